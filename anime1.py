@@ -1,34 +1,115 @@
 import os
 import re
 import time
+import argparse
 import getpass
+import atexit
 import logging
 import threading
-import requests
 import configparser
-import tkinter as tk
-from tkinter import messagebox, simpledialog
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import _tkinter
 
 # Custom imports
-from helper.tk_helper import tkHelper, DownloadProgressBar
+from helper.lazy_import import lazy_import
 from helper.anime1_fetch import DownloadHelper
 
+# Heavy modules are only imported once the UI or network is actually used
+tk = lazy_import("tkinter")
+messagebox = lazy_import("tkinter.messagebox")
+simpledialog = lazy_import("tkinter.simpledialog")
+_tkinter = lazy_import("_tkinter")
+requests = lazy_import("requests")
+tk_helper = lazy_import("helper.tk_helper")
+
 __version__ = "0.0.1"
 
 CONFIG_PATH = "config.ini"
 LOG_DIR = "logs"
+PROGRESS_LOG_INTERVAL = 10  # seconds between two throughput/ETA log lines of a batch
+LOG_BACKUPS = 2  # rotated files kept of a log file that reached log_max_mb
 
 CONFIG_DEFAULT = {
     "APP": {
         "download_path": f"C:/Users/{getpass.getuser()}/Downloads",
         "max_workers": 4,
+        "hls_workers": 4,
+        # Processes a batch is sharded over (max_workers transfers each), 1 for a single process
+        "processes": 1,
+        # Reuse files already under download_path instead of downloading them again.
+        # A file counts as identical when its size and its first and last MB match:
+        # two encodes differing only in between would be taken for the same video
+        "dedupe": "no",
+        # fsync downloads every 64 MB: less lost on a power failure, a bit slower
+        "sync_writes": "no",
+        # Multiplex API calls and series pages over HTTP/2 (needs `pip install httpx[http2]`)
+        "http2": "no",
+        # Combined download rate cap in MB/s, 0 for none. This, max_workers and
+        # hls_workers are also applied to a running batch when the file is saved
+        "bandwidth_limit": 0,
+        # Seconds a resolved host address is reused, 0 to resolve on every connection
+        "dns_ttl": 300,
+        # Local source addresses and HTTP/SOCKS proxy URLs transfers are spread over,
+        # e.g. "192.168.1.10, 192.168.1.11, socks5://127.0.0.1:1080" (empty: default route)
+        "egress": "",
+        # Failed answers (403 or 5xx) in a row after which new work to a host waits,
+        # 0 to never wait, and the seconds before a single request probes it again
+        "circuit_failures": 5,
+        "circuit_cooldown": 30,
+    },
+    # Per-host "max connections, requests per second" used by the mirror mode,
+    # "*" applies to every other host (video hosts)
+    "LIMITS": {
+        "anime1.me": "2, 1",
+        "v.anime1.me": "4, 2",
+        "*": "4, 5",
+    },
+    "WATCH": {
+        # One category URL per line
+        "series": "",
+        "poll_interval": 1800,
+    },
+    # Coordinator address for --coordinate (use 0.0.0.0 to accept workers on other
+    # hosts, together with a token), seconds a worker keeps an episode without
+    # reporting progress, and the shared token coordinator and workers must send
+    "DISTRIBUTED": {
+        "listen": "127.0.0.1:8611",
+        "lease_time": 60,
+        "token": "",
+    },
+    # Address of the local control API for --serve, and the token its clients must
+    # send (needed when listening beyond 127.0.0.1)
+    "CONTROL": {
+        "listen": "127.0.0.1:8612",
+        "token": "",
+    },
+    # Address of the local endpoint a player streams the "play next" episode from
+    # while it downloads
+    "STREAM": {
+        "listen": "127.0.0.1:8613",
+    },
+    # Where episodes are stored: "local" (download_path) or "s3" to upload them to
+    # an S3-compatible bucket while they download, without a local copy. endpoint
+    # is e.g. https://s3.eu-west-1.amazonaws.com or http://127.0.0.1:9000 (MinIO),
+    # object keys are prefix/<series>/<episode>; empty keys are read from the
+    # AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables
+    "STORAGE": {
+        "sink": "local",
+        "endpoint": "",
+        "bucket": "",
+        "prefix": "",
+        "region": "us-east-1",
+        "access_key": "",
+        "secret_key": "",
+        # Parts (8 MB each) uploaded at once
+        "upload_workers": 4,
     },
     # "DEBUG": {
     #     "log_level": "INFO",
     #     "log_file_level": "DEBUG",
-    #     "log_file": "%%DATETIME%%.log"
+    #     "log_file": "%%DATETIME%%.log",
+    #     # Size at which the log file is rotated (two rotated files are kept), in MB
+    #     "log_max_mb": 10,
+    #     # Debug records of one message passed per second, 0 for no limit
+    #     "log_rate_limit": 10
     # }
 }
 
@@ -39,6 +120,7 @@ def init_config() -> configparser.ConfigParser:
     This function reads the configuration from a file specified by CONFIG_PATH.
     If the file exists, it updates any missing keys with default values from CONFIG_DEFAULT.
     If the file does not exist or an error occurs while reading it, the function uses the default configuration.
+    The file is only written back when defaults were actually added.
     Returns:
         configparser.ConfigParser: The loaded configuration object.
     """
@@ -46,13 +128,19 @@ def init_config() -> configparser.ConfigParser:
     if os.path.exists(CONFIG_PATH):
         try:
             config.read(CONFIG_PATH)
+            changed = False
             for key in CONFIG_DEFAULT:
+                if not config.has_section(key):
+                    config.add_section(key)
+                    changed = True
                 for k, v in CONFIG_DEFAULT[key].items():
                     if k not in config[key]:
-                        config[key][k] = v
+                        config[key][k] = str(v)
+                        changed = True
 
-            with open(CONFIG_PATH, "w") as config_file:
-                config.write(config_file)
+            if changed:
+                with open(CONFIG_PATH, "w") as config_file:
+                    config.write(config_file)
             return config
         except Exception as e:
             logging.error(
@@ -68,19 +156,80 @@ def init_config() -> configparser.ConfigParser:
     return config
 
 
+def save_config(config: configparser.ConfigParser) -> None:
+    """
+    Writes the configuration back to CONFIG_PATH.
+    """
+    with open(CONFIG_PATH, "w") as config_file:
+        config.write(config_file)
+
+
+def rotate_logs(log_dir: str = LOG_DIR, keep: int = 4) -> None:
+    """
+    Removes old log files so that the files of at most `keep` runs remain before a
+    new one is created. Log files are named after their start time, so sorting by
+    name is enough and no per-file stat call is needed; the rotated files of a run
+    (`.log.1`, `.log.2`) go with it.
+    Args:
+        log_dir (str): The log directory.
+        keep (int): The number of old runs to keep the logs of.
+    """
+    try:
+        with os.scandir(log_dir) as entries:
+            log_files = [
+                entry.name
+                for entry in entries
+                if entry.name.startswith("app_log_") and ".log" in entry.name
+            ]
+    except FileNotFoundError:
+        os.makedirs(log_dir)
+        return
+
+    runs = sorted({file.split(".log")[0] for file in log_files})
+    old_runs = set(runs[:-keep]) if len(runs) > keep else set()
+    for file in log_files:
+        if file.split(".log")[0] not in old_runs:
+            continue
+        try:
+            os.remove(os.path.join(log_dir, file))
+        except OSError:
+            pass
+
+
 class Anime1_downloader:
     def __init__(self) -> None:
+        init_start = time.perf_counter()
         self.stop_flag = threading.Event()
 
         self.config = init_config()
         self.download_path: str = self.config["APP"]["download_path"]
         self.max_workers = int(self.config["APP"]["max_workers"])
+        self.hls_workers = int(self.config["APP"]["hls_workers"])
+        self.processes = int(self.config["APP"]["processes"])
+        self.dedupe = self.config.getboolean("APP", "dedupe", fallback=False)
+        self.sync_writes = self.config.getboolean("APP", "sync_writes", fallback=False)
+        self.http2 = self.config.getboolean("APP", "http2", fallback=False)
+        self.bandwidth_limit = self.config.getfloat("APP", "bandwidth_limit", fallback=0)
+        self.dns_ttl = self.config.getfloat("APP", "dns_ttl", fallback=300)
+        self.egress_text = self.config.get("APP", "egress", fallback="")
+        self.circuit_failures = self.config.getint("APP", "circuit_failures", fallback=5)
+        self.circuit_cooldown = self.config.getfloat("APP", "circuit_cooldown", fallback=30)
+        self.storage = dict(self.config["STORAGE"]) if self.config.has_section("STORAGE") else {}
 
         self.logger = logging.getLogger(__name__)
         self.init_logging()
 
+        self.egress = []
+        if self.egress_text.strip():
+            from helper.egress import parse_members
+
+            self.egress = parse_members(self.egress_text, self.logger)
+
         self.download_helper: DownloadHelper
-        self.tkHelper = tkHelper(self.logger)
+        self.tkHelper = None
+
+        self.startup_time = time.perf_counter() - init_start
+        self.logger.debug(f"Startup took {self.startup_time * 1000:.1f} ms")
 
     def init_logging(self) -> None:
         """
@@ -103,17 +252,7 @@ class Anime1_downloader:
             )
 
         if log_file:
-            log_files = []
-            if not os.path.exists(LOG_DIR):
-                os.makedirs(LOG_DIR)
-            else:
-                for file in os.listdir(LOG_DIR):
-                    if re.match(r"app_log_.*\.log$", file):
-                        log_files.append(os.path.join(LOG_DIR, file))
-            log_files.sort(key=os.path.getctime)
-            if len(log_files) >= 5:
-                for file in log_files[:-4]:
-                    os.remove(file)
+            rotate_logs()
             log_file = os.path.join(os.getcwd(), f"{LOG_DIR}/app_log_{log_file}")
 
         formatter = logging.Formatter(
@@ -121,16 +260,37 @@ class Anime1_downloader:
             datefmt="%H:%M:%S",
         )
 
+        handlers = []
         if log_level:
             console_handler = logging.StreamHandler()
             console_handler.setLevel(log_level_int)
             console_handler.setFormatter(formatter)
-            self.logger.addHandler(console_handler)
+            handlers.append(console_handler)
         if log_file_level:
-            file_handler = logging.FileHandler(log_file, mode="w", encoding="utf-8")
+            from logging.handlers import RotatingFileHandler
+
+            log_max_mb = self.config.getfloat("DEBUG", "log_max_mb", fallback=10)
+            # RotatingFileHandler always appends, start the file over like before
+            open(log_file, "w").close()
+            file_handler = RotatingFileHandler(
+                log_file,
+                maxBytes=int(log_max_mb * 1024 * 1024),
+                backupCount=LOG_BACKUPS,
+                encoding="utf-8",
+            )
             file_handler.setLevel(log_level_file_int)
             file_handler.setFormatter(formatter)
-            self.logger.addHandler(file_handler)
+            handlers.append(file_handler)
+
+        if handlers:
+            # Records are written by a background thread, see LogPipeline
+            from helper.log_pipeline import LogPipeline, RateLimitFilter
+
+            rate_limit = self.config.getint("DEBUG", "log_rate_limit", fallback=10)
+            self.log_pipeline = LogPipeline.install(
+                self.logger, handlers, RateLimitFilter(burst=rate_limit) if rate_limit > 0 else None
+            )
+            atexit.register(self.log_pipeline.stop)
 
         self.logger.info(f"Anime1 downloader {__version__}")
         self.logger.info(f"PID: {os.getpid()}")
@@ -144,11 +304,159 @@ class Anime1_downloader:
             self.logger.debug(f"Config Path: {CONFIG_PATH}")
             self.logger.debug(f"Download Path: {self.download_path}")
             self.logger.debug(f"Max Workers: {self.max_workers}")
+            self.logger.debug(f"HLS Workers: {self.hls_workers}")
             self.logger.debug(f"{' Log detail: ':=^50}")
             self.logger.debug(f"Log level: {log_level}")
             self.logger.debug(f"Log file: {log_file}")
             self.logger.debug("=" * 50)
 
+    def create_download_helper(self, adapter=None) -> DownloadHelper:
+        """
+        Creates the download helper configured from the config file.
+        Args:
+            adapter: Optional transport adapter shared by all sessions of the helper.
+        """
+        content_index = None
+        # Only files under download_path can be reused
+        if self.dedupe and self.storage.get("sink", "local") == "local":
+            from helper.content_index import ContentIndex
+
+            content_index = ContentIndex(self.download_path, logger=self.logger)
+        return DownloadHelper(
+            self.download_path,
+            self.logger,
+            hls_workers=self.hls_workers,
+            adapter=adapter,
+            content_index=content_index,
+            sync_writes=self.sync_writes,
+            http2=self.http2,
+            bandwidth_limit=self.bandwidth_limit * 1024 * 1024,
+            dns_ttl=self.dns_ttl,
+            egress=self.egress,
+            circuit_failures=self.circuit_failures,
+            circuit_cooldown=self.circuit_cooldown,
+            storage=self.storage,
+        )
+
+    def create_sharded_downloader(self):
+        """
+        Creates the multi-process downloader used when `processes` is above 1.
+        Returns:
+            ShardedDownloader | None: None when batches run in this process.
+        """
+        if self.processes <= 1:
+            return None
+        from helper.sharding import ShardedDownloader
+
+        if self.dedupe:
+            # Shards would rewrite one index cache each with its own entries
+            self.logger.warning("dedupe is not supported with processes above 1, it is disabled")
+
+        return ShardedDownloader(
+            self.download_path,
+            processes=self.processes,
+            max_workers=self.max_workers,
+            hls_workers=self.hls_workers,
+            sync_writes=self.sync_writes,
+            http2=self.http2,
+            bandwidth_limit=self.bandwidth_limit * 1024 * 1024,
+            dns_ttl=self.dns_ttl,
+            egress=self.egress,
+            circuit_failures=self.circuit_failures,
+            circuit_cooldown=self.circuit_cooldown,
+            storage=self.storage,
+            logger=self.logger,
+        )
+
+    def apply_settings(self, values: dict) -> None:
+        """
+        Applies [APP] settings to the running batch: max_workers grows or shrinks
+        the active transfers, hls_workers changes the segments fetched at once per
+        episode and bandwidth_limit (MB/s) the combined rate cap. Episodes already
+        downloading keep going. Invalid values are logged and ignored.
+        Args:
+            values (dict): Setting name to value (str or number), see LIVE_KEYS.
+        """
+        helper = getattr(self, "download_helper", None)
+        try:
+            if "max_workers" in values:
+                self.max_workers = max(int(values["max_workers"]), 1)
+                batch = getattr(self, "batch", None)
+                if batch is not None:
+                    batch.set_workers(self.max_workers)
+            if "hls_workers" in values:
+                self.hls_workers = max(int(values["hls_workers"]), 1)
+                if helper is not None:
+                    helper.set_hls_workers(self.hls_workers)
+            if "bandwidth_limit" in values:
+                self.bandwidth_limit = max(float(values["bandwidth_limit"]), 0)
+                if helper is not None:
+                    helper.set_bandwidth_limit(self.bandwidth_limit * 1024 * 1024)
+                self.logger.info(
+                    f"Bandwidth limit: {self.bandwidth_limit:g} MB/s" if self.bandwidth_limit else "Bandwidth limit: none"
+                )
+        except ValueError as e:
+            self.logger.error(f"Ignoring invalid setting in {values}: {e}")
+
+    def watch_config(self):
+        """
+        Starts applying changes of config.ini to the running batch (see apply_settings).
+        Returns:
+            ConfigWatcher: The running watcher, to be stopped when the batch ends.
+        """
+        from helper.live_config import ConfigWatcher
+
+        watcher = ConfigWatcher(CONFIG_PATH, self.apply_settings, logger=self.logger)
+        watcher.start()
+        return watcher
+
+    def plan_batch(self, download_helper: DownloadHelper, data: dict, names: list):
+        """
+        Probes the sizes of a batch, checks the free disk space against them and
+        orders the episodes largest first, so the batch does not end on one long
+        transfer while the other workers sit idle.
+        Returns:
+            list | None: The episodes in download order, None when the disk is too small.
+        """
+        from helper.scheduling import check_disk_space, lpt_order, probe_sizes, remaining_sizes
+
+        sizes = probe_sizes(download_helper, data, names, self.max_workers, self.stop_flag, self.logger)
+        self.batch_sizes = sizes
+        remaining = remaining_sizes(download_helper, data, sizes)
+        needed = sum(size for size in remaining.values() if size > 0)
+        unknown = sum(1 for size in remaining.values() if size < 0)
+        if download_helper.storage.remote:
+            # Uploaded as they arrive, nothing stays on this disk
+            self.logger.info(f"{len(names)} episodes, {needed / 2**30:.2f} GB to upload ({unknown} of unknown size)")
+            return lpt_order(names, sizes)
+        enough, free = check_disk_space(self.download_path, needed)
+        if not enough:
+            self.logger.error(
+                f"Not enough disk space under {self.download_path}: "
+                f"{needed / 2**30:.2f} GB needed, {free / 2**30:.2f} GB free"
+            )
+            return None
+        self.logger.info(
+            f"{len(names)} episodes, {needed / 2**30:.2f} GB to download "
+            f"({unknown} of unknown size), {free / 2**30:.2f} GB free"
+        )
+        return lpt_order(names, sizes)
+
+    def log_progress(self, progress, estimator, done: threading.Event) -> None:
+        """
+        Logs the throughput and ETA of a batch every PROGRESS_LOG_INTERVAL seconds
+        (and of every active episode at debug level) until `done` is set.
+        """
+        from helper.eta import format_eta, format_rate
+
+        while not done.wait(PROGRESS_LOG_INTERVAL):
+            process = progress.process
+            estimator.update(process, dropped=progress.dropped)
+            self.logger.info(estimator.summary())
+            for name in list(estimator.episodes):
+                rate, eta = estimator.episode_eta(name, process)
+                self.logger.debug(f"{str(name):>3} | {format_rate(rate)}, ETA {format_eta(eta)}")
+
     def start(self, restart: bool = False) -> int:
         """
         Starts the application by initializing it.
@@ -156,9 +464,10 @@ class Anime1_downloader:
         Returns:
             int: The status code returned by the initialization process.
         """
-        self.download_helper = DownloadHelper(self.download_path, self.logger)
+        self.download_helper = self.create_download_helper()
 
         if not restart:
+            self.tkHelper = tk_helper.tkHelper(self.logger)
             self.root = tk.Tk()
 
         self.root.protocol("WM_DELETE_WINDOW", lambda: self.exit_app(0))
@@ -181,7 +490,7 @@ class Anime1_downloader:
         """
         self.root.title("Anime1 Downloader")
         self.root.configure(bg="black")
-        tkHelper.center_window(self.root, 600, 400)
+        tk_helper.tkHelper.center_window(self.root, 600, 400)
 
         url_label = tk.Label(
             self.root,
@@ -315,7 +624,7 @@ class Anime1_downloader:
                             if choice:
                                 data["title"] = data_temp["title"]
                             else:
-                                custom_title = tk.simpledialog.askstring(
+                                custom_title = simpledialog.askstring(
                                     "Custom Title",
                                     "Enter the custom title:",
                                 )
@@ -360,7 +669,7 @@ class Anime1_downloader:
                 url_text.config(state=tk.NORMAL)
                 return
 
-            tkHelper.clear_window(self.root)
+            tk_helper.tkHelper.clear_window(self.root)
             self.selected_episodes_ui(data)
 
         submit_button = tk.Button(
@@ -414,7 +723,7 @@ class Anime1_downloader:
             download_button.config(text=f"Download ({len(selected_episodes)})")
 
         self.root.title(f"Anime1 Downloader {data['title']}")
-        tkHelper.center_window(self.root, 500, 600)
+        tk_helper.tkHelper.center_window(self.root, 500, 600)
 
         frame = tk.Frame(self.root, bg="black")
         frame.pack(pady=20)
@@ -500,6 +809,19 @@ class Anime1_downloader:
         )
         self.root.bind("<Control-a>", lambda e: select_all())
 
+        # Connections are opened while the episodes are being chosen
+        threading.Thread(target=self.warm_up, args=(data,), name="warm-up", daemon=True).start()
+
+    def warm_up(self, data) -> None:
+        """
+        Opens the connections of the coming batch ahead of it, see DownloadHelper.warm_up.
+        """
+        try:
+            self.download_helper.warm_up(data, self.max_workers)
+        except Exception as e:
+            # Only costs the batch its head start
+            self.logger.debug(f"Warm-up failed: {e}")
+
     def download_ui(self, data, eps) -> None:
         """
         Sets up and displays the download user interface.
@@ -512,9 +834,9 @@ class Anime1_downloader:
         - A percentage label to show the download percentage.
         The window is centered and configured with a black background.
         """
-        tkHelper.clear_window(self.root)
+        tk_helper.tkHelper.clear_window(self.root)
         self.root.configure(bg="black")
-        tkHelper.center_window(self.root, 500, 600)
+        tk_helper.tkHelper.center_window(self.root, 500, 600)
         self.root.title(f"Downloading {data['title']} {0}/{len(eps)} Episodes")
 
         title = tk.Label(
@@ -542,21 +864,127 @@ class Anime1_downloader:
             else:
                 ep_id = episode
 
-            self.ep_processbar_dict[episode] = DownloadProgressBar(
+            self.ep_processbar_dict[episode] = tk_helper.DownloadProgressBar(
                 ep_processbar, 100, f"{ep_id}", vertical=True
             )
             self.ep_processbar_dict[episode].frame.pack(side=tk.LEFT, padx=3)
             self.ep_processbar_dict[episode].config(bg="black", fg="white")
+            self.ep_processbar_dict[episode].label.bind(
+                "<Button-3>", lambda e, episode=episode: self.episode_menu(e, episode)
+            )
 
-        self.root.progress_bar = DownloadProgressBar(
+        self.root.progress_bar = tk_helper.DownloadProgressBar(
             self.root, len(eps), f"Downloading Episodes (0/{len(eps)})"
         )
         self.root.progress_bar.frame.pack(pady=20)
         self.root.progress_bar.config(bg="black", fg="white")
 
+        # Applied to the running batch and saved to config.ini (see save_settings)
+        from helper.hls import MAX_WINDOW
+
+        settings = tk.Frame(self.root, bg="black")
+        settings.pack(pady=10)
+        self.settings_vars = {}
+        for key, text, value, high, increment in (
+            ("max_workers", "Episodes", self.max_workers, 32, 1),
+            ("hls_workers", "Segments", self.hls_workers, MAX_WINDOW, 1),
+            ("bandwidth_limit", "MB/s (0: no limit)", f"{self.bandwidth_limit:g}", 1000, 0.5),
+        ):
+            tk.Label(settings, text=text, bg="black", fg="white").pack(side=tk.LEFT, padx=(6, 2))
+            var = tk.StringVar()
+            tk.Spinbox(
+                settings, from_=0 if key == "bandwidth_limit" else 1, to=high, increment=increment,
+                textvariable=var, width=5,
+            ).pack(side=tk.LEFT)
+            # Set after the Spinbox, which resets its variable to `from_`
+            var.set(str(value))
+            self.settings_vars[key] = var
+        tk.Button(
+            settings, text="Apply", command=self.save_settings, bg="blue", fg="white"
+        ).pack(side=tk.LEFT, padx=6)
+
         self.root.progress_bar.process_queue()
         self.root.update()
 
+    def save_settings(self) -> None:
+        """
+        Saves the settings entered in the download window to config.ini and applies
+        them to the running batch.
+        """
+        values = {key: var.get().strip() for key, var in self.settings_vars.items()}
+        try:
+            if int(values["max_workers"]) < 1 or int(values["hls_workers"]) < 1 or float(values["bandwidth_limit"]) < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Episodes and segments must be whole numbers above 0, MB/s 0 or more.")
+            return
+        for key, value in values.items():
+            self.config["APP"][key] = value
+        save_config(self.config)
+        watcher = getattr(self, "config_watcher", None)
+        if watcher is not None:
+            # The watcher applies what changed, and will not apply it again
+            watcher.check()
+        else:
+            self.apply_settings(values)
+
+    def episode_menu(self, event, episode) -> None:
+        """
+        Shows the Pause / Resume / Cancel menu of an episode of the running batch.
+        """
+        batch = getattr(self, "batch", None)
+        if batch is None:
+            return
+        menu = tk.Menu(self.root, tearoff=0)
+        menu.add_command(label="Pause", command=lambda: batch.pause(episode))
+        menu.add_command(label="Resume", command=lambda: batch.resume(episode))
+        menu.add_command(label="Cancel", command=lambda: batch.cancel(episode))
+        menu.add_command(label="Play next", command=lambda: self.play_next_ui(episode))
+        menu.tk_popup(event.x_root, event.y_root)
+
+    def play_next_ui(self, episode) -> None:
+        """
+        Plays an episode next and puts its streaming URL on the clipboard.
+        """
+        url = self.play_next(episode)
+        if url is None:
+            return
+        self.root.clipboard_clear()
+        self.root.clipboard_append(url)
+        self.root.progress_bar.label.config(text=f"Stream URL copied: {url}")
+
+    def play_next(self, episode):
+        """
+        Downloads an episode of the running batch before the others, with most of
+        the bandwidth, and serves it to players while it downloads.
+        Returns:
+            str | None: The URL to stream it from, None if it is not in the batch.
+        """
+        batch = getattr(self, "batch", None)
+        if batch is None or not batch.play_next(episode):
+            return None
+        if self.download_helper.storage.remote:
+            self.logger.warning(f"{episode} downloads next, but it is uploaded as it arrives and cannot be streamed")
+            return None
+        url = self.stream_url(episode)
+        self.logger.info(f"{episode} can be played from {url}")
+        return url
+
+    def stream_url(self, episode) -> str:
+        """
+        Returns the URL of an episode on the local streaming endpoint, which is
+        started on first use.
+        """
+        server = getattr(self, "stream_server", None)
+        if server is None:
+            from helper.stream import StreamServer
+
+            host, _, port = self.config["STREAM"]["listen"].rpartition(":")
+            server = StreamServer(self.download_helper, logger=self.logger)
+            server.serve(host or "127.0.0.1", int(port))
+            self.stream_server = server
+        return server.url(episode)
+
     def update_progress(self, downloaded_size, total_size) -> None:
         """
         Updates the progress bar and labels with the current download progress.
@@ -586,65 +1014,73 @@ class Anime1_downloader:
         Returns:
             None
         This method initializes the download UI, logs the start of the download process,
-        and creates a thread to handle the download tasks. It uses a ThreadPoolExecutor
-        to download episodes concurrently. The progress of each episode is updated in the UI,
+        and creates a thread to handle the download tasks. It uses an EpisodeBatch
+        to download episodes concurrently; right-clicking an episode pauses, resumes
+        or cancels it. The progress of each episode is updated in the UI,
         and the method handles stopping the download process if a stop flag is set.
         """
+        from helper.batch import CANCELLED, PAUSED, EpisodeBatch
+        from helper.eta import ThroughputEstimator, format_eta, format_rate
+
+        self.batch = None
         self.download_ui(data, eps)
         self.logger.debug("Starting download of %s episodes", len(eps))
         start_time = time.time()
 
         self.download_helper.total_eps = len(eps)
+        # Progress is read from the helper, or from shared memory when sharded
+        sharded = self.create_sharded_downloader()
+        progress = sharded or self.download_helper
+        estimator = ThroughputEstimator(eps)
+        batch_done = threading.Event()
+        self.config_watcher = self.watch_config()
 
-        def download_task():
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = []
-                for episode in eps:
-                    # Init so it can be preload detail and check existed file
-                    self.download_helper.process[episode] = {
-                        "total_size": -1,
-                        "downloaded_size": 0,
-                    }
-                    if self.stop_flag.is_set():
-                        self.logger.debug("Download stopped")
-                        return
-                    futures.append(
-                        executor.submit(
-                            self.download_helper.download_episode,
-                            episode,
-                            data,
-                        )
-                    )
+        batch_error = []
 
-                downloaded_ep = 0
-                for future in as_completed(futures):
-                    if self.stop_flag.is_set():
-                        self.logger.debug("Download stopped")
-                        for f in futures:
-                            f.cancel()
-                        return
-                    try:
-                        future.result()
-                        downloaded_ep += 1
-                        self.root.title(
-                            f"Downloading {data['title']} {downloaded_ep}/{len(eps)} Episodes"
-                        )
-                    except Exception as e:
-                        self.logger.error(f"Error downloading episode: {e}")
+        def download_task():
+            ordered = self.plan_batch(self.download_helper, data, eps)
+            if ordered is None:
+                batch_error.append("Not enough disk space for these episodes.")
+                return
+            estimator.sizes = self.batch_sizes
+            if sharded is not None:
+                # Shards resolve their episodes again in their own sessions
+                self.download_helper.prepared.clear()
+                sharded.run(data, ordered, self.stop_flag)
+                return
+            for episode in ordered:
+                # Init so it can be preload detail and check existed file
+                self.download_helper.process[episode] = {
+                    "total_size": -1,
+                    "downloaded_size": 0,
+                }
+            self.batch = EpisodeBatch(
+                self.download_helper, data, ordered, self.max_workers, logger=self.logger
+            )
+            self.batch.run(self.stop_flag)
 
         self.download_thread = threading.Thread(target=download_task, daemon=True)
         self.download_thread.start()
+        threading.Thread(target=self.log_progress, args=(progress, estimator, batch_done), daemon=True).start()
 
+        detail = ""
         while self.download_thread.is_alive() and not self.stop_flag.is_set():
             try:
+                process = progress.process
+                if estimator.update(process, dropped=progress.dropped):
+                    detail = f"{format_rate(estimator.rate)}  ETA {format_eta(estimator.eta)}"
                 self.root.progress_bar.set_progress(
-                    self.download_helper.downloaded_size,
-                    self.download_helper.total_size,
+                    progress.downloaded_size,
+                    progress.total_size,
+                    detail,
                 )
 
+                batch = self.batch
                 for episode in eps:
-                    ep_state = self.download_helper.process.get(episode)
-                    if ep_state:
+                    ep_state = process.get(episode)
+                    if batch is not None and batch.state(episode) in (PAUSED, CANCELLED):
+                        self.ep_processbar_dict[episode].label.config(bg="gray", fg="white")
+                    elif ep_state:
                         if ep_state.get("success", None) is not None:
                             if ep_state["success"]:
                                 self.ep_processbar_dict[episode].label.config(
@@ -675,8 +1111,9 @@ class Anime1_downloader:
 
                 self.root.update()
                 self.root.progress_bar.label.config(
-                    text=f"Downloading Episodes ({self.download_helper.finished}/{self.download_helper.total_eps})"
+                    text=f"Downloading Episodes ({progress.finished}/{progress.total_eps})"
                 )
+                self.root.title(f"Downloading {data['title']} {progress.finished}/{len(eps)} Episodes")
             except _tkinter.TclError:
                 break
             except Exception as e:
@@ -684,7 +1121,13 @@ class Anime1_downloader:
 
             finally:
                 time.sleep(0.1)
+        batch_done.set()
+        self.config_watcher.stop()
+        self.config_watcher = None
         self.logger.info(f"Time taken: {time.time() - start_time:.2f} seconds")
+        self.log_stall_summary()
+        if batch_error:
+            messagebox.showerror("Error", batch_error[0])
         self.download_complete(data["title"])
 
     def download_complete(self, title=None) -> None:
@@ -698,7 +1141,7 @@ class Anime1_downloader:
         and fonts, and are packed into the frame with padding.
         """
 
-        tkHelper.clear_window(self.root)
+        tk_helper.tkHelper.clear_window(self.root)
         # for episode in self.ep_processbar_dict:
         #     self.ep_processbar_dict[episode].frame.destroy()
         # self.root.frame.destroy()
@@ -751,20 +1194,341 @@ class Anime1_downloader:
 
         exit_button.bind("<Return>", lambda e: self.restart_app())
 
+    def log_stall_summary(self) -> None:
+        """
+        Logs how many transfers stalled, how much time hedging recovered, how long
+        the episodes waited for their first byte, the traffic of each egress and
+        the hosts whose circuit opened.
+        """
+        helper = getattr(self, "download_helper", None)
+        if helper is None:
+            return
+        egress = helper.egress_pool.summary() if helper.egress else ""
+        for summary in (helper.watchdog.summary(), helper.ttfb_summary(), egress, helper.health.summary()):
+            if summary:
+                self.logger.info(summary)
+
+    def load_catalog(self, update: bool = True):
+        """
+        Loads the local catalog index, refreshing it from the site when it is stale.
+        Returns:
+            CatalogIndex: The loaded index.
+        """
+        from helper.catalog import CatalogIndex
+
+        catalog = getattr(self, "catalog", None)
+        if catalog is None:
+            catalog = CatalogIndex(logger=self.logger)
+            catalog.load()
+            self.catalog = catalog
+        if update:
+            try:
+                catalog.update()
+            except requests.RequestException as e:
+                self.logger.error(f"Failed to update the catalog: {e}")
+        return catalog
+
+    def resolve_search(self, search: str, fuzzy: bool = True, limit: int = 20) -> list:
+        """
+        Resolves a search to category URLs: an anime1 URL is used as is, anything
+        else is looked up in the catalog index.
+        Args:
+            search (str): A category URL or a title.
+            fuzzy (bool): Also return fuzzy matches, otherwise only titles starting
+                with the search (after normalization).
+            limit (int | None): The most entries returned; None for every prefix match.
+        Returns:
+            list: The matching catalog entries (dicts with at least "title" and "url").
+        """
+        if re.match(r"https?://anime1\.(?:me|pw)", search):
+            return [{"title": search, "url": search.split("/page")[0]}]
+        catalog = self.load_catalog()
+        return catalog.search(search, limit) if fuzzy else catalog.prefix(search, limit)
+
+    def download_headless(self, data: dict, names: list) -> int:
+        """
+        Downloads the given episodes of a series without the UI.
+        Returns:
+            int: The number of episodes downloaded successfully.
+        """
+        from helper.batch import EpisodeBatch
+        from helper.eta import ThroughputEstimator
+
+        if getattr(self, "download_helper", None) is None:
+            self.download_helper = self.create_download_helper()
+        names = self.plan_batch(self.download_helper, data, names)
+        if names is None:
+            return 0
+
+        sharded = self.create_sharded_downloader()
+        progress = sharded or self.download_helper
+        batch_done = threading.Event()
+        estimator = ThroughputEstimator(names, self.batch_sizes)
+        threading.Thread(target=self.log_progress, args=(progress, estimator, batch_done), daemon=True).start()
+        watcher = self.watch_config()
+        try:
+            if sharded is not None:
+                # Shards resolve their episodes again in their own sessions
+                self.download_helper.prepared.clear()
+                return sharded.run(data, names, self.stop_flag)
+
+            self.download_helper.total_eps += len(names)
+            self.batch = EpisodeBatch(
+                self.download_helper, data, names, self.max_workers, logger=self.logger
+            )
+            return self.batch.run(self.stop_flag)
+        finally:
+            watcher.stop()
+            batch_done.set()
+            self.log_stall_summary()
+
     def download_search(self, search):
-        pass
+        """
+        Looks up a title in the catalog index.
+        Returns:
+            list: The matching catalog entries, best first.
+        """
+        results = self.resolve_search(search)
+        for entry in results:
+            self.logger.debug(f"{entry['title']} ({entry.get('count', '?')} EPs): {entry['url']}")
+        return results
 
     def download_search_range(self, search, start, end):
-        pass
+        """
+        Downloads episodes `start` to `end` (1-based, inclusive) of the best match.
+        """
+        data = self.resolve_series(search)
+        if data is None:
+            return 0
+        return self.download_headless(data, data["names"][max(start - 1, 0) : end])
+
+    def resolve_series(self, search: str):
+        """
+        Fetches the series of the best match of a search (or a category URL).
+        Returns:
+            dict | None: See DownloadHelper.get_series_data, None when nothing matches.
+        """
+        results = self.resolve_search(search)
+        if not results:
+            self.logger.error(f"No series found for {search}")
+            return None
+        return DownloadHelper(self.download_path, self.logger, http2=self.http2).get_series_data(results[0]["url"])
+
+    def init_watcher(self):
+        """
+        Creates the series watcher for the followed series in the config.
+        Returns:
+            SeriesWatcher: The watcher, sharing the download helper of the app.
+        """
+        from helper.watch import SeriesWatcher
+
+        if getattr(self, "download_helper", None) is None:
+            self.download_helper = self.create_download_helper()
+        watcher = SeriesWatcher(
+            self.download_helper,
+            interval=int(self.config["WATCH"]["poll_interval"]),
+            max_workers=self.max_workers,
+            logger=self.logger,
+        )
+        # The config is the source of truth, series removed from it are unfollowed
+        watcher.retain(self.followed_series())
+        for url in self.followed_series():
+            watcher.follow(url)
+        return watcher
+
+    def followed_series(self) -> list:
+        return [url.strip() for url in self.config["WATCH"]["series"].splitlines() if url.strip()]
+
+    def follow(self, url: str) -> None:
+        """
+        Adds a series to the followed series in the config.
+        """
+        followed = self.followed_series()
+        if url not in followed:
+            followed.append(url)
+            self.config["WATCH"]["series"] = "\n".join(followed)
+            save_config(self.config)
+            self.logger.info(f"Following {url}")
+
+    def watch(self) -> None:
+        """
+        Runs the watch mode until interrupted: followed series are polled on their own
+        schedule and newly aired episodes are downloaded.
+        """
+        watcher = self.init_watcher()
+        try:
+            watcher.run(self.stop_flag)
+        except KeyboardInterrupt:
+            self.logger.info("Watch mode stopped")
+        finally:
+            self.stop_flag.set()
+            self.download_helper.download_stop = True
+            watcher.save_state()
+            self.log_stall_summary()
+
+    def mirror(self, source: str) -> None:
+        """
+        Mirrors many series under per-host limits until everything is downloaded.
+        Args:
+            source (str): A file with one category URL per line, or a catalog search.
+        """
+        from helper.mirror import Mirror
+        from helper.politeness import HostLimiter, PoliteAdapter, parse_rules
+
+        urls = self.read_series_source(source)
+
+        rules = parse_rules(self.config["LIMITS"].items(), self.logger)
+        adapter = PoliteAdapter(HostLimiter(rules), pool_maxsize=self.max_workers * 2)
+        self.download_helper = self.create_download_helper(adapter)
+
+        mirror = Mirror(self.download_helper, max_workers=self.max_workers, logger=self.logger)
+        try:
+            mirror.run(urls, self.stop_flag)
+        except KeyboardInterrupt:
+            self.logger.info("Mirror stopped")
+        finally:
+            self.stop_flag.set()
+            self.download_helper.download_stop = True
+            mirror.save_checkpoint()
+            self.log_stall_summary()
+
+    def read_series_source(self, source: str) -> list:
+        """
+        Returns the category URLs listed in a file (one per line), or matching a search.
+        """
+        if os.path.isfile(source):
+            with open(source, "r", encoding="utf-8") as f:
+                return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        return [entry["url"] for entry in self.resolve_search(source)]
+
+    def coordinate(self, source: str, listen: str = None) -> None:
+        """
+        Runs a coordinator that hands the episodes of many series out to workers
+        (see --worker), until every episode is done or it is interrupted.
+        Args:
+            source (str): A file with one category URL per line, or a catalog search.
+            listen (str): "host:port" to listen on, defaults to the config.
+        """
+        from helper.distributed import Coordinator
+
+        host, _, port = (listen or self.config["DISTRIBUTED"]["listen"]).rpartition(":")
+        self.download_helper = self.create_download_helper()
+        coordinator = Coordinator(
+            self.download_helper,
+            lease_time=int(self.config["DISTRIBUTED"]["lease_time"]),
+            token=self.config["DISTRIBUTED"]["token"],
+            logger=self.logger,
+        )
+        try:
+            for url in self.read_series_source(source):
+                try:
+                    coordinator.add_series(url)
+                except requests.RequestException as e:
+                    self.logger.error(f"Error crawling {url}: {e}")
+            coordinator.serve(host or "127.0.0.1", int(port))
+            coordinator.run(self.stop_flag)
+            self.logger.info(f"Coordinator finished: {coordinator.status()['counts']}")
+        except KeyboardInterrupt:
+            self.logger.info("Coordinator stopped")
+        finally:
+            self.stop_flag.set()
+            coordinator.shutdown()
+
+    def serve(self, listen: str = None) -> None:
+        """
+        Runs the local control API (see helper.control) until interrupted: jobs
+        posted to it are downloaded one after the other, and their progress is
+        streamed to any number of clients.
+        Args:
+            listen (str): "host:port" to listen on, defaults to the config.
+        """
+        from helper.control import ControlServer
+
+        host, _, port = (listen or self.config["CONTROL"]["listen"]).rpartition(":")
+        if self.processes > 1:
+            # Episode progress and control need the batch in this process
+            self.logger.info("The control API downloads in a single process, ignoring processes")
+            self.processes = 1
+        if getattr(self, "download_helper", None) is None:
+            self.download_helper = self.create_download_helper()
+        self.batch = None
+        server = ControlServer(self, token=self.config["CONTROL"]["token"], logger=self.logger)
+        try:
+            server.serve(host or "127.0.0.1", int(port), self.stop_flag)
+            while not self.stop_flag.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.logger.info("Control API stopped")
+        finally:
+            self.stop_flag.set()
+            self.download_helper.stop()
+            server.shutdown()
+            if getattr(self, "stream_server", None) is not None:
+                self.stream_server.shutdown()
+
+    def work(self, coordinator_url: str) -> None:
+        """
+        Runs a worker that downloads the episodes leased from a coordinator into the
+        local download folder.
+        """
+        from helper.distributed import Worker
+
+        self.download_helper = self.create_download_helper()
+        worker = Worker(
+            self.download_helper,
+            coordinator_url,
+            max_workers=self.max_workers,
+            token=self.config["DISTRIBUTED"]["token"],
+            logger=self.logger,
+        )
+        try:
+            worker.run(self.stop_flag)
+        except KeyboardInterrupt:
+            self.logger.info("Worker stopped")
+        finally:
+            self.stop_flag.set()
+            self.download_helper.download_stop = True
+            self.log_stall_summary()
 
     def download_search_latest(self, search):
-        pass
+        """
+        Downloads only the newest episode of the best match that is not in the library yet.
+        """
+        results = self.resolve_search(search)
+        if not results:
+            self.logger.error(f"No series found for {search}")
+            return 0
+        return self.init_watcher().check(results[0]["url"], latest_only=True)
 
     def download_search_new(self, search):
-        pass
+        """
+        Downloads every episode on the first page of the best match that is not in the
+        library yet.
+        """
+        results = self.resolve_search(search)
+        if not results:
+            self.logger.error(f"No series found for {search}")
+            return 0
+        return self.init_watcher().check(results[0]["url"])
 
     def download_search_all(self, search):
-        pass
+        """
+        Downloads every episode of every series whose title starts with the search.
+        Fuzzy matches are left out, so a loose query cannot start downloading
+        unrelated series.
+        """
+        # Every series starting with the search, not the first 20
+        results = self.resolve_search(search, fuzzy=False, limit=None)
+        if not results:
+            self.logger.error(f"No series starts with {search}, see --search for similar titles")
+            return 0
+        self.logger.info(f"Downloading {len(results)} series: {', '.join(entry['title'] for entry in results)}")
+        downloaded = 0
+        for entry in results:
+            data = DownloadHelper(self.download_path, self.logger, http2=self.http2).get_series_data(entry["url"])
+            if data is not None:
+                downloaded += self.download_headless(data, data["names"])
+        return downloaded
 
     def restart_app(self) -> None:
         """
@@ -781,7 +1545,7 @@ class Anime1_downloader:
             None
         """
         self.logger.debug("Restarting the app")
-        tkHelper.clear_window(self.root)
+        tk_helper.tkHelper.clear_window(self.root)
         self.start(True)
 
     def exit_app(self, code=None) -> None:
@@ -797,7 +1561,7 @@ class Anime1_downloader:
         Args:
             code (int, optional): The exit code to use. If not provided, the default exit code is used.
         """
-        tkHelper.clear_window(self.root)
+        tk_helper.tkHelper.clear_window(self.root)
         label = tk.Label(
             self.root,
             text="Exiting...",
@@ -818,7 +1582,8 @@ class Anime1_downloader:
 
         self.stop_flag.set()
         if getattr(self, "download_thread", None) and self.download_thread.is_alive():
-            self.download_helper.download_stop = True
+            # Closes the open connections, so the join does not wait on a stalled read
+            self.download_helper.stop()
             self.download_thread.join()
 
         if code is None:
@@ -830,9 +1595,82 @@ class Anime1_downloader:
         self.logger.info("Exit (%s)", code)
 
 
-if __name__ == "__main__":
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Anime1 downloader")
+    parser.add_argument(
+        "--follow", metavar="URL", action="append", default=[], help="follow a series in watch mode"
+    )
+    parser.add_argument(
+        "--watch", action="store_true", help="download newly aired episodes of followed series"
+    )
+    parser.add_argument("--search", metavar="TITLE", help="search the local catalog index")
+    parser.add_argument(
+        "--episodes",
+        metavar="START-END",
+        help="with --search, download this episode range of the best match ('all' for every match)",
+    )
+    parser.add_argument(
+        "--mirror", metavar="FILE|TITLE", help="mirror every series listed in FILE or matching TITLE"
+    )
+    parser.add_argument(
+        "--coordinate",
+        metavar="FILE|TITLE",
+        help="hand the episodes of every series listed in FILE or matching TITLE out to workers",
+    )
+    parser.add_argument("--listen", metavar="HOST:PORT", help="with --coordinate, the address to listen on")
+    parser.add_argument(
+        "--worker", metavar="URL", help="download episodes leased from the coordinator at URL"
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="HOST:PORT",
+        nargs="?",
+        const="",
+        help="run the local HTTP control API (address from the config when omitted)",
+    )
+    args = parser.parse_args(argv)
+
+    if (
+        args.follow or args.watch or args.search or args.mirror or args.coordinate or args.worker
+        or args.serve is not None
+    ):
+        downloader = Anime1_downloader()
+        if not downloader.logger.handlers:
+            logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s]: %(message)s")
+            downloader.logger.setLevel(logging.INFO)
+        for url in args.follow:
+            downloader.follow(url)
+        if args.search:
+            if args.episodes == "all":
+                downloader.download_search_all(args.search)
+            elif args.episodes:
+                start, _, end = args.episodes.partition("-")
+                downloader.download_search_range(args.search, int(start), int(end or start))
+            else:
+                for entry in downloader.download_search(args.search):
+                    print(f"{entry['title']}\t{entry.get('count', '')}\t{entry['url']}")
+        if args.mirror:
+            downloader.mirror(args.mirror)
+        if args.coordinate:
+            downloader.coordinate(args.coordinate, args.listen)
+        if args.worker:
+            downloader.work(args.worker)
+        if args.watch:
+            downloader.watch()
+        if args.serve is not None:
+            downloader.serve(args.serve or None)
+        return 0
+
     while True:
         downloader = Anime1_downloader()
         r = downloader.start()
         if r != 1:
-            break
+            return r
+
+
+if __name__ == "__main__":
+    # Page parsing uses a process pool, which needs this in a frozen executable
+    import multiprocessing
+
+    multiprocessing.freeze_support()
+    main()
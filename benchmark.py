@@ -0,0 +1,2274 @@
+"""
+Benchmarks for the Anime1 downloader.
+
+Run with:
+    python benchmark.py [name ...]
+
+Without arguments every benchmark is run. Results are printed to stdout.
+"""
+import os
+import re
+import sys
+import time
+import socket
+import subprocess
+import tempfile
+import contextlib
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Budget for `import anime1` plus `Anime1_downloader()` (config + logging), in ms
+STARTUP_BUDGET_MS = 150
+HEAVY_MODULES = ("tkinter", "requests", "bs4")
+
+
+def bench_startup(runs: int = 5, top: int = 10) -> bool:
+    """
+    Measures the cold start of the app without the UI and prints an import-time profile.
+    Returns:
+        bool: True if the median start-up time is within STARTUP_BUDGET_MS.
+    """
+    code = (
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        "import anime1\n"
+        "anime1.Anime1_downloader()\n"
+        "print(f'{(time.perf_counter() - t) * 1000:.3f}')\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    timings = []
+    profile = []
+    loaded = ""
+    with tempfile.TemporaryDirectory() as cwd:
+        for i in range(runs):
+            args = [sys.executable, "-X", "importtime", "-c", code]
+            result = subprocess.run(args, cwd=cwd, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(result.stderr)
+                return False
+            out = result.stdout.splitlines()
+            timings.append(float(out[0]))
+            loaded = out[1] if len(out) > 1 else ""
+            if i == 0:
+                # First run also writes config.ini, profile the warm-config runs instead
+                continue
+            profile = []
+            for line in result.stderr.splitlines():
+                match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)", line)
+                if match:
+                    profile.append((int(match.group(2)), int(match.group(1)), match.group(4)))
+
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print(f"{' Startup ':=^60}")
+    print(f"Runs: {runs}  min: {timings[0]:.1f} ms  median: {median:.1f} ms  budget: {STARTUP_BUDGET_MS} ms")
+    print(f"Heavy modules loaded at start-up: {loaded or 'none'}")
+    print(f"{' Import-time profile (cumulative us) ':-^60}")
+    for cumulative, own, name in sorted(profile, reverse=True)[:top]:
+        print(f"{cumulative:>10} {own:>10}  {name}")
+    ok = median <= STARTUP_BUDGET_MS and not loaded
+    print(f"Result: {'OK' if ok else 'OVER BUDGET'}")
+    return ok
+
+
+@contextlib.contextmanager
+def file_server(directory: str):
+    """
+    Serves `directory` over HTTP from a separate process and yields its base URL.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    args = [sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1", "--directory", directory]
+    server = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(50):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_transfer(size_mb: int = 256, counted_mb: int = 32) -> bool:
+    """
+    Compares the old iter_content loop with the readinto + writer thread loop
+    on a local file server. Reports MB/s, MB per CPU second and the number of
+    payload objects each loop allocates.
+    Payload objects are counted by identity on a separate `counted_mb` file
+    that keeps every object alive, so freed memory cannot hand the same id to a
+    new object.
+    """
+    import requests
+    from helper.transfer import BufferPool, RingWriter, iter_readinto
+
+    def iter_content_loop(response, path, seen=None):
+        with open(path, "ab") as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk:
+                    f.write(chunk)
+                    if seen is not None:
+                        seen[id(chunk)] = chunk
+
+    def readinto_loop(response, path, seen=None):
+        pool = BufferPool()
+        with RingWriter(path, pool) as writer:
+            for buffer, size in iter_readinto(response, pool):
+                if seen is not None:
+                    seen[id(buffer)] = buffer
+                writer.write(buffer, size)
+
+    print(f"{' Transfer loop ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+        with open(os.path.join(directory, "counted.mp4"), "wb") as f:
+            f.write(os.urandom(counted_mb * 1024 * 1024))
+
+        with file_server(directory) as url:
+            session = requests.Session()
+            results = {}
+            for name, loop in (("iter_content", iter_content_loop), ("readinto", readinto_loop)):
+                output = os.path.join(directory, f"out_{name}")
+                best = None
+                for _ in range(3):
+                    if os.path.exists(output):
+                        os.remove(output)
+                    wall, cpu = time.perf_counter(), time.process_time()
+                    with session.get(f"{url}/video.mp4", stream=True) as response:
+                        loop(response, output)
+                    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                    if best is None or wall < best[0]:
+                        best = (wall, cpu)
+                    assert os.path.getsize(output) == size_mb * 1024 * 1024
+
+                os.remove(output)
+                seen = {}
+                with session.get(f"{url}/counted.mp4", stream=True) as response:
+                    loop(response, output, seen)
+                objects = len(seen)
+                del seen
+
+                results[name] = best + (objects,)
+                wall, cpu = best
+                print(
+                    f"{name:<14} {size_mb / wall:>8.1f} MB/s  {size_mb / max(cpu, 1e-6):>8.1f} MB/cpu-s  "
+                    f"{objects:>8} payload objects per {counted_mb} MB"
+                )
+
+    old, new = results["iter_content"], results["readinto"]
+    ok = new[2] < old[2] and size_mb / new[1] >= size_mb / old[1]
+    print(f"Result: {'OK' if ok else 'REGRESSION'}")
+    return ok
+
+
+def bench_distributed(episodes: int = 6, lease_time: int = 2) -> bool:
+    """
+    Runs a coordinator and worker processes against a local file server.
+    The first worker is killed while it holds leases, and the second worker has to
+    pick its episodes up once the leases expire. An in-process worker then loses its
+    lease and has to stop its transfer without reporting a completion.
+    """
+    import json
+    import signal
+    import threading
+    import urllib.request
+    from helper.anime1_fetch import DownloadHelper
+    from helper.distributed import Coordinator, Worker
+
+    worker_code = (
+        "import sys, time, threading\n"
+        "from helper.anime1_fetch import DownloadHelper\n"
+        "from helper.distributed import Worker\n"
+        "source, coordinator, folder, hang = sys.argv[1:5]\n"
+        "class Helper(DownloadHelper):\n"
+        "    def video_detail_api(self, session, d):\n"
+        "        if hang == '1':\n"
+        "            time.sleep(3600)\n"
+        "        return {'s': [{'src': source, 'type': 'video/mp4'}]}\n"
+        "Worker(Helper(folder), coordinator, max_workers=2).run(threading.Event())\n"
+    )
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    def status(url):
+        with urllib.request.urlopen(f"{url}/status", timeout=5) as response:
+            return json.load(response)
+
+    def series(names):
+        return {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+
+    print(f"{' Distributed ':=^60}")
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            f.write(os.urandom(4 * 1024 * 1024))
+
+        with file_server(directory) as url:
+            source = f"{url}/video.mp4"
+            coordinator = Coordinator(DownloadHelper(directory), lease_time=lease_time)
+            coordinator.add_jobs(series([f"Series [{i + 1:02d}]" for i in range(episodes)]))
+            host, port = coordinator.serve("127.0.0.1", 0)
+            coordinator_url = f"http://{host}:{port}"
+
+            def spawn(name, hang):
+                folder = os.path.join(directory, name)
+                args = [sys.executable, "-c", worker_code, source, coordinator_url, folder, hang]
+                return subprocess.Popen(args, cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            # ------------ Worker A dies while holding two leases ------------
+            dying = spawn("a", "1")
+            while sum(job["state"] == "leased" for job in status(coordinator_url)["jobs"]) < 2:
+                time.sleep(0.1)
+            held = [job["name"] for job in status(coordinator_url)["jobs"] if job["state"] == "leased"]
+            dying.send_signal(signal.SIGKILL)
+            dying.wait()
+
+            # ------------ Worker B finishes everything ------------
+            start = time.perf_counter()
+            survivor = spawn("b", "0")
+            survivor.wait(timeout=120)
+            elapsed = time.perf_counter() - start
+            jobs = {job["name"]: job for job in status(coordinator_url)["jobs"]}
+            done = sum(job["state"] == "done" for job in jobs.values())
+            reassigned = all(jobs[name]["attempts"] == 2 for name in held)
+            files = len(os.listdir(os.path.join(directory, "b", "Series")))
+            print(f"Killed worker held: {', '.join(held)}")
+            print(f"Done: {done}/{episodes}  files: {files}  reassigned: {reassigned}  ({elapsed:.1f} s)")
+            ok &= done == files == episodes and reassigned
+            coordinator.shutdown()
+
+            # ------------ A worker that loses its lease stops its transfer ------------
+            class BlockingHelper(DownloadHelper):
+                def download_episode(self, _id, data):
+                    self.process[_id] = {"downloaded_size": 0, "total_size": 1, "success": False}
+                    while not self.stopped(_id):
+                        time.sleep(0.05)
+
+            coordinator = Coordinator(DownloadHelper(directory), lease_time=5)
+            coordinator.add_jobs(series(["Lost [01]"]))
+            host, port = coordinator.serve("127.0.0.1", 0)
+            helper = BlockingHelper(directory)
+            worker = Worker(helper, f"http://{host}:{port}", worker_id="w1", max_workers=1)
+            stop_flag = threading.Event()
+            thread = threading.Thread(target=worker.run, args=(stop_flag,), daemon=True)
+            thread.start()
+            while not any(job["state"] == "leased" for job in coordinator.status()["jobs"]):
+                time.sleep(0.05)
+            with coordinator.lock:
+                for job in coordinator.jobs.values():
+                    job["expires"] = 0
+            coordinator.lease("w2")
+            deadline = time.monotonic() + 10
+            # The worker keys episodes by series and name, they print as the name
+            while "Lost [01]" not in map(str, helper.cancelled) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            time.sleep(0.5)
+            job = coordinator.status()["jobs"][0]
+            cancelled = "Lost [01]" in map(str, helper.cancelled)
+            print(f"Lease lost: transfer cancelled: {cancelled}  held by: {job['worker']}  state: {job['state']}")
+            ok &= cancelled and job["worker"] == "w2" and job["state"] == "leased"
+            stop_flag.set()
+            coordinator.shutdown()
+
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+# Budget for one catalog query on the full catalog, in ms
+CATALOG_BUDGET_MS = 5
+
+
+def bench_catalog(entries: int = 8000, queries: int = 500) -> bool:
+    """
+    Measures prefix and fuzzy lookups on a synthetic catalog the size of the full
+    site, and the time to load it from disk.
+    """
+    import random
+    from helper.catalog import CatalogIndex
+
+    random.seed(1)
+    # Common characters of anime titles, so bigram postings get realistically long
+    alphabet = "之的不一人是我在你這戀愛魔法少女學園世界轉生異勇者物語王國天使惡魔日常偶像生活冒險ABCDEFGHIJKLMNOPRSTUVWXYZ"
+    rows = []
+    for i in range(entries):
+        title = "".join(random.choice(alphabet) for _ in range(random.randint(4, 16)))
+        if random.random() < 0.3:
+            title += f" 第{random.randint(2, 4)}季"
+        rows.append([i, title, f"1-{random.randint(1, 24)}", "2024", "秋", ""])
+
+    print(f"{' Catalog ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalog.json.gz")
+        catalog = CatalogIndex(path)
+        catalog.merge(rows)
+        catalog.save()
+
+        start = time.perf_counter()
+        catalog = CatalogIndex(path)
+        catalog.load()
+        load_ms = (time.perf_counter() - start) * 1000
+
+    titles = [row[1] for row in rows]
+    results = {}
+    for name, lookup, make_query in (
+        ("prefix", catalog.prefix, lambda title: title[:3]),
+        ("fuzzy", catalog.search, lambda title: title[1:-1]),
+        ("miss", catalog.search, lambda title: "不存在的作品名稱"),
+    ):
+        timings = []
+        for title in random.sample(titles, queries):
+            query = make_query(title)
+            start = time.perf_counter()
+            lookup(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = timings
+        print(
+            f"{name:<8} median: {timings[len(timings) // 2]:.3f} ms  "
+            f"p99: {timings[int(len(timings) * 0.99)]:.3f} ms  max: {timings[-1]:.3f} ms"
+        )
+    print(f"Load {entries} entries from disk: {load_ms:.1f} ms  budget per query: {CATALOG_BUDGET_MS} ms")
+
+    ok = all(timings[int(len(timings) * 0.99)] <= CATALOG_BUDGET_MS for timings in results.values())
+    print(f"Result: {'OK' if ok else 'OVER BUDGET'}")
+    return ok
+
+
+def write_series_fixture(directory: str, pages: int, per_page: int = 14) -> None:
+    """
+    Writes a saved multi-page category in the anime1.me layout: /cat/ and /cat/page/N/,
+    newest episodes first, with the sidebar and script noise of the real pages.
+    """
+    sidebar = "".join(
+        f'<li class="cat-item"><a href="https://anime1.me/category/{i}">Series {i} 第{i % 4 + 1}季</a></li>'
+        for i in range(400)
+    )
+    script = "<script>" + "var a=1;" * 2000 + "</script>"
+    episode = pages * per_page
+    for page in range(1, pages + 1):
+        articles = []
+        for _ in range(per_page):
+            articles.append(
+                f'<article id="post-{episode}"><header class="entry-header"><h2 class="entry-title">'
+                f'<a href="https://anime1.me/{episode}">Fixture [{episode:03d}]</a></h2></header>'
+                f'<div class="entry-content"><div class="vjscontainer"><video data-apireq="%7B%22c%22%3A{episode}%7D" '
+                f'class="video-js" controls preload="none"></video></div><p>{"說明 " * 40}</p></div></article>'
+            )
+            episode -= 1
+        html = (
+            '<html><head><meta name="keywords" content="Fixture"></head><body>'
+            '<header class="page-header"><h1 class="page-title">Fixture</h1></header>'
+            f'<main>{"".join(articles)}</main><aside><ul>{sidebar}</ul></aside>{script}</body></html>'
+        )
+        folder = os.path.join(directory, "cat", *(["page", str(page)] if page > 1 else []))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "index.html"), "w", encoding="utf-8") as f:
+            f.write(html)
+
+
+def bench_parse(pages: int = 300) -> bool:
+    """
+    Crawls a saved series of `pages` pages from a local file server, parsing serially
+    in the crawling thread and with the process pool.
+    """
+    from helper.anime1_fetch import DownloadHelper, parse_video_page
+
+    print(f"{' Page parsing ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        write_series_fixture(directory, pages)
+        size = sum(
+            os.path.getsize(os.path.join(folder, name))
+            for folder, _, names in os.walk(directory)
+            for name in names
+        )
+        html = open(os.path.join(directory, "cat", "page", "2", "index.html"), "rb").read()
+        start = time.perf_counter()
+        parse_video_page(html, "page 2")
+        one_page = time.perf_counter() - start
+        print(f"Fixture: {pages} pages, {size / 1024 / 1024:.1f} MB, {one_page * 1000:.1f} ms to parse one page")
+
+        results = {}
+        with file_server(directory) as url:
+            for name, workers in (("serial", 1), ("process pool", os.cpu_count() or 1)):
+                helper = DownloadHelper(directory, parse_workers=workers)
+                start = time.perf_counter()
+                data = helper.get_series_data(f"{url}/cat/")
+                elapsed = time.perf_counter() - start
+                results[name] = (elapsed, data)
+                print(f"{name:<14} {workers:>2} process(es)  {elapsed:>7.2f} s  {data['total episode']} episodes")
+
+    serial, pooled = results["serial"], results["process pool"]
+    same = serial[1] == pooled[1] and len(serial[1]["names"]) == pages * 14
+    print(f"Identical results: {same}  speed-up: {serial[0] / pooled[0]:.2f}x")
+    ok = same
+    if (os.cpu_count() or 1) > 1:
+        ok = ok and pooled[0] < serial[0]
+    else:
+        print("Single core: the speed-up of the process pool cannot show here")
+    print(f"Result: {'OK' if ok else 'REGRESSION'}")
+    return ok
+
+
+class LocalSourceHelper:
+    """
+    DownloadHelper whose API answers with the source in $BENCH_SOURCE. Defined at
+    module level so spawned shard processes can import it. With $BENCH_HOLD set,
+    an episode holds its slot until it is stopped.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        from helper.anime1_fetch import DownloadHelper
+
+        class Helper(DownloadHelper):
+            def video_detail_api(self, session, d):
+                return {"s": [{"src": os.environ["BENCH_SOURCE"], "type": "video/mp4"}]}
+
+            def download_episode(self, _id, data):
+                if not os.environ.get("BENCH_HOLD"):
+                    return super().download_episode(_id, data)
+                self.process[_id] = {"downloaded_size": 0, "total_size": 1, "loading": True}
+                while not self.stopped(_id):
+                    time.sleep(0.01)
+                self.process[_id]["success"] = False
+
+        return Helper(*args, **kwargs)
+
+
+def bench_sharding(episodes: int = 8, processes: int = 2) -> bool:
+    """
+    Downloads a batch with the sharded downloader and checks the totals read from
+    shared memory, then measures how long every shard takes to exit once the stop
+    flag is set.
+    """
+    import threading
+    from helper.sharding import STOP_GRACE, ShardedDownloader
+
+    size = 8 * 1024 * 1024
+    names = [f"Series [{i + 1:02d}]" for i in range(episodes)]
+    data = {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+
+    print(f"{' Sharding ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            f.write(os.urandom(size))
+
+        with file_server(directory) as url:
+            os.environ["BENCH_SOURCE"] = f"{url}/video.mp4"
+            output = os.path.join(directory, "out")
+            sharded = ShardedDownloader(output, processes=processes, max_workers=2, helper_class=LocalSourceHelper)
+            start = time.perf_counter()
+            finished = sharded.run(data, names, threading.Event())
+            elapsed = time.perf_counter() - start
+            files = len(os.listdir(os.path.join(output, "Series")))
+            print(
+                f"{processes} processes: {finished}/{episodes} episodes, {files} files, "
+                f"{sharded.downloaded_size / 2**20:.0f}/{sharded.total_size / 2**20:.0f} MB in {elapsed:.2f} s"
+            )
+            ok = finished == files == episodes and sharded.downloaded_size == sharded.total_size == episodes * size
+
+            os.environ["BENCH_HOLD"] = "1"
+            try:
+                sharded = ShardedDownloader(output, processes=processes, max_workers=2, helper_class=LocalSourceHelper)
+                stop_flag = threading.Event()
+                thread = threading.Thread(target=sharded.run, args=(data, names, stop_flag))
+                thread.start()
+                while sum(entry["loading"] for entry in sharded.process.values()) < processes * 2:
+                    time.sleep(0.05)
+                start = time.perf_counter()
+                stop_flag.set()
+                thread.join()
+                stopped = time.perf_counter() - start
+            finally:
+                del os.environ["BENCH_HOLD"]
+            print(f"Stop to all shards exited: {stopped * 1000:.0f} ms (grace {STOP_GRACE * 1000:.0f} ms)")
+            ok &= stopped < STOP_GRACE
+
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def simulate_makespan(order: list, sizes: dict, workers: int) -> float:
+    """
+    Wall time of a batch when every free worker takes the next episode in `order`
+    and all workers transfer at the same rate (size units per second).
+    """
+    import heapq
+
+    slots = [0.0] * workers
+    for name in order:
+        heapq.heappush(slots, heapq.heappop(slots) + sizes[name])
+    return max(slots)
+
+
+def bench_scheduling(workers: int = 4) -> bool:
+    """
+    Compares the batch wall time of list order and largest-first order on a season
+    with long specials at its end, then checks that probing sizes reuses the API
+    resolution of every episode and that the disk preflight refuses an oversized batch.
+    """
+    import threading
+    from helper.anime1_fetch import DownloadHelper
+    from helper.scheduling import check_disk_space, lpt_order, probe_sizes
+
+    print(f"{' Scheduling ':=^60}")
+    names = [f"Series [{i + 1:02d}]" for i in range(24)] + ["Series [OVA1]", "Series [OVA2]", "Series [SP]"]
+    sizes = {name: 300 for name in names}
+    sizes.update({"Series [OVA1]": 1200, "Series [OVA2]": 1100, "Series [SP]": 900})
+    listed = simulate_makespan(names, sizes, workers)
+    ordered = simulate_makespan(lpt_order(names, sizes), sizes, workers)
+    bound = max(sum(sizes.values()) / workers, max(sizes.values()))
+    print(f"Simulated wall time, {workers} workers: list order {listed:.0f}  largest first {ordered:.0f}  (bound {bound:.0f})")
+    ok = ordered < listed
+
+    class CountingHelper(DownloadHelper):
+        calls = 0
+
+        def video_detail_api(self, session, d):
+            with lock:
+                CountingHelper.calls += 1
+            return {"s": [{"src": source, "type": "video/mp4"}]}
+
+    lock = threading.Lock()
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            f.write(os.urandom(1024 * 1024))
+        with file_server(directory) as url:
+            source = f"{url}/video.mp4"
+            episodes = names[:6]
+            data = {"title": "Series", "names": episodes, "data": {name: name for name in episodes}}
+            helper = CountingHelper(os.path.join(directory, "out"))
+            probed = probe_sizes(helper, data, episodes, workers)
+            for name in lpt_order(episodes, probed):
+                helper.download_episode(name, data)
+            done = sum(1 for name in episodes if helper.process.get(name, {}).get("success"))
+            print(f"Probed {len(probed)} sizes, downloaded {done}, API calls: {CountingHelper.calls}")
+            ok &= done == len(episodes) and CountingHelper.calls == len(episodes)
+            ok &= all(size == 1024 * 1024 for size in probed.values())
+
+        enough, free = check_disk_space(os.path.join(directory, "missing", "folder"), 2**60)
+        print(f"Preflight of 1 EB against {free / 2**30:.1f} GB free: {'refused' if not enough else 'accepted'}")
+        ok &= not enough
+
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+# Budget for one estimator sample over the episodes of the full catalog, in ms
+ETA_BUDGET_MS = 5
+
+
+def bench_eta(episodes: int = 5000, workers: int = 4) -> bool:
+    """
+    Feeds the throughput estimator a simulated batch (constant 10 MB/s split over
+    the active episodes, half of the sizes unknown until an episode starts, one
+    episode resuming a large partial file) and checks its rate, its ETA and the
+    cost of one sample over `episodes` tracked episodes.
+    """
+    from helper.eta import ThroughputEstimator, format_eta
+
+    print(f"{' Throughput / ETA ':=^60}")
+    rate = 10 * 1024 * 1024
+    size = 50 * 1024 * 1024
+    names = [f"Series [{i + 1:04d}]" for i in range(episodes)]
+    batch = names[:40]
+    sizes = {name: size for name in batch[::2]}
+    process = {}
+    estimator = ThroughputEstimator(batch, sizes)
+    now, step = 0.0, 0.5
+    queue = list(batch)
+    active = []
+    peak = 0.0
+    errors = []
+    while queue or active:
+        while len(active) < workers and queue:
+            name = queue.pop(0)
+            # The first episode resumes a 40 MB partial file
+            resumed = 40 * 1024 * 1024 if name == batch[0] else 0
+            process[name] = {"total_size": size, "downloaded_size": resumed, "loading": True, "success": False}
+            active.append(name)
+        for name in active:
+            state = process[name]
+            state["downloaded_size"] = min(state["downloaded_size"] + rate * step / len(active), size)
+        for name in [name for name in active if process[name]["downloaded_size"] >= size]:
+            process[name]["success"] = True
+            active.remove(name)
+        now += step
+        estimator.update(process, now)
+        if now > 10:
+            peak = max(peak, estimator.rate)
+            left = sum(size - process.get(name, {}).get("downloaded_size", 0) for name in batch)
+            if estimator.eta:
+                errors.append(abs(estimator.eta - left / rate) / max(left / rate, 1))
+    print(f"Smoothed rate after warm-up: peak {peak / rate:.2f}x of the real rate")
+    print(f"ETA error: median {sorted(errors)[len(errors) // 2]:.1%}, last estimate {format_eta(estimator.eta)}")
+    ok = peak < 1.2 * rate and sorted(errors)[len(errors) // 2] < 0.1 and estimator.finished == len(batch)
+
+    # A failed and a cancelled episode leave the remaining bytes, the rest of the batch stays
+    process = {
+        "A": {"total_size": size, "downloaded_size": size, "success": True, "finished": True},
+        "B": {"total_size": size, "downloaded_size": size // 2, "success": False, "finished": True},
+        "C": {"total_size": size, "downloaded_size": size // 4, "loading": True, "success": False},
+        "D": {"total_size": size, "downloaded_size": 0, "loading": True, "success": False},
+    }
+    estimator = ThroughputEstimator(["A", "B", "C", "D", "E"], {"E": size})
+    estimator.update(process, 0.0, dropped={"C"})
+    print(f"Failed and cancelled episodes left out: {estimator.remaining / size:.1f} of 2.0 episodes left")
+    ok &= estimator.remaining == 2 * size and estimator.finished == 1
+
+    # A third of the batch done, `workers` episodes transferring, the rest queued
+    done, queued = names[: episodes // 3], names[episodes // 3 + workers :]
+    process = {name: {"total_size": size, "downloaded_size": size, "success": True} for name in done}
+    for name in names[episodes // 3 : episodes // 3 + workers]:
+        process[name] = {"total_size": size, "downloaded_size": 0, "loading": True, "success": False}
+    estimator = ThroughputEstimator(names, {name: size for name in queued[::2]})
+    samples = []
+    for i in range(20):
+        for name in names[episodes // 3 : episodes // 3 + workers]:
+            process[name]["downloaded_size"] += 1024 * 1024
+        start = time.perf_counter()
+        estimator.update(process, i * 1.0)
+        samples.append((time.perf_counter() - start) * 1000)
+    cost = sorted(samples)[len(samples) // 2]
+    print(f"One sample over {episodes} episodes: {cost:.2f} ms (budget {ETA_BUDGET_MS} ms)")
+    ok &= cost < ETA_BUDGET_MS
+
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+# Stand-in API server for bench_http2: TLS, HTTP/2 and HTTP/1.1 chosen by ALPN,
+# every answer delayed by a fixed round trip. GET /stats returns the connections
+# accepted per protocol.
+API_SERVER = r"""
+import asyncio, json, ssl, sys
+import h2.config, h2.connection, h2.events
+
+port, cert, key, delay, protocols = int(sys.argv[1]), sys.argv[2], sys.argv[3], float(sys.argv[4]), sys.argv[5].split(",")
+stats = {"h2": 0, "http/1.1": 0}
+API = json.dumps({"s": [{"src": "https://127.0.0.1/video.mp4", "type": "video/mp4"}]}).encode()
+
+
+def body(path):
+    return json.dumps(stats).encode() if path == "/stats" else API
+
+
+async def serve_h2(reader, writer):
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+    conn.initiate_connection()
+    writer.write(conn.data_to_send())
+    paths = {}
+
+    async def respond(stream_id, path):
+        await asyncio.sleep(delay)
+        data = body(path)
+        headers = [(":status", "200"), ("content-type", "application/json"), ("content-length", str(len(data))), ("set-cookie", "e=1; Path=/")]
+        conn.send_headers(stream_id, headers)
+        conn.send_data(stream_id, data, end_stream=True)
+        writer.write(conn.data_to_send())
+
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                paths[event.stream_id] = dict(event.headers)[":path"]
+            elif isinstance(event, h2.events.DataReceived):
+                conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                asyncio.ensure_future(respond(event.stream_id, paths.pop(event.stream_id)))
+        writer.write(conn.data_to_send())
+
+
+async def serve_h1(reader, writer):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        path, length = line.decode().split(" ")[1], 0
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b""):
+                break
+            name, value = header.decode().split(":", 1)
+            if name.lower() == "content-length":
+                length = int(value)
+        await reader.readexactly(length)
+        await asyncio.sleep(delay)
+        data = body(path)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nSet-Cookie: e=1; Path=/\r\nContent-Length: %d\r\n\r\n" % len(data) + data)
+        await writer.drain()
+
+
+async def handle(reader, writer):
+    protocol = writer.get_extra_info("ssl_object").selected_alpn_protocol() or "http/1.1"
+    stats[protocol] += 1
+    try:
+        await (serve_h2 if protocol == "h2" else serve_h1)(reader, writer)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    writer.close()
+
+
+async def main():
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    context.set_alpn_protocols(protocols)
+    server = await asyncio.start_server(handle, "127.0.0.1", port, ssl=context)
+    async with server:
+        await server.serve_forever()
+
+
+asyncio.run(main())
+"""
+
+
+def certificate(directory: str) -> tuple:
+    """
+    Creates a self-signed certificate for 127.0.0.1 and localhost in `directory`.
+    Returns:
+        tuple: (certificate file, key file).
+    """
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    if not os.path.exists(cert):
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+             "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost", "-keyout", key, "-out", cert],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    return cert, key
+
+
+@contextlib.contextmanager
+def api_server(directory: str, delay: float, protocols: str = "h2,http/1.1"):
+    """
+    Runs API_SERVER with a self-signed certificate and yields (base URL, CA file).
+    """
+    cert, key = certificate(directory)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    args = [sys.executable, "-c", API_SERVER, str(port), cert, key, str(delay), protocols]
+    server = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(50):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield f"https://127.0.0.1:{port}", cert
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_http2(episodes: int = 500, delay: float = 0.02, workers: int = 4) -> bool:
+    """
+    Resolves a batch of `episodes` API calls against a stand-in API server with a
+    `delay` second round trip, over HTTP/1.1 (`workers` connections) and multiplexed
+    over HTTP/2. Then checks that a server without HTTP/2 is spoken to over HTTP/1.1.
+    """
+    import json
+    import shutil
+    from helper import anime1_fetch
+    from helper.anime1_fetch import DownloadHelper
+    import requests
+    from helper import multiplex
+    from helper.multiplex import MultiplexedClient
+
+    print(f"{' HTTP/2 API resolution ':=^60}")
+    try:
+        import h2, httpx  # noqa: F401
+    except ImportError:
+        print("Skipped: needs `pip install httpx[http2]`")
+        return True
+    if shutil.which("openssl") is None:
+        print("Skipped: needs openssl to create a test certificate")
+        return True
+
+    names = [f"Series [{i + 1:03d}]" for i in range(episodes)]
+    data = {"title": "Series", "names": names, "data": {name: name for name in names}}
+    api_url = anime1_fetch.API_URL
+    cooldown = multiplex.FALLBACK_COOLDOWN
+    ok = True
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            with api_server(directory, delay) as (url, cafile):
+                os.environ["REQUESTS_CA_BUNDLE"] = cafile
+                anime1_fetch.API_URL = f"{url}/api"
+                results = {}
+                for name, http2 in (("HTTP/1.1", False), ("HTTP/2", True)):
+                    helper = DownloadHelper(directory, http2=http2)
+                    if http2:
+                        helper._multiplexed = MultiplexedClient(verify=cafile)
+                    start = time.perf_counter()
+                    resolved = helper.resolve_api(names, data, workers)
+                    results[name] = time.perf_counter() - start
+                    cookies = all("e" in session.cookies for session, _ in resolved.values())
+                    print(f"{name:<9} {len(resolved)}/{episodes} resolved in {results[name]:.2f} s  (cookies handed over: {cookies})")
+                    ok &= len(resolved) == episodes and cookies
+                with urllib_open(f"{url}/stats", cafile) as response:
+                    stats = json.load(response)
+                print(f"Connections opened: {stats}")
+                ok &= results["HTTP/2"] < results["HTTP/1.1"] and stats["h2"] <= 2
+
+                # One transport failure moves the host to HTTP/1.1 until the cooldown ends
+                client = MultiplexedClient(verify=cafile)
+                session = requests.Session()
+                session.verify = cafile
+                send = client.client.request
+
+                async def fail(*args, **kwargs):
+                    client.client.request = send
+                    raise httpx.ConnectError("reset")
+
+                client.client.request = fail
+                multiplex.FALLBACK_COOLDOWN = 0.5
+                versions = [client.request(session, "POST", f"{url}/api", data=b"d=1").http_version for _ in range(2)]
+                time.sleep(0.6)
+                versions.append(client.request(session, "POST", f"{url}/api", data=b"d=1").http_version)
+                multiplex.FALLBACK_COOLDOWN = cooldown
+                client.close()
+                print(f"After a transport failure: {', '.join(versions)}")
+                ok &= versions == ["HTTP/1.1", "HTTP/1.1", "HTTP/2"]
+
+            with api_server(directory, delay, "http/1.1") as (url, cafile):
+                client = MultiplexedClient(verify=cafile)
+                response = client.request(None, "POST", f"{url}/api", data=b"d=1")
+                print(f"Server without HTTP/2: answered over {response.http_version}")
+                ok &= response.http_version == "HTTP/1.1" and response.status_code == 200
+                client.close()
+    finally:
+        anime1_fetch.API_URL = api_url
+        os.environ.pop("REQUESTS_CA_BUNDLE", None)
+
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+# Throttled Range server for bench_cancel: /video.mp4 is sent in 64 KB steps every
+# 10 ms; /stall.mp4 in 16 KB steps every 50 ms, and every other request for it
+# stops sending after 256 KB, leaving the client blocked in recv().
+RANGE_SERVER = r"""
+import asyncio, sys
+
+port, path = int(sys.argv[1]), sys.argv[2]
+content = open(path, "rb").read()
+requests = 0
+
+
+async def handle(reader, writer):
+    global requests
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, target = line.decode().split(" ")[:2]
+            start = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                name, value = header.decode().split(":", 1)
+                if name.lower() == "range":
+                    start = int(value.strip()[6:].split("-")[0])
+            body = content[start:]
+            status = "206 Partial Content" if start else "200 OK"
+            head = f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\nAccept-Ranges: bytes\r\n"
+            if start:
+                head += f"Content-Range: bytes {start}-{len(content) - 1}/{len(content)}\r\n"
+            writer.write((head + "\r\n").encode())
+            if method == "HEAD":
+                continue
+            step, delay, stall = 65536, 0.01, None
+            if target == "/stall.mp4":
+                requests += 1
+                step, delay = 16384, 0.05
+                stall = 256 * 1024 if requests % 2 else None
+            for i in range(0, len(body), step):
+                if stall is not None and i >= stall:
+                    await asyncio.sleep(3600)
+                writer.write(body[i:i + step])
+                await writer.drain()
+                await asyncio.sleep(delay)
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    writer.close()
+
+
+async def main():
+    server = await asyncio.start_server(handle, "127.0.0.1", port, backlog=256)
+    async with server:
+        await server.serve_forever()
+
+
+asyncio.run(main())
+"""
+
+
+def bench_cancel(transfers: int = 50, size_mb: int = 4) -> bool:
+    """
+    Stops a batch of `transfers` active downloads, half of them blocked on a
+    stalled socket, and measures how long the batch takes to return. Every partial
+    file must hold exactly the bytes counted as downloaded. Then pauses and resumes
+    one episode and checks that the finished file matches the source.
+    """
+    import threading
+    from helper.batch import PAUSED, EpisodeBatch
+
+    size = size_mb * 1024 * 1024
+    names = [f"Series [{i + 1:02d}]" for i in range(transfers)]
+    data = {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+
+    print(f"{' Cancel ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "video.mp4")
+        with open(source, "wb") as f:
+            f.write(os.urandom(size))
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen([sys.executable, "-c", RANGE_SERVER, str(port), source])
+        try:
+            for _ in range(50):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            # ------------ Stop a batch of active transfers ------------
+            os.environ["BENCH_SOURCE"] = f"http://127.0.0.1:{port}/stall.mp4"
+            output = os.path.join(directory, "stop")
+            helper = LocalSourceHelper(output, hls_workers=1)
+            batch = EpisodeBatch(helper, data, names, workers=transfers)
+            stop_flag = threading.Event()
+            thread = threading.Thread(target=batch.run, args=(stop_flag,))
+            thread.start()
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                active = [state for state in list(helper.process.values()) if state.get("downloaded_size", 0) > 0]
+                if len(active) == transfers:
+                    break
+                time.sleep(0.05)
+            # Let the stalled half block in recv()
+            time.sleep(0.5)
+            start = time.perf_counter()
+            stop_flag.set()
+            thread.join()
+            stopped = time.perf_counter() - start
+
+            lost = 0
+            for name in names:
+                partial = helper.check_filename(f"{output}/Series", name) + ".downloading"
+                on_disk = os.path.getsize(partial) if os.path.exists(partial) else 0
+                lost += on_disk != helper.process.get(name, {}).get("downloaded_size", -1)
+            print(
+                f"{len(active)}/{transfers} active transfers stopped in {stopped * 1000:.0f} ms, "
+                f"{lost} partial files out of step with their progress"
+            )
+            ok = len(active) == transfers and stopped < 1.0 and lost == 0
+
+            # ------------ Pause and resume one episode ------------
+            os.environ["BENCH_SOURCE"] = f"http://127.0.0.1:{port}/video.mp4"
+            output = os.path.join(directory, "pause")
+            helper = LocalSourceHelper(output, hls_workers=1)
+            name = names[0]
+            batch = EpisodeBatch(helper, data, [name], workers=1)
+            thread = threading.Thread(target=batch.run)
+            thread.start()
+            while helper.process.get(name, {}).get("downloaded_size", 0) < size // 4:
+                time.sleep(0.01)
+            start = time.perf_counter()
+            batch.pause(name)
+            while batch.state(name) != PAUSED:
+                time.sleep(0.001)
+            paused = time.perf_counter() - start
+            paused_at = helper.process[name]["downloaded_size"]
+            partial = helper.check_filename(f"{output}/Series", name) + ".downloading"
+            in_step = os.path.getsize(partial) == paused_at
+            batch.resume(name)
+            thread.join()
+            with open(source, "rb") as f, open(helper.check_filename(f"{output}/Series", name), "rb") as g:
+                identical = f.read() == g.read()
+            print(
+                f"Paused in {paused * 1000:.0f} ms at {paused_at / 2**20:.1f} MB "
+                f"(partial file {'in step' if in_step else 'OUT OF STEP'}), "
+                f"resumed file {'identical' if identical else 'DIFFERENT'}"
+            )
+            ok &= in_step and identical and 0 < paused_at < size and batch.state(name) == "done"
+        finally:
+            server.terminate()
+            server.wait()
+            os.environ.pop("BENCH_SOURCE", None)
+
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+class EventClient:
+    """
+    Reads the control API's event stream on a raw socket and merges the episode
+    states it receives.
+    """
+
+    def __init__(self, address: tuple) -> None:
+        import threading
+
+        self.sock = socket.create_connection(address)
+        self.sock.sendall(b"GET /events HTTP/1.1\r\nHost: bench\r\n\r\n")
+        self.events = 0
+        self.bytes = 0
+        self.states = {}
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    def read(self) -> None:
+        import json
+
+        reader = self.sock.makefile("rb")
+        try:
+            for line in reader:
+                self.bytes += len(line)
+                if line.startswith(b"data: "):
+                    self.events += 1
+                    for job, names in json.loads(line[6:]).get("episodes", {}).items():
+                        for name, state in names.items():
+                            self.states[f"{job}/{name}"] = state["state"]
+        except (OSError, ValueError):
+            pass
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def bench_control(episodes: int = 300, clients: int = 50, workers: int = 8) -> bool:
+    """
+    Runs a 300-episode job through the control API from a local file server,
+    first with no event client, then with 50 clients following the event stream.
+    Every client must end up with every episode done, the download rate must
+    stay within 20% of the run without clients, and the cost of building and
+    serializing one coalesced event is reported.
+    """
+    import json
+    import threading
+    import urllib.request
+    from helper.batch import EpisodeBatch
+    from helper.control import ControlServer, EVENT_INTERVAL
+
+    size = 512 * 1024
+
+    class Downloader:
+        # The parts of the app the control server uses
+        def __init__(self, helper):
+            self.download_helper = helper
+            self.batch = None
+
+        def resolve_series(self, series):
+            names = [f"{series} [{i + 1:03d}]" for i in range(episodes)]
+            return {"title": series, "url": "local", "names": names, "data": {name: name for name in names}}
+
+        def download_headless(self, data, names):
+            self.batch = EpisodeBatch(self.download_helper, data, names, workers)
+            return self.batch.run()
+
+    print(f"{' Control API ':=^60}")
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            f.write(os.urandom(size))
+        with file_server(directory) as url:
+            os.environ["BENCH_SOURCE"] = f"{url}/video.mp4"
+            for count in (0, clients):
+                helper = LocalSourceHelper(os.path.join(directory, f"out{count}"))
+                server = ControlServer(Downloader(helper))
+                stop_flag = threading.Event()
+                address = server.serve("127.0.0.1", 0, stop_flag)
+                base = f"http://127.0.0.1:{address[1]}"
+                followers = [EventClient(address) for _ in range(count)]
+
+                request = urllib.request.Request(
+                    f"{base}/jobs", data=json.dumps({"series": "Series"}).encode(), method="POST"
+                )
+                job = json.load(urllib.request.urlopen(request))["id"]
+                start = time.perf_counter()
+                publish_ms = 0.0
+                while True:
+                    status = json.load(urllib.request.urlopen(f"{base}/jobs/{job}"))
+                    publish_ms = max(publish_ms, server.publish_time * 1000)
+                    if status["state"] not in ("queued", "resolving", "downloading"):
+                        break
+                    time.sleep(0.1)
+                elapsed = time.perf_counter() - start
+                # The last coalesced event goes out on the next tick
+                time.sleep(EVENT_INTERVAL * 3)
+                metrics = json.load(urllib.request.urlopen(f"{base}/metrics"))
+                stop_flag.set()
+                server.shutdown()
+                for follower in followers:
+                    follower.close()
+
+                rate = episodes * size / elapsed / 2**20
+                results[count] = rate
+                complete = sum(
+                    1 for follower in followers
+                    if sum(1 for state in follower.states.values() if state == "done") == episodes
+                )
+                line = f"{count:>3} clients: job {status['state']}, {status['finished']}/{episodes} episodes, {rate:.1f} MB/s"
+                if followers:
+                    events = sum(follower.events for follower in followers) / len(followers)
+                    kb = sum(follower.bytes for follower in followers) / len(followers) / 1024
+                    line += f", {events:.0f} events / {kb:.0f} KB per client, {complete}/{count} saw every episode done"
+                print(line)
+                print(f"             slowest event build {publish_ms:.2f} ms, {metrics['clients']} clients at the end")
+                ok = status["finished"] == episodes and complete == count
+                results[f"ok{count}"] = ok
+    os.environ.pop("BENCH_SOURCE", None)
+
+    ok = results["ok0"] and results[f"ok{clients}"] and results[clients] >= 0.8 * results[0]
+    print(f"Rate with {clients} clients: {results[clients] / results[0]:.0%} of no clients")
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def bench_reconfigure(episodes: int = 24, size_mb: int = 4) -> bool:
+    """
+    Runs a batch with one worker under an 8 MB/s cap, then edits a watched
+    config file to 4 workers and 16 MB/s, then to 2 workers. Reports how long
+    each change takes to show, the measured rates, and checks that no episode
+    in flight was restarted and every file is complete.
+    """
+    import threading
+    from helper.batch import EpisodeBatch
+    from helper.live_config import POLL_INTERVAL, ConfigWatcher
+
+    size = size_mb * 1024 * 1024
+    names = [f"Series [{i + 1:02d}]" for i in range(episodes)]
+    data = {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+
+    def write_config(path, workers, limit):
+        with open(path, "w") as f:
+            f.write(f"[APP]\nmax_workers = {workers}\nbandwidth_limit = {limit}\n")
+
+    def measure_rate(helper, seconds=2.0):
+        start, done = time.perf_counter(), helper.downloaded_size
+        time.sleep(seconds)
+        return (helper.downloaded_size - done) / (time.perf_counter() - start) / 2**20
+
+    print(f"{' Reconfigure ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            f.write(os.urandom(size))
+        config = os.path.join(directory, "config.ini")
+        write_config(config, 1, 8)
+        with file_server(directory) as url:
+            os.environ["BENCH_SOURCE"] = f"{url}/video.mp4"
+            helper = LocalSourceHelper(os.path.join(directory, "out"), bandwidth_limit=8 * 2**20)
+            batch = EpisodeBatch(helper, data, names, workers=1)
+
+            def apply(values):
+                if "max_workers" in values:
+                    batch.set_workers(int(values["max_workers"]))
+                if "bandwidth_limit" in values:
+                    helper.set_bandwidth_limit(float(values["bandwidth_limit"]) * 2**20)
+
+            watcher = ConfigWatcher(config, apply)
+            watcher.start()
+            restarted = set()
+            seen = {}
+            sampling = True
+
+            def sample():
+                # An episode restarted from scratch would see its progress go down
+                while sampling:
+                    for name, state in list(helper.process.items()):
+                        done = state.get("downloaded_size", 0)
+                        if done < seen.get(name, 0):
+                            restarted.add(name)
+                        seen[name] = done
+                    time.sleep(0.01)
+
+            threading.Thread(target=sample, daemon=True).start()
+            thread = threading.Thread(target=batch.run)
+            thread.start()
+            time.sleep(0.5)
+            rate_before = measure_rate(helper)
+
+            # Make sure the new mtime differs on filesystems with coarse timestamps
+            time.sleep(0.05)
+            write_config(config, 4, 16)
+            start = time.perf_counter()
+            while batch.active < 4 and thread.is_alive():
+                time.sleep(0.01)
+            grown = time.perf_counter() - start
+            rate_after = measure_rate(helper)
+
+            write_config(config, 2, 16)
+            start = time.perf_counter()
+            while batch.active > 2 and thread.is_alive():
+                time.sleep(0.01)
+            shrunk = time.perf_counter() - start
+            most = 0
+            while thread.is_alive():
+                most = max(most, batch.active)
+                time.sleep(0.01)
+            sampling = False
+            watcher.stop()
+            folder = os.path.join(directory, "out", "Series")
+            complete = sum(1 for file in os.listdir(folder) if os.path.getsize(os.path.join(folder, file)) == size)
+    os.environ.pop("BENCH_SOURCE", None)
+
+    print(f"1 worker at 8 MB/s cap:   {rate_before:>5.1f} MB/s")
+    print(f"4 workers at 16 MB/s cap: {rate_after:>5.1f} MB/s, applied in {grown * 1000:.0f} ms (poll {POLL_INTERVAL:g} s)")
+    print(f"Back to 2 workers in {shrunk * 1000:.0f} ms (after the episodes in flight), at most {most} active after")
+    print(f"{complete}/{episodes} files complete, {len(restarted)} episodes restarted")
+    ok = (
+        abs(rate_before - 8) < 8 * 0.2
+        and abs(rate_after - 16) < 16 * 0.2
+        and grown < POLL_INTERVAL + 1
+        and most <= 2
+        and complete == episodes
+        and not restarted
+    )
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+class SlowStream:
+    """
+    Console stand-in whose every write takes `delay` seconds.
+    """
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text: str) -> None:
+        time.sleep(self.delay)
+        self.lines += 1
+
+    def flush(self) -> None:
+        pass
+
+
+def bench_logging(episodes: int = 120, size_kb: int = 512, workers: int = 4, delay: float = 0.002) -> bool:
+    """
+    Downloads a batch of small episodes from a local file server with logging off,
+    with debug logging written synchronously to a file and a slow console, and
+    with the same handlers behind the LogPipeline. Throughput with the pipeline
+    should stay within 10% of logging off.
+    """
+    import logging
+    from helper.batch import EpisodeBatch
+    from helper.log_pipeline import LogPipeline, RateLimitFilter
+
+    names = [f"Series [{i + 1:03d}]" for i in range(episodes)]
+    data = {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+    size = size_kb * 1024
+
+    print(f"{' Logging ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            f.write(os.urandom(size))
+        with file_server(directory) as url:
+            os.environ["BENCH_SOURCE"] = f"{url}/video.mp4"
+            results = {}
+            for mode in ("off", "sync", "pipeline"):
+                logger = logging.getLogger(f"bench.logging.{mode}")
+                logger.propagate = False
+                handlers = []
+                if mode != "off":
+                    logger.setLevel(logging.DEBUG)
+                    console = logging.StreamHandler(SlowStream(delay))
+                    file = logging.FileHandler(os.path.join(directory, f"{mode}.log"), encoding="utf-8")
+                    handlers = [console, file]
+                    for handler in handlers:
+                        handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s] [%(levelname)s]: %(message)s"))
+                pipeline = None
+                if mode == "sync":
+                    for handler in handlers:
+                        logger.addHandler(handler)
+                elif mode == "pipeline":
+                    pipeline = LogPipeline.install(logger, handlers, RateLimitFilter())
+
+                helper = LocalSourceHelper(os.path.join(directory, mode), logger=logger)
+                start = time.perf_counter()
+                finished = EpisodeBatch(helper, data, names, workers, logger=logger).run()
+                elapsed = time.perf_counter() - start
+                if pipeline is not None:
+                    pipeline.stop()
+                for handler in handlers:
+                    logger.removeHandler(handler)
+                    handler.close()
+
+                rate = episodes * size / elapsed / 2**20
+                results[mode] = rate
+                lines = handlers[0].stream.lines if handlers else 0
+                dropped = pipeline.rate_limit.dropped if pipeline is not None else 0
+                print(
+                    f"{mode:<9} {finished}/{episodes} episodes  {rate:>7.1f} MB/s  "
+                    f"{lines:>5} lines written, {dropped} suppressed"
+                )
+    os.environ.pop("BENCH_SOURCE", None)
+
+    ok = results["pipeline"] >= 0.9 * results["off"]
+    print(f"Pipeline vs logging off: {results['pipeline'] / results['off']:.0%}, sync: {results['sync'] / results['off']:.0%}")
+    print(f"Result: {'OK' if ok else 'REGRESSION'}")
+    return ok
+
+
+# Stand-in API and video host for bench_warmup, on https://localhost:<port>. The
+# first request of a connection waits two more round trips (TCP and TLS handshakes),
+# every request one. POST /api answers with /video.mp4 as the source, which is served with Range
+# support; GET /stats returns the connections accepted.
+WARM_SERVER = r"""
+import asyncio, json, ssl, sys
+
+port, cert, key, rtt, path = int(sys.argv[1]), sys.argv[2], sys.argv[3], float(sys.argv[4]), sys.argv[5]
+content = open(path, "rb").read()
+context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+context.load_cert_chain(cert, key)
+stats = {"connections": 0}
+API = json.dumps({"s": [{"src": f"https://localhost:{port}/video.mp4", "type": "video/mp4"}]}).encode()
+
+
+async def handle(reader, writer):
+    stats["connections"] += 1
+    try:
+        await asyncio.sleep(2 * rtt)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, target = line.decode().split(" ")[:2]
+            length, start = 0, 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                name, value = header.decode().split(":", 1)
+                if name.lower() == "content-length":
+                    length = int(value)
+                elif name.lower() == "range":
+                    start = int(value.strip()[6:].split("-")[0])
+            await reader.readexactly(length)
+            await asyncio.sleep(rtt)
+            status, extra = "200 OK", ""
+            if target == "/api":
+                body = API
+            elif target == "/stats":
+                body = json.dumps(stats).encode()
+            else:
+                body = content[start:]
+                if start:
+                    status = "206 Partial Content"
+                    extra = f"Content-Range: bytes {start}-{len(content) - 1}/{len(content)}\r\n"
+            head = f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\nAccept-Ranges: bytes\r\n{extra}\r\n"
+            writer.write(head.encode() + (b"" if method == "HEAD" else body))
+            await writer.drain()
+    except (ConnectionError, ssl.SSLError, asyncio.IncompleteReadError):
+        pass
+    writer.close()
+
+
+async def main():
+    server = await asyncio.start_server(handle, "127.0.0.1", port, ssl=context, backlog=256)
+    async with server:
+        await server.serve_forever()
+
+
+asyncio.run(main())
+"""
+
+
+def bench_warmup(episodes: int = 24, workers: int = 4, rtt: float = 0.02, dns_delay: float = 0.02) -> bool:
+    """
+    Downloads `episodes` small episodes from a stand-in host with a `rtt` second
+    round trip and a `dns_delay` second resolver, and compares the time to first
+    byte of each episode: a session with its own connections per episode and no
+    DNS cache (as before), then the shared pool with the DNS cache, warmed up
+    while the episodes would be chosen.
+    """
+    import json
+    import shutil
+    import statistics
+    import threading
+    from helper import anime1_fetch
+    from helper.anime1_fetch import DownloadHelper
+    from helper.batch import EpisodeBatch
+    from helper.warmup import DNSCache
+
+    print(f"{' Connection warm-up ':=^60}")
+    if shutil.which("openssl") is None:
+        print("Skipped: needs openssl to create a test certificate")
+        return True
+
+    import requests
+
+    class ColdHelper(DownloadHelper):
+        # One session and connection pool per episode, as before the shared adapter
+        def new_session(self):
+            return requests.Session()
+
+    resolve = socket.getaddrinfo
+
+    def slow_resolve(host, *args, **kwargs):
+        if host == "localhost":
+            time.sleep(dns_delay)
+        return resolve(host, *args, **kwargs)
+
+    names = [f"Series [{i + 1:02d}]" for i in range(episodes)]
+    data = {"title": "Series", "names": names, "data": {name: name for name in names}}
+    api_url = anime1_fetch.API_URL
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = certificate(directory)
+        source = os.path.join(directory, "video.mp4")
+        with open(source, "wb") as f:
+            f.write(os.urandom(256 * 1024))
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen([sys.executable, "-c", WARM_SERVER, str(port), cert, key, str(rtt), source])
+        cache = None
+        try:
+            for _ in range(50):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            os.environ["REQUESTS_CA_BUNDLE"] = cert
+            anime1_fetch.API_URL = f"https://localhost:{port}/api"
+            socket.getaddrinfo = slow_resolve
+
+            results = {}
+            connections = 0
+            for run in ("cold", "warm"):
+                if run == "cold":
+                    helper = ColdHelper(os.path.join(directory, run))
+                else:
+                    cache = DNSCache().install()
+                    helper = DownloadHelper(os.path.join(directory, run))
+                    start = time.perf_counter()
+                    helper.warm_up(data, workers)
+                    print(f"Warm-up (while choosing episodes): {(time.perf_counter() - start) * 1000:.0f} ms")
+                EpisodeBatch(helper, data, names, workers).run(threading.Event())
+                with urllib_open(f"https://127.0.0.1:{port}/stats", cert) as response:
+                    opened = json.load(response)["connections"] - connections - 1
+                    connections += opened + 1
+                times = sorted(helper.ttfb.values())
+                results[run] = statistics.median(times)
+                done = sum(1 for state in helper.process.values() if state.get("success"))
+                print(
+                    f"{run:<5} {done}/{episodes} done, time to first byte: median {results[run] * 1000:.0f} ms, "
+                    f"slowest {times[-1] * 1000:.0f} ms, {opened} connections opened"
+                )
+                ok &= done == episodes and len(times) == episodes
+            print(f"DNS cache: {cache.misses} names resolved, {cache.hits} answered from the cache")
+            print(f"Time to first byte warm vs cold: {results['warm'] / results['cold']:.0%}")
+            ok &= results["warm"] < 0.7 * results["cold"]
+        finally:
+            socket.getaddrinfo = resolve
+            anime1_fetch.API_URL = api_url
+            os.environ.pop("REQUESTS_CA_BUNDLE", None)
+            server.terminate()
+            server.wait()
+
+    print(f"Result: {'OK' if ok else 'REGRESSION'}")
+    return ok
+
+
+# Stand-in video host for bench_egress that throttles each client address to a
+# fixed rate, shared by all of its connections. Addresses in the forbidden list
+# answer 403 from their third request on. Serves /video.mp4 (with Range),
+# /playlist.m3u8 cutting the same file into 16 segments, and GET /stats with the
+# bytes sent to each address.
+EGRESS_SERVER = r"""
+import asyncio, json, sys, time
+
+port, path, rate, forbidden = int(sys.argv[1]), sys.argv[2], float(sys.argv[3]), sys.argv[4].split(",")
+content = open(path, "rb").read()
+step = len(content) // 16
+segments = [content[i * step:(i + 1) * step if i < 15 else len(content)] for i in range(16)]
+playlist = "#EXTM3U\n" + "".join(f"#EXTINF:4.0,\n/seg{i}.ts\n" for i in range(16)) + "#EXT-X-ENDLIST\n"
+sent, requests, free_at = {}, {}, {}
+
+
+async def handle(reader, writer):
+    address = writer.get_extra_info("peername")[0]
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, target = line.decode().split(" ")[:2]
+            start = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                name, value = header.decode().split(":", 1)
+                if name.lower() == "range":
+                    start = int(value.strip()[6:].split("-")[0])
+            requests[address] = requests.get(address, 0) + 1
+            status, extra = "200 OK", ""
+            if target == "/stats":
+                body = json.dumps(sent).encode()
+            elif address in forbidden and requests[address] > 2:
+                status, body = "403 Forbidden", b""
+            elif target == "/playlist.m3u8":
+                body = playlist.encode()
+            elif target.startswith("/seg"):
+                body = segments[int(target[4:].split(".")[0])]
+            else:
+                body = content[start:]
+                if start:
+                    status = "206 Partial Content"
+                    extra = f"Content-Range: bytes {start}-{len(content) - 1}/{len(content)}\r\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\nAccept-Ranges: bytes\r\n{extra}\r\n".encode())
+            if method == "HEAD":
+                continue
+            for i in range(0, len(body), 65536):
+                chunk = body[i:i + 65536]
+                if target != "/stats":
+                    # The address's share of the rate, whichever connection sends
+                    now = time.monotonic()
+                    free_at[address] = max(free_at.get(address, now), now) + len(chunk) / rate
+                    await asyncio.sleep(free_at[address] - len(chunk) / rate - now)
+                    sent[address] = sent.get(address, 0) + len(chunk)
+                writer.write(chunk)
+                await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    writer.close()
+
+
+async def main():
+    server = await asyncio.start_server(handle, "0.0.0.0", port, backlog=256)
+    async with server:
+        await server.serve_forever()
+
+
+asyncio.run(main())
+"""
+
+
+def bench_egress(episodes: int = 12, workers: int = 6, size_mb: int = 4, rate_mb: float = 4) -> bool:
+    """
+    Downloads `episodes` episodes from a stand-in host that throttles each client
+    address to `rate_mb` MB/s: through the default address, then spread over
+    three loopback addresses, one of which starts answering 403. Then downloads
+    two HLS episodes with their segments spread over the remaining addresses.
+    Checks the speed-up, that the refusing address is removed and every file is
+    complete.
+    """
+    import json
+    import threading
+    import urllib.request
+    from helper.batch import EpisodeBatch
+
+    size = size_mb * 1024 * 1024
+    names = [f"Series [{i + 1:02d}]" for i in range(episodes)]
+    data = {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+    members = ["127.0.0.2", "127.0.0.3", "127.0.0.4"]
+
+    print(f"{' Egress pool ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "video.mp4")
+        with open(source, "wb") as f:
+            f.write(os.urandom(size))
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen(
+            [sys.executable, "-c", EGRESS_SERVER, str(port), source, str(rate_mb * 2**20), members[-1]]
+        )
+        try:
+            for _ in range(50):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            def stats():
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=5) as response:
+                    return json.load(response)
+
+            def complete(folder, expected):
+                folder = os.path.join(directory, folder, "Series")
+                return sum(1 for file in os.listdir(folder) if os.path.getsize(os.path.join(folder, file)) == expected)
+
+            os.environ["BENCH_SOURCE"] = f"http://localhost:{port}/video.mp4"
+            results = {}
+            for run, egress in (("default", None), ("egress", members)):
+                helper = LocalSourceHelper(os.path.join(directory, run), egress=egress)
+                before = stats()
+                start = time.perf_counter()
+                EpisodeBatch(helper, data, names, workers).run(threading.Event())
+                results[run] = episodes * size / (time.perf_counter() - start) / 2**20
+                after = stats()
+                spread = {address: (sent - before.get(address, 0)) / 2**20 for address, sent in after.items()}
+                done = complete(run, size)
+                print(
+                    f"{run:<8} {results[run]:5.1f} MB/s, {done}/{episodes} complete, MB per address: "
+                    + ", ".join(f"{address} {mb:.0f}" for address, mb in sorted(spread.items()) if mb)
+                )
+                ok = done == episodes if run == "default" else ok and done == episodes
+            pool = helper.egress_pool
+            removed = [member["name"] for member in pool.members if member["removed"]]
+            print(f"Removed after 403s: {removed or 'none'}")
+            ok &= removed == [members[-1]] and results["egress"] >= 1.6 * results["default"]
+
+            # ------------ HLS segments spread over the members ------------
+            os.environ["BENCH_SOURCE"] = f"http://localhost:{port}/playlist.m3u8"
+            before = stats()
+            EpisodeBatch(helper, data, names[:2], 2).run(threading.Event())
+            after = stats()
+            used = sorted(address for address, sent in after.items() if sent > before.get(address, 0))
+            with open(source, "rb") as f, open(helper.check_filename(f"{directory}/egress/Series", names[0], "ts"), "rb") as g:
+                identical = f.read() == g.read()
+            print(f"HLS: segments fetched through {used}, file {'identical' if identical else 'DIFFERENT'}")
+            # The playlist itself comes through the default address
+            ok &= set(members[:2]) <= set(used) and members[-1] not in used and identical
+        finally:
+            server.terminate()
+            server.wait()
+            os.environ.pop("BENCH_SOURCE", None)
+
+    print(f"Egress vs default: {results['egress'] / results['default']:.1f}x")
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def bench_integrity(size_mb: int = 8, torn_kb: int = 20) -> bool:
+    """
+    Resumes partial files left in four states: a valid prefix, a prefix whose last
+    `torn_kb` KB were never written (zeros), the start of a different file, and a
+    complete file with garbage appended. Checks where each is truncated, how many
+    ranged requests the check costs, and that every file ends up identical to the
+    source.
+    """
+    import logging
+    from helper.anime1_fetch import DownloadHelper, DOWNLOADING_EXTENSION
+
+    size = size_mb * 1024 * 1024
+    half = size // 2
+    content = os.urandom(size)
+    torn = torn_kb * 1024
+    partials = {
+        "prefix": (content[:half], half),
+        "torn": (content[: half - torn] + bytes(torn), half - torn),
+        "replaced": (os.urandom(half), 0),
+        "longer": (content + os.urandom(1024 * 1024), size),
+    }
+
+    print(f"{' Resume integrity check ':=^60}")
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "video.mp4")
+        with open(source, "wb") as f:
+            f.write(content)
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen([sys.executable, "-c", RANGE_SERVER, str(port), source])
+        try:
+            for _ in range(50):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            helper = DownloadHelper(directory, logging.getLogger("bench.integrity"))
+            checks = []
+            fetch_range = helper.fetch_range
+
+            def counted(*args):
+                checks.append(args)
+                return fetch_range(*args)
+
+            helper.fetch_range = counted
+            verify_partial = helper.verify_partial
+            kept = {}
+
+            def timed(_id, *args):
+                start = time.perf_counter()
+                kept[_id] = (verify_partial(_id, *args), time.perf_counter() - start)
+                return kept[_id][0]
+
+            helper.verify_partial = timed
+            folder = os.path.join(directory, "Series")
+            os.makedirs(folder)
+            for name, (partial, expected) in partials.items():
+                with open(helper.check_filename(folder, name) + DOWNLOADING_EXTENSION, "wb") as f:
+                    f.write(partial)
+                checks.clear()
+                helper.download_video(name, {"url": f"http://127.0.0.1:{port}/video.mp4", "download_path": folder}, helper.new_session())
+                with open(helper.check_filename(folder, name), "rb") as f:
+                    identical = f.read() == content
+                verified, elapsed = kept[name]
+                print(
+                    f"{name:<9} kept {verified:>8} of {len(partial):>8} bytes (expected {expected:>8}), "
+                    f"{len(checks)} ranged requests, {elapsed * 1000:5.1f} ms, file {'identical' if identical else 'DIFFERENT'}"
+                )
+                ok &= verified == expected and identical
+                ok &= len(checks) <= (10 if name == "replaced" else 1)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+OUTAGE_SERVER = r"""
+import asyncio, json, sys, time
+
+port, path = int(sys.argv[1]), sys.argv[2]
+content = open(path, "rb").read()
+stats = {"failed": 0, "served": 0}
+outage_until = 0.0
+
+
+async def handle(reader, writer):
+    global outage_until
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, target = line.decode().split(" ")[:2]
+            start = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                name, value = header.decode().split(":", 1)
+                if name.lower() == "range":
+                    start = int(value.strip()[6:].split("-")[0])
+            status, extra = "200 OK", ""
+            if target.startswith("/outage/"):
+                outage_until = time.monotonic() + float(target[8:])
+                body = b""
+            elif target == "/stats":
+                body = json.dumps(stats).encode()
+            elif time.monotonic() < outage_until:
+                stats["failed"] += 1
+                status, body = "503 Service Unavailable", b""
+            else:
+                stats["served"] += 1
+                body = content[start:]
+                if start:
+                    status = "206 Partial Content"
+                    extra = f"Content-Range: bytes {start}-{len(content) - 1}/{len(content)}\r\n"
+            head = f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\nAccept-Ranges: bytes\r\n{extra}\r\n"
+            writer.write(head.encode() + (b"" if method == "HEAD" else body))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+async def main():
+    server = await asyncio.start_server(handle, "127.0.0.1", port, backlog=256)
+    async with server:
+        await server.serve_forever()
+
+
+asyncio.run(main())
+"""
+
+
+def bench_circuit(episodes: int = 30, workers: int = 4, outage: float = 2.0, size_kb: int = 256) -> bool:
+    """
+    Downloads `episodes` episodes from a stand-in host that answers 503 for the
+    first `outage` seconds, without and with the circuit breaker (opening after 3
+    failed answers). Checks that with the breaker every episode completes, that
+    few requests are sent during the outage and that the circuit closes.
+    """
+    import json
+    import logging
+    import threading
+    import urllib.request
+    from helper.batch import EpisodeBatch
+
+    size = size_kb * 1024
+    names = [f"Series [{i + 1:02d}]" for i in range(episodes)]
+    data = {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+    # The failed episodes of the run without breaker would flood the output
+    quiet = logging.getLogger("bench.circuit")
+    quiet.setLevel(logging.CRITICAL)
+
+    print(f"{' Circuit breaker ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "video.mp4")
+        with open(source, "wb") as f:
+            f.write(os.urandom(size))
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen([sys.executable, "-c", OUTAGE_SERVER, str(port), source])
+        try:
+            for _ in range(50):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            def get(path):
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+                    return json.loads(response.read() or b"null")
+
+            os.environ["BENCH_SOURCE"] = f"http://127.0.0.1:{port}/video.mp4"
+            results = {}
+            for run, failures in (("off", 0), ("breaker", 3)):
+                helper = LocalSourceHelper(
+                    os.path.join(directory, run),
+                    quiet if run == "off" else logging.getLogger(),
+                    circuit_failures=failures,
+                    circuit_cooldown=0.25,
+                )
+                before = get("/stats")
+                get(f"/outage/{outage}")
+                start = time.perf_counter()
+                done = EpisodeBatch(helper, data, names, workers, logger=quiet).run(threading.Event())
+                elapsed = time.perf_counter() - start
+                failed = get("/stats")["failed"] - before["failed"]
+                circuit = helper.health.states().get("127.0.0.1", {})
+                results[run] = (done, failed, circuit)
+                print(
+                    f"{run:<8} {done}/{episodes} episodes done in {elapsed:.1f} s, {failed} requests failed, "
+                    f"circuit {circuit.get('state')} after opening {circuit.get('opened', 0)}x"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+            os.environ.pop("BENCH_SOURCE", None)
+
+    done, failed, circuit = results["breaker"]
+    # Failures until the circuit opens (one per worker at most) and one per failed probe
+    ok = failed <= 3 + workers + circuit.get("opened", 0) and circuit.get("state") == "closed"
+    # The episodes whose failures opened the circuit try again too, every episode completes
+    ok &= done == episodes and results["off"][0] < done
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def bench_playnext(episodes: int = 6, workers: int = 3, size_mb: int = 16, rate_mb: float = 8, start_mb: int = 2) -> bool:
+    """
+    Downloads `episodes` episodes with `workers` workers over a link limited to
+    `rate_mb` MB/s and asks for the last one after a second: once as a normal
+    batch, where it waits for a worker and then shares the link, and once played
+    next, streamed from the local endpoint. Compares how long a player waits for
+    the first `start_mb` MB and the share of the link the episode gets, and checks
+    the streamed bytes and every file.
+    """
+    import http.client
+    import json
+    import threading
+    import urllib.request
+    from urllib.parse import urlparse
+    from helper.batch import EpisodeBatch
+    from helper.stream import StreamServer
+
+    size = size_mb * 1024 * 1024
+    names = [f"Series [{i + 1:02d}]" for i in range(episodes)]
+    data = {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+    target = names[-1]
+
+    print(f"{' Play next ':=^60}")
+    ok = True
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "video.mp4")
+        content = os.urandom(size)
+        with open(source, "wb") as f:
+            f.write(content)
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        # Every connection comes from 127.0.0.1: the per-address rate is the link
+        server = subprocess.Popen([sys.executable, "-c", EGRESS_SERVER, str(port), source, str(rate_mb * 2**20), "-"])
+        stream = None
+        try:
+            for _ in range(50):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            os.environ["BENCH_SOURCE"] = f"http://127.0.0.1:{port}/video.mp4"
+
+            results = {}
+            for run in ("batch", "play next"):
+                helper = LocalSourceHelper(os.path.join(directory, run.replace(" ", "_")))
+                batch = EpisodeBatch(helper, data, names, workers)
+                thread = threading.Thread(target=batch.run, args=(threading.Event(),))
+                start = time.perf_counter()
+                thread.start()
+                time.sleep(1)
+                asked = time.perf_counter()
+                streamed = b""
+                if run == "batch":
+                    while helper.process.get(target, {}).get("downloaded_size", 0) < start_mb * 2**20:
+                        time.sleep(0.02)
+                    waited = time.perf_counter() - asked
+                    while not helper.process[target].get("success"):
+                        time.sleep(0.02)
+                else:
+                    batch.play_next(target)
+                    stream = StreamServer(helper)
+                    stream.serve("127.0.0.1", 0)
+                    url = urlparse(stream.url(target))
+                    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+                    connection.request("GET", url.path, headers={"Range": "bytes=0-"})
+                    response = connection.getresponse()
+                    streamed = response.read(start_mb * 2**20)
+                    waited = time.perf_counter() - asked
+                    streamed += response.read()
+                    connection.close()
+                    ok &= response.status == 206 and streamed == content
+                # After the first `start_mb` MB
+                share = (size - start_mb * 2**20) / (time.perf_counter() - asked - waited) / (rate_mb * 2**20)
+                thread.join()
+                elapsed = time.perf_counter() - start
+                folder = os.path.join(directory, run.replace(" ", "_"), "Series")
+                done = sum(1 for file in os.listdir(folder) if os.path.getsize(os.path.join(folder, file)) == size)
+                results[run] = (waited, share)
+                print(
+                    f"{run:<10} first {start_mb} MB of the last episode after {waited:5.2f} s, then "
+                    f"{share:4.0%} of the link, batch {elapsed:5.1f} s, {done}/{episodes} complete"
+                    + (f", streamed {len(streamed) / 2**20:.0f} MB {'identical' if streamed == content else 'DIFFERENT'}" if streamed else "")
+                )
+                ok &= done == episodes
+        finally:
+            if stream is not None:
+                stream.shutdown()
+            server.terminate()
+            server.wait()
+            os.environ.pop("BENCH_SOURCE", None)
+
+    ok &= results["play next"][0] < 0.3 * results["batch"][0] and results["play next"][1] >= 0.5
+    print(f"Player start: {results['batch'][0] / results['play next'][0]:.1f}x sooner")
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+S3_SERVER = r"""
+import asyncio, base64, hashlib, hmac, json, re, sys
+from urllib.parse import parse_qsl, unquote
+
+port, secret, rate = int(sys.argv[1]), sys.argv[2], float(sys.argv[3])
+uploads, objects = {}, {}
+stats = {"parts": 0, "active": 0, "max_active": 0, "bad_signature": 0, "completed": 0}
+XMLNS = "xmlns='http://s3.amazonaws.com/doc/2006-03-01/'"
+
+
+def signature(method, path, query, headers):
+    # SigV4 recomputed from the request as received
+    authorization = headers["authorization"]
+    names = authorization.split("SignedHeaders=")[1].split(",")[0].split(";")
+    scope = authorization.split("Credential=")[1].split(",")[0].split("/", 1)[1]
+    canonical = "\n".join(
+        [method, path, query, "".join(f"{name}:{headers[name]}\n" for name in names), ";".join(names), headers["x-amz-content-sha256"]]
+    )
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", headers["x-amz-date"], scope, hashlib.sha256(canonical.encode()).hexdigest()])
+    key = f"AWS4{secret}".encode()
+    for part in scope.split("/"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def answer(method, path, query, headers, body):
+    if "authorization" not in headers or not headers["authorization"].endswith(
+        "Signature=" + signature(method, path, query, headers)
+    ):
+        stats["bad_signature"] += 1
+        return "403 Forbidden", b"<Error><Code>SignatureDoesNotMatch</Code></Error>", ""
+    key = unquote(path)
+    params = dict(parse_qsl(query, keep_blank_values=True))
+    upload = uploads.get(params.get("uploadId"))
+    if method == "POST" and "uploads" in params:
+        upload_id = str(len(uploads) + stats["completed"] + 1)
+        uploads[upload_id] = {"key": key, "parts": {}}
+        return "200 OK", f"<InitiateMultipartUploadResult {XMLNS}><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>".encode(), ""
+    if "uploadId" in params and upload is None:
+        return "404 Not Found", b"<Error><Code>NoSuchUpload</Code></Error>", ""
+    if method == "PUT":
+        if base64.b64encode(hashlib.md5(body).digest()).decode() != headers.get("content-md5"):
+            return "400 Bad Request", b"<Error><Code>BadDigest</Code></Error>", ""
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        upload["parts"][int(params["partNumber"])] = (etag, body)
+        stats["parts"] += 1
+        return "200 OK", b"", f"ETag: {etag}\r\n"
+    if method == "GET" and upload is not None:
+        # Two parts per page, so clients have to follow the markers
+        numbers = sorted(n for n in upload["parts"] if n > int(params.get("part-number-marker", 0)))
+        page, truncated = numbers[:2], len(numbers) > 2
+        parts = "".join(
+            f"<Part><PartNumber>{n}</PartNumber><ETag>{upload['parts'][n][0]}</ETag><Size>{len(upload['parts'][n][1])}</Size></Part>"
+            for n in page
+        )
+        marker = f"<NextPartNumberMarker>{page[-1]}</NextPartNumberMarker>" if truncated else ""
+        return "200 OK", f"<ListPartsResult {XMLNS}><IsTruncated>{str(truncated).lower()}</IsTruncated>{marker}{parts}</ListPartsResult>".encode(), ""
+    if method == "POST" and upload is not None:
+        listed = [(int(n), etag) for n, etag in re.findall(r"<PartNumber>(\d+)</PartNumber><ETag>(.*?)</ETag>", body.decode())]
+        if [n for n, _ in listed] != list(range(1, len(listed) + 1)) or any(upload["parts"].get(n, ("",))[0] != etag for n, etag in listed):
+            return "400 Bad Request", b"<Error><Code>InvalidPart</Code></Error>", ""
+        if any(len(upload["parts"][n][1]) < 5 * 2**20 for n, _ in listed[:-1]):
+            return "400 Bad Request", b"<Error><Code>EntityTooSmall</Code></Error>", ""
+        objects[key] = b"".join(upload["parts"][n][1] for n, _ in listed)
+        del uploads[params["uploadId"]]
+        stats["completed"] += 1
+        return "200 OK", f"<CompleteMultipartUploadResult {XMLNS}><Key>{key}</Key></CompleteMultipartUploadResult>".encode(), ""
+    if method == "DELETE" and upload is not None:
+        del uploads[params["uploadId"]]
+        return "204 No Content", b"", ""
+    if key in objects:
+        return "200 OK", objects[key], ""
+    return "404 Not Found", b"<Error><Code>NoSuchKey</Code></Error>", ""
+
+
+async def handle(reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, target = line.decode().split(" ")[:2]
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                name, value = header.decode().split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            path, _, query = target.partition("?")
+            if path == "/stats":
+                status, out, extra = "200 OK", json.dumps({**stats, "open": len(uploads)}).encode(), ""
+            else:
+                if method == "PUT":
+                    # The upload link of each connection
+                    stats["active"] += 1
+                    stats["max_active"] = max(stats["max_active"], stats["active"])
+                    await asyncio.sleep(len(body) / rate)
+                    stats["active"] -= 1
+                status, out, extra = answer(method, path, query, headers, body)
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: {len(out)}\r\n{extra}\r\n".encode())
+            if method != "HEAD":
+                writer.write(out)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+        pass
+    writer.close()
+
+
+async def main():
+    server = await asyncio.start_server(handle, "127.0.0.1", port, backlog=256)
+    async with server:
+        await server.serve_forever()
+
+
+asyncio.run(main())
+"""
+
+
+def bench_storage(episodes: int = 3, workers: int = 3, size_mb: int = 36, rate_mb: float = 48, upload_mb: float = 16) -> bool:
+    """
+    Downloads `episodes` episodes into a stand-in S3 bucket (multipart uploads,
+    signatures checked, `upload_mb` MB/s per connection) from a source sending
+    `rate_mb` MB/s. Checks that every object is identical, that nothing is left
+    on the local disk and that parts upload in parallel. Then stops a download
+    after two parts and restarts it with a new helper, which must resume after the
+    journaled parts instead of fetching and uploading them again, and uploads an
+    HLS episode (assembled locally, then uploaded).
+    """
+    import json
+    import threading
+    import urllib.request
+    from helper.batch import EpisodeBatch
+    from helper.storage import JOURNAL_DIR, PART_SIZE
+
+    size = size_mb * 1024 * 1024
+    parts = -(-size // PART_SIZE)
+    names = [f"Series [{i + 1:02d}]" for i in range(episodes)]
+    data = {"title": "Series", "url": "local", "names": names, "data": {name: name for name in names}}
+    secret = "bench-secret"
+
+    print(f"{' Storage sink ':=^60}")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "video.mp4")
+        content = os.urandom(size)
+        with open(source, "wb") as f:
+            f.write(content)
+        ports = []
+        for _ in range(2):
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                ports.append(sock.getsockname()[1])
+        servers = [
+            subprocess.Popen([sys.executable, "-c", EGRESS_SERVER, str(ports[0]), source, str(rate_mb * 2**20), "-"]),
+            subprocess.Popen([sys.executable, "-c", S3_SERVER, str(ports[1]), secret, str(upload_mb * 2**20)]),
+        ]
+        try:
+            for port in ports:
+                for _ in range(50):
+                    try:
+                        socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+
+            def stats(port):
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=5) as response:
+                    return json.load(response)
+
+            def fetched():
+                return sum(stats(ports[0]).values())
+
+            storage = {
+                "sink": "s3",
+                "endpoint": f"http://127.0.0.1:{ports[1]}",
+                "bucket": "bench",
+                "prefix": "anime",
+                "access_key": "bench",
+                "secret_key": secret,
+                "upload_workers": 4,
+            }
+            download_path = os.path.join(directory, "downloads")
+
+            def helper():
+                return LocalSourceHelper(download_path, storage=storage)
+
+            def object_of(sink, name, extension="mp4"):
+                from helper.anime1_fetch import DownloadHelper
+
+                key = sink.key(DownloadHelper.check_filename(f"{download_path}/Series", str(name), extension))
+                response = sink.client.request("GET", key, ok=(200, 404))
+                return response.content if response.status_code == 200 else None
+
+            def local_files():
+                return [
+                    os.path.join(root, file)
+                    for root, _, files in os.walk(download_path)
+                    for file in files
+                ]
+
+            # ------------ A batch streamed to the bucket ------------
+            os.environ["BENCH_SOURCE"] = f"http://127.0.0.1:{ports[0]}/video.mp4"
+            first = helper()
+            start = time.perf_counter()
+            done = EpisodeBatch(first, data, names, workers).run(threading.Event())
+            elapsed = time.perf_counter() - start
+            after = stats(ports[1])
+            identical = sum(1 for name in names if object_of(first.storage, name) == content)
+            print(
+                f"Batch: {done}/{episodes} episodes in {elapsed:.1f} s ({episodes * size / elapsed / 2**20:.1f} MB/s), "
+                f"{identical} objects identical, {after['parts']} parts, up to {after['max_active']} uploading at once"
+            )
+            print(f"Local files left: {local_files() or 'none'}")
+            ok = done == identical == episodes and after["parts"] == episodes * parts and after["max_active"] >= 2
+            ok &= not local_files() and after["open"] == 0 and after["bad_signature"] == 0
+
+            # ------------ Resumed after a restart ------------
+            name = "Resumed [01]"
+            resumed = {"title": "Series", "url": "local", "names": [name], "data": {name: name}}
+            second = helper()
+            stop = threading.Event()
+            thread = threading.Thread(target=EpisodeBatch(second, resumed, [name], 1).run, args=(stop,))
+            thread.start()
+            journal = None
+            while thread.is_alive():
+                uploads = list(second.storage.uploads.values())
+                if uploads and len(uploads[0]["parts"]) >= 2:
+                    journal = uploads[0]
+                    break
+                time.sleep(0.01)
+            stop.set()
+            second.stop()
+            thread.join()
+            kept = second.storage.contiguous(journal) if journal else 0
+            before = stats(ports[1])["parts"]
+            fetched_before = fetched()
+            # A new helper knows the upload from the journal only
+            third = helper()
+            done = EpisodeBatch(third, resumed, [name], 1).run(threading.Event())
+            uploaded = stats(ports[1])["parts"] - before
+            refetched = fetched() - fetched_before
+            identical = object_of(third.storage, name) == content
+            print(
+                f"Restart: {kept} parts kept in the journal, {refetched / 2**20:.1f} MB fetched and "
+                f"{uploaded} parts uploaded after the restart, object {'identical' if identical else 'DIFFERENT'}"
+            )
+            ok &= done == 1 and identical and kept >= 2 and uploaded == parts - kept
+            ok &= refetched <= size - kept * PART_SIZE + 2**20
+            ok &= not os.listdir(os.path.join(download_path, JOURNAL_DIR))
+
+            # ------------ HLS, assembled locally then uploaded ------------
+            os.environ["BENCH_SOURCE"] = f"http://127.0.0.1:{ports[0]}/playlist.m3u8"
+            hls_name = "Stream [01]"
+            hls_data = {"title": "Series", "url": "local", "names": [hls_name], "data": {hls_name: hls_name}}
+            done = EpisodeBatch(helper(), hls_data, [hls_name], 1).run(threading.Event())
+            identical = object_of(third.storage, hls_name, "ts") == content
+            print(f"HLS: object {'identical' if identical else 'DIFFERENT'}, local files left: {local_files() or 'none'}")
+            ok &= done == 1 and identical and not local_files()
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+            os.environ.pop("BENCH_SOURCE", None)
+
+    print(f"Result: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def urllib_open(url: str, cafile: str):
+    import ssl
+    import urllib.request
+
+    return urllib.request.urlopen(url, context=ssl.create_default_context(cafile=cafile), timeout=5)
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "transfer": bench_transfer,
+    "distributed": bench_distributed,
+    "catalog": bench_catalog,
+    "parse": bench_parse,
+    "sharding": bench_sharding,
+    "scheduling": bench_scheduling,
+    "eta": bench_eta,
+    "http2": bench_http2,
+    "cancel": bench_cancel,
+    "logging": bench_logging,
+    "reconfigure": bench_reconfigure,
+    "control": bench_control,
+    "warmup": bench_warmup,
+    "egress": bench_egress,
+    "circuit": bench_circuit,
+    "integrity": bench_integrity,
+    "playnext": bench_playnext,
+    "storage": bench_storage,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    failed = [name for name in names if not BENCHMARKS[name]()]
+    sys.exit(1 if failed else 0)
@@ -1,10 +1,28 @@
+from __future__ import annotations
+
 import json
 import logging
 import os
 import re
-from bs4 import BeautifulSoup
-import requests
+import statistics
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pprint import pprint
+from urllib.parse import urlparse
+
+from helper import hls
+from helper.content_index import materialize
+from helper.health import HostHealth, FAILURE_LIMIT, COOLDOWN, EPISODE_RETRIES
+from helper.lazy_import import lazy_import
+from helper.transfer import BandwidthLimiter, BufferPool, iter_readinto, release_response, BUFFER_SIZE
+from helper.source_select import SourceSelector, MIN_SWITCH_INTERVAL
+from helper.watchdog import StallWatchdog, CONNECT_TIMEOUT, READ_TIMEOUT
+
+# Loaded on first use to keep start-up fast
+bs4 = lazy_import("bs4")
+requests = lazy_import("requests")
+http_client = lazy_import("http.client")
 
 HEADERS = {
     "accept": "/",
@@ -25,23 +43,292 @@ HEADERS = {
 DOWNLOADING_EXTENSION = ".downloading"
 
 API_URL = "https://v.anime1.me/api"
+API_HOST = urlparse(API_URL).hostname
+
+RATE_WINDOW = 2  # seconds between throughput measurements of a transfer
+PAGE_WINDOW = 8  # series pages fetched concurrently
+PARSE_POOL_MIN_PAGES = 8  # pages parsed in-thread before a series uses the process pool
+PLAN_TTL = 600  # seconds a prepared episode (session, source, size) stays usable
+# While a "play next" episode transfers, the others share this part of its rate,
+# starting from BACKGROUND_START bytes/s until it is measured
+PRIORITY_SHARE = 0.2
+BACKGROUND_START = 256 * 1024
+TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+
+def parse_video_page(html, url: str, logger: logging = logging) -> dict:
+    """
+    Extracts the title and episodes from an anime1.me category page.
+    Args:
+        html (str | bytes): The page content.
+        url (str): The URL of the page, used in log messages.
+        logger (logging): The logger to use.
+    Returns:
+        dict: See DownloadHelper.get_video_data_me, or None if the page has no video.
+    """
+    data = {"title": "", "total episode": 0, "names": [], "data": {}}
+
+    # ----------- Parsing data -----------
+    # Parse the HTML content using BeautifulSoup
+
+    soup = bs4.BeautifulSoup(html, "html.parser")
+
+    # ----------- Extracting title -----------
+    header_tag = soup.find("header", class_="page-header")
+    if header_tag:
+        title = header_tag.find("h1").text
+    else:
+        meta_tag = soup.find("meta", attrs={"name": "keywords"})
+        if meta_tag:
+            title = meta_tag["content"]
+        else:
+            title = "Unknown"
+            logger.warning("Title not found for %s", url)
+
+    data["title"] = title
+
+    # ----------- Extracting video data -----------
+    articles = soup.find_all("article")
+    for article in articles:
+        name_tag = article.find("h2", class_="entry-title")
+        if name_tag:
+            name = name_tag.text.strip()
+        else:
+            name = "Unknown"
+            logger.warning("Name not found in article for %s", url)
+
+        video_ele = article.find("video")
+        if video_ele and "data-apireq" in video_ele.attrs:
+            video_data = video_ele["data-apireq"]
+            data["total episode"] += 1
+            data["names"].append(name)
+            data["data"][name] = video_data
+        else:
+            logger.warning(
+                "Video element or data-apireq attribute not found in article for %s", url
+            )
+
+    numeric_positions = [(i, int(re.search(r'\[(\d+)\]', name).group(1))) for i, name in enumerate(data['names']) if re.search(r'\[(\d+)\]', name)]
+
+    for i in range(len(numeric_positions) - 1):
+        start_pos, start_val = numeric_positions[i]
+        end_pos, end_val = numeric_positions[i + 1]
+        gap = end_pos - start_pos - 1
+        
+        if gap > 0:
+            for j in range(1, gap + 1):
+                gap_pos = start_pos + j
+                new_value = start_val + j * (end_val - start_val) / (gap + 1)
+                original_string = data['names'][gap_pos]
+                data['names'][gap_pos] = re.sub(r'\[.*?\]', f'[{new_value:.1f} {original_string[original_string.index("[") + 1:-1]}]', original_string)
+                # Keep the API data reachable under the new name
+                data['data'][data['names'][gap_pos]] = data['data'].pop(original_string)
+
+    if numeric_positions:
+        start = numeric_positions[0][1]
+        end = numeric_positions[-1][1]            
+        if start > end:
+            data["names"].reverse()
+    else:
+        logger.error("No video found in the page")
+        return None
+
+    soup.find_all("player_html5_api")
+    return data
 
 
 class DownloadHelper:
-    def __init__(self, download_path: str, logger: logging = logging) -> None:
+    def __init__(
+        self,
+        download_path: str,
+        logger: logging = logging,
+        hls_workers: int = 4,
+        adapter=None,
+        content_index=None,
+        sync_writes: bool = False,
+        parse_workers: int = None,
+        http2: bool = False,
+        bandwidth_limit: float = 0,
+        dns_ttl: float = 0,
+        egress: list = None,
+        circuit_failures: int = FAILURE_LIMIT,
+        circuit_cooldown: float = COOLDOWN,
+        storage: dict = None,
+    ) -> None:
         self.download_path = download_path
         self.logger = logger
+        self.hls_workers = hls_workers
+        # Combined rate cap of the transfers in bytes/s, 0 for none (see set_bandwidth_limit)
+        self.bandwidth = BandwidthLimiter(bandwidth_limit)
+        # Episode downloaded first with most of the bandwidth (see set_priority), and
+        # the cap of the other transfers while it runs
+        self.priority = None
+        self.background = BandwidthLimiter()
+        # Transport adapter shared by every session of this helper (e.g. PoliteAdapter),
+        # so its connections are reused across episodes; created on first use if None
+        self.adapter = adapter
+        self._adapter_lock = threading.Lock()
+        # Source addresses and proxies transfers are spread over (see EgressPool)
+        self.egress = list(egress or [])
+        self._egress_pool = None
+        # Where finished episodes are stored: the [STORAGE] settings (a plain dict, so
+        # shard processes can be given it), local files by default (see create_sink)
+        from helper.storage import create_sink
+
+        self.storage = create_sink(storage, download_path, logger)
+        # ContentIndex used to reuse identical local files, None to always download
+        self.content_index = content_index if not self.storage.remote else None
+        # fsync progressive downloads every SYNC_BYTES, so a power loss loses little
+        self.sync_writes = sync_writes
+        # Processes parsing the pages of long series, 1 to parse in-thread only
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        # Send API calls and series pages over a multiplexed HTTP/2 connection
+        self.http2 = http2
+        self._multiplexed = None
+        if dns_ttl > 0:
+            # Process-wide: every session and the HTTP/2 client resolve through it
+            from helper.warmup import install_dns_cache
+
+            install_dns_cache(dns_ttl, logger)
+        self._multiplexed_lock = threading.Lock()
 
         self.total_eps = 0
         self.download_stop = False
+        # Episodes whose transfer was cancelled on their own (see cancel), and the
+        # ones of those that are only paused
+        self.cancelled = set()
+        self.paused = set()
+        # Open transfers of each episode (anything with an abort() method)
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        # Episodes resolved ahead of their download (see prepare_episode)
+        self.prepared = {}
+        # Start of the current run of each episode, and the seconds from its start
+        # to its first video byte (see first_byte)
+        self.started = {}
+        self.ttfb = {}
 
         self.process = {}
         self.total_size = 0
         self.downloaded_size = 0
         self.finished = 0
 
+        self.source_selector = SourceSelector(logger)
+        self.watchdog = StallWatchdog(logger)
+        # Answers of each host; new work to a failing host waits (see HostHealth)
+        self.health = HostHealth(circuit_failures, circuit_cooldown, logger)
+
         self.logger.debug("DownloadHelper initialized")
 
+    def cancel(self, _id) -> None:
+        """
+        Stops the transfer of one episode, keeping its partial file. The connection
+        is closed, so a transfer blocked on a stalled socket stops at once too.
+        """
+        self.cancelled.add(_id)
+        self.abort_connections(_id)
+
+    def pause(self, _id) -> None:
+        """
+        Stops the transfer of one episode like cancel; resume() lets it run again
+        from where it stopped.
+        """
+        self.paused.add(_id)
+        self.cancel(_id)
+
+    def resume(self, _id) -> None:
+        self.paused.discard(_id)
+        self.cancelled.discard(_id)
+
+    def stop(self) -> None:
+        """
+        Stops every transfer and closes their connections. Partial files are kept.
+        """
+        self.download_stop = True
+        self.abort_connections()
+
+    @property
+    def dropped(self) -> set:
+        """
+        Episodes cancelled for good; paused episodes are cancelled too until resumed.
+        """
+        return self.cancelled - self.paused
+
+    def stopped(self, _id) -> bool:
+        return self.download_stop or _id in self.cancelled
+
+    def set_hls_workers(self, hls_workers: int) -> None:
+        """
+        Changes how many segments an HLS episode fetches at once, including the
+        episodes already downloading.
+        """
+        self.hls_workers = max(hls_workers, 1)
+        with self.connections_lock:
+            transfers = [transfer for group in self.connections.values() for transfer in group]
+        for transfer in transfers:
+            if isinstance(transfer, hls.SegmentWriter):
+                transfer.window = min(self.hls_workers, hls.MAX_WINDOW)
+
+    def set_bandwidth_limit(self, rate: float) -> None:
+        """
+        Changes the combined rate cap of the transfers, in bytes/s (0 for none).
+        """
+        self.bandwidth.set_rate(rate)
+
+    def set_priority(self, _id) -> None:
+        """
+        Gives one episode most of the bandwidth: while it transfers, the other
+        transfers together are held to PRIORITY_SHARE of its rate. None ends it.
+        """
+        self.priority = _id
+        self.background.set_rate(0 if _id is None else BACKGROUND_START)
+        if _id is not None:
+            self.logger.info("%3s | Downloading first", _id)
+
+    def yield_to_priority(self, _id, size: int) -> None:
+        """
+        Called with the bytes each transfer receives: holds the transfers of other
+        episodes back while the priority episode transfers.
+        """
+        priority = self.priority
+        if priority is None or priority == _id or priority not in self.connections:
+            return
+        self.background.consume(size, lambda: self.stopped(_id) or self.priority != priority)
+
+    def priority_rate(self, _id, rate: float) -> None:
+        """
+        Records the rate of a transfer, which sets the cap of the others when it is
+        the priority episode.
+        """
+        if _id == self.priority:
+            self.background.set_rate(max(rate * PRIORITY_SHARE, BACKGROUND_START))
+
+    def track(self, _id, transfer) -> None:
+        with self.connections_lock:
+            self.connections.setdefault(_id, set()).add(transfer)
+        if self.stopped(_id):
+            # Stopped while the transfer was being opened
+            transfer.abort()
+
+    def untrack(self, _id, transfer) -> None:
+        with self.connections_lock:
+            transfers = self.connections.get(_id, set())
+            transfers.discard(transfer)
+            if not transfers:
+                self.connections.pop(_id, None)
+
+    def abort_connections(self, _id=None) -> None:
+        """
+        Aborts the open transfers of one episode, or of every episode.
+        """
+        with self.connections_lock:
+            if _id is None:
+                transfers = [transfer for group in self.connections.values() for transfer in group]
+            else:
+                transfers = list(self.connections.get(_id, ()))
+        for transfer in transfers:
+            transfer.abort()
+
     def get_video_data_me(self, url: str) -> dict:
         """
         Fetches video data from a given URL.
@@ -57,96 +344,266 @@ class DownloadHelper:
                 - "names" (list): A list of names associated with the video data.
                 - "data" (dict): A dictionary mapping names to their corresponding video data.
         """
-        self.logger.debug(f"Fetching video data for {url}")
-        data = {"title": "", "total episode": 0, "names": [], "data": {}}
+        self.logger.debug("Fetching video data for %s", url)
 
         # ----------- Fetching data from website -----------
         try:
             response = requests.get(url, timeout=10)
             response.raise_for_status()  # Raise an HTTPError for bad responses
             # if response.status_code != 200:
-            #     self.logger.error(f"Failed to fetch URL {url}. Status code: {response.status_code}")
+            #     self.logger.error("Failed to fetch URL %s. Status code: %s", url, response.status_code)
             #     raise requests.RequestException(response)
         except requests.RequestException as e:
             raise e
 
-        # ----------- Parsing data -----------
-        # Parse the HTML content using BeautifulSoup
+        data = parse_video_page(response.text, url, self.logger)
+        if data is not None:
+            self.logger.debug("Anime data fetched successfully")
+        return data
 
-        soup = BeautifulSoup(response.text, "html.parser")
+    def new_session(self) -> requests.Session:
+        """
+        Creates a session with its own cookies that sends through the shared adapter
+        and records every answer in the health of its host.
+        """
+        if self.adapter is None:
+            with self._adapter_lock:
+                if self.adapter is None:
+                    self.adapter = self.new_adapter()
+        session = requests.Session()
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+        session.hooks["response"].append(self.health.observe)
+        return session
 
-        # ----------- Extracting title -----------
-        header_tag = soup.find("header", class_="page-header")
-        if header_tag:
-            title = header_tag.find("h1").text
-        else:
-            meta_tag = soup.find("meta", attrs={"name": "keywords"})
-            if meta_tag:
-                title = meta_tag["content"]
-            else:
-                title = "Unknown"
-                self.logger.warning(f"Title not found for {url}")
+    def new_adapter(self):
+        """
+        Creates a transport adapter like the shared one: under the same HostLimiter
+        when there is one, with POOL_SIZE idle connections per host.
+        """
+        from helper.warmup import POOL_SIZE
 
-        data["title"] = title
+        limiter = getattr(self.adapter, "limiter", None)
+        if limiter is not None:
+            from helper.politeness import PoliteAdapter
 
-        # ----------- Extracting video data -----------
-        articles = soup.find_all("article")
-        for article in articles:
-            name_tag = article.find("h2", class_="entry-title")
-            if name_tag:
-                name = name_tag.text.strip()
-            else:
-                name = "Unknown"
-                self.logger.warning(f"Name not found in article for {url}")
-
-            video_ele = article.find("video")
-            if video_ele and "data-apireq" in video_ele.attrs:
-                video_data = video_ele["data-apireq"]
-                data["total episode"] += 1
-                data["names"].append(name)
-                data["data"][name] = video_data
-            else:
-                self.logger.warning(
-                    f"Video element or data-apireq attribute not found in article for {url}"
+            return PoliteAdapter(limiter, pool_maxsize=POOL_SIZE)
+        return requests.adapters.HTTPAdapter(pool_maxsize=POOL_SIZE)
+
+    @property
+    def egress_pool(self):
+        """
+        The egress pool of this helper, created on first use.
+        Returns:
+            EgressPool | None: None without egress members.
+        """
+        if not self.egress:
+            return None
+        with self._adapter_lock:
+            if self._egress_pool is None:
+                from helper.egress import EgressPool
+
+                self._egress_pool = EgressPool.create(self.egress, self.new_adapter, self.logger)
+                if self._egress_pool is None:
+                    self.egress = []
+            return self._egress_pool
+
+    def warm_up(self, data: dict, connections: int = 4) -> list:
+        """
+        Gets the connections of a batch ready while its episodes are still being
+        chosen: opens `connections` connections to the API host, then resolves the
+        newest episode to learn its video hosts and opens as many to each. They
+        stay idle in the shared pool for the sessions of the batch, and the episode
+        stays prepared (see prepare_episode).
+        Returns:
+            list: The URLs whose hosts connections were opened to.
+        """
+        from helper.warmup import warm_connections
+
+        start = time.monotonic()
+        session = self.new_session()
+        urls = []
+        if self.multiplexed is None:
+            # Over HTTP/2 the API calls share one connection, opened by the first call
+            urls.append(API_URL)
+            warm_connections(session, API_URL, connections, self.logger)
+        if data["names"] and not self.download_stop:
+            name = data["names"][-1]
+            self.prepare_episode(name, data)
+            video_data = self.prepared[name]["video_data"]
+            for url in [video_data["url"], *video_data.get("alternatives", [])]:
+                if self.download_stop:
+                    break
+                warm_connections(session, url, connections, self.logger)
+                urls.append(url)
+        self.logger.debug(
+            "Warmed up %s connections to %s hosts in %.0f ms",
+            connections,
+            len(urls),
+            (time.monotonic() - start) * 1000,
+        )
+        return urls
+
+    def first_byte(self, _id) -> None:
+        """
+        Records the time from the start of an episode to its first video byte.
+        Only the first call after each start counts.
+        """
+        started = self.started.pop(_id, None)
+        if started is not None:
+            self.ttfb[_id] = time.monotonic() - started
+            self.logger.debug("%3s | First byte after %.0f ms", _id, self.ttfb[_id] * 1000)
+
+    def ttfb_summary(self) -> str:
+        """
+        Returns a one-line report of the time to first byte of the episodes so far,
+        or "" if none started.
+        """
+        times = sorted(self.ttfb.values())
+        if not times:
+            return ""
+        return (
+            f"Time to first byte: median {statistics.median(times) * 1000:.0f} ms, "
+            f"slowest {times[-1] * 1000:.0f} ms ({len(times)} episodes)"
+        )
+
+    @property
+    def multiplexed(self):
+        """
+        The HTTP/2 client of this helper, created on first use.
+        Returns:
+            MultiplexedClient | None: None when HTTP/2 is off or not installed.
+        """
+        if not self.http2:
+            return None
+        with self._multiplexed_lock:
+            if self._multiplexed is None:
+                from helper.multiplex import MultiplexedClient
+
+                self._multiplexed = MultiplexedClient.create(
+                    getattr(self.adapter, "limiter", None), record=self.health.record, logger=self.logger
                 )
+                if self._multiplexed is None:
+                    self.http2 = False
+            return self._multiplexed
 
-        numeric_positions = [(i, int(re.search(r'\[(\d+)\]', name).group(1))) for i, name in enumerate(data['names']) if re.search(r'\[(\d+)\]', name)]
-
-        for i in range(len(numeric_positions) - 1):
-            start_pos, start_val = numeric_positions[i]
-            end_pos, end_val = numeric_positions[i + 1]
-            gap = end_pos - start_pos - 1
-            
-            if gap > 0:
-                for j in range(1, gap + 1):
-                    gap_pos = start_pos + j
-                    new_value = start_val + j * (end_val - start_val) / (gap + 1)
-                    original_string = data['names'][gap_pos]
-                    data['names'][gap_pos] = re.sub(r'\[.*?\]', f'[{new_value:.1f} {original_string[original_string.index("[") + 1:-1]}]', original_string)
-
-        if numeric_positions:
-            start = numeric_positions[0][1]
-            end = numeric_positions[-1][1]            
-            if start > end:
-                data["names"].reverse()
-        else:
-            self.logger.error("No video found in the page")
+    def small_request(self, session: requests.Session, method: str, url: str, data=None):
+        """
+        Sends an API call or page request, over HTTP/2 when enabled. Cookies the
+        answer sets end up in `session` either way.
+        """
+        client = self.multiplexed
+        if client is None:
+            return session.request(method, url, headers=HEADERS, data=data, timeout=TIMEOUT)
+        response = client.request(session, method, url, headers=HEADERS, data=data)
+        response.copy_cookies(session)
+        return response
+
+    def get_series_data(self, url: str, max_pages: int = 1500) -> dict:
+        """
+        Fetches every page of a series without any user interaction.
+        Pages are read until the site answers 404 or `max_pages` is reached, and the
+        episodes are merged oldest first, like the episode selection UI does.
+        Args:
+            url (str): The category URL of the series (redirects are followed).
+            max_pages (int): The maximum number of pages to read.
+        Returns:
+            dict: See get_video_data_me, with "url" set to the resolved category URL,
+            or None if the series has no video.
+        """
+        session = self.new_session()
+        response = self.small_request(session, "GET", url)
+        response.raise_for_status()
+        base_url = response.url.split("/page")[0].rstrip("/")
+
+        data = parse_video_page(response.content, url, self.logger)
+        if data is None:
             return None
+        data["title"] = data["title"].replace("/", "-")
+        data["url"] = base_url
 
-        soup.find_all("player_html5_api")
-        self.logger.debug("Anime data fetched successfully")
+        older_names = []
+        for page_data in self.parse_pages(session, base_url, max_pages):
+            data["total episode"] += page_data["total episode"]
+            older_names.append(page_data["names"])
+            data["data"].update(page_data["data"])
+        data["names"] = [name for names in reversed(older_names) for name in names] + data["names"]
+
+        self.logger.debug("Fetched %s episodes of %s", data['total episode'], data['title'])
         return data
 
+    def fetch_pages(self, session: requests.Session, base_url: str, max_pages: int):
+        """
+        Fetches pages 2..max_pages of a series, PAGE_WINDOW pages at a time, until the
+        site answers 404.
+        Yields:
+            tuple: (page URL, page content) in page order.
+        """
+        with ThreadPoolExecutor(max_workers=PAGE_WINDOW) as fetcher:
+            for first in range(2, max_pages + 1, PAGE_WINDOW):
+                if self.download_stop:
+                    return
+                urls = [
+                    f"{base_url}/page/{page}"
+                    for page in range(first, min(first + PAGE_WINDOW, max_pages + 1))
+                ]
+                responses = fetcher.map(
+                    lambda page_url: self.small_request(session, "GET", page_url), urls
+                )
+                for page_url, response in zip(urls, responses):
+                    if response.status_code == 404:
+                        return
+                    response.raise_for_status()
+                    yield page_url, response.content
+
+    def parse_pages(self, session: requests.Session, base_url: str, max_pages: int) -> list:
+        """
+        Fetches and parses pages 2..max_pages of a series.
+        The first PARSE_POOL_MIN_PAGES pages are parsed in this thread. Longer series
+        send the raw HTML of the remaining pages to a process pool, so parsing runs on
+        every core and overlaps with fetching the next pages; only the extracted
+        episode records come back.
+        Returns:
+            list: The parsed pages (see parse_video_page) in page order, up to the
+            first page without any video.
+        """
+        results = []
+        pool = None
+        try:
+            for page_url, content in self.fetch_pages(session, base_url, max_pages):
+                if pool is None and len(results) >= PARSE_POOL_MIN_PAGES and self.parse_workers > 1:
+                    # Imported here, multiprocessing is not needed for short series
+                    from concurrent.futures import ProcessPoolExecutor
+
+                    pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+                if pool is not None:
+                    results.append(pool.submit(parse_video_page, content, page_url))
+                    continue
+                page_data = parse_video_page(content, page_url, self.logger)
+                if page_data is None:
+                    break
+                results.append(page_data)
+
+            pages = []
+            for result in results:
+                page_data = result.result() if isinstance(result, Future) else result
+                if page_data is None:
+                    break
+                pages.append(page_data)
+            return pages
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
     def video_detail_api(self, session: requests.Session, d) -> dict:
         # Required session to work
 
         body = f"d={d}"
 
-        response = session.post(API_URL, headers=HEADERS, data=body)
+        response = self.small_request(session, "POST", API_URL, body)
         try:
             response_json = response.json()
             response_dict = dict(response_json)
-            self.logger.debug(f"API Response: {response_dict}")
         except json.JSONDecodeError:
             self.logger.error("Failed to decode JSON from response")
         return response_dict
@@ -162,35 +619,36 @@ class DownloadHelper:
         """
         header = HEADERS.copy()
         if session is None:
-            head_response = requests.head(url, headers=header)
+            head_response = requests.head(url, headers=header, timeout=TIMEOUT)
         else:
-            head_response = session.head(url, headers=header)
+            head_response = session.head(url, headers=header, timeout=TIMEOUT)
         if head_response.status_code != 200:
-            raise requests.RequestException(
-                f"Failed to get file size. Status code: {head_response.status_code}"
+            raise requests.HTTPError(
+                f"Failed to get file size. Status code: {head_response.status_code}",
+                response=head_response,
             )
 
         expected_size = int(head_response.headers.get("Content-Length", 0))
         return expected_size
 
     @staticmethod
-    def check_filename(path: str, filename: str) -> str:
+    def check_filename(path: str, filename: str, extension: str = "mp4") -> str:
         checked_title: str = "".join(
             c if c.isalnum() or c not in "/\\" or c in "._-" else "_" for c in filename
         )
         checked_title = re.sub(r"_+", "_", checked_title)
         if checked_title[-1] == "_":
             checked_title = checked_title[:-1]
-        return os.path.join(path, f"{checked_title}.mp4")
+        return os.path.join(path, f"{checked_title}.{extension}")
 
     def download_video(
-        self, _id, data: dict, session: requests.Session, chunk_size=8192
+        self, _id, data: dict, session: requests.Session, chunk_size=BUFFER_SIZE
     ) -> None:
-        if self.download_stop:
-            self.logger.debug(f"{str(_id):>3} | Download stopped")
+        if self.stopped(_id):
+            self.logger.debug("%3s | Download stopped", _id)
             return
 
-        self.logger.info(f"{_id:>3} | Downloading video from {data['url']}")
+        self.logger.info("%3s | Downloading video from %s", _id, data['url'])
 
         header = HEADERS.copy()
 
@@ -203,17 +661,24 @@ class DownloadHelper:
             }
         if self.process[_id].get("loading", False):
             self.logger.debug(
-                f"{str(_id):>3} | Resuming download {self.process[_id]['downloaded_size'] / (1024 * 1024)/self.process[_id]['total_size']:.2%}"
+                "%3s | Resuming download %.2f%%",
+                _id,
+                100 * self.process[_id]["downloaded_size"] / max(self.process[_id]["total_size"], 1),
             )
-            header["Range"] = f"bytes={self.process[_id]['downloaded_size']}-"
             output_path = self.check_filename(data["download_path"], str(_id))
             output_path_temp = output_path + DOWNLOADING_EXTENSION
+            self.process[_id]["path"] = output_path_temp
+            # Bytes counted but not stored (e.g. a part whose upload failed) are fetched again
+            stored = self.storage.size(output_path_temp)
+            self.downloaded_size += stored - self.process[_id]["downloaded_size"]
+            self.process[_id]["downloaded_size"] = stored
+            header["Range"] = f"bytes={stored}-"
         else:
             # ------ Get the expected file size from the server ------
-            expected_size = self.get_expected_size(data["url"], session)
+            expected_size = data.get("size") or self.get_expected_size(data["url"], session)
             expected_size_mb = expected_size / (1024 * 1024)
             self.logger.debug(
-                f"{str(_id):>3} | Expected file size: {expected_size_mb:.2f} MB"
+                "%3s | Expected file size: %.2f MB", _id, expected_size_mb
             )
 
             # ---------------- Set file name and path ----------------
@@ -221,50 +686,59 @@ class DownloadHelper:
             output_path_temp = f"{output_path}{DOWNLOADING_EXTENSION}"
 
             #  ----------------- Init process -----------------
+            # A resumed episode (e.g. after a pause) replaces its earlier share of the totals
+            self.total_size -= max(self.process[_id]["total_size"], 0)
+            self.downloaded_size -= self.process[_id]["downloaded_size"]
+            self.process[_id]["downloaded_size"] = 0
             self.process[_id]["total_size"] = expected_size
             self.process[_id]["loading"] = False
+            # Where the file grows, for the streaming endpoint (see helper.stream)
+            self.process[_id]["path"] = output_path_temp
             self.total_size += expected_size
             downloaded = 0
 
+            # ------------ Reuse an identical local file ------------
+            if self.content_index is not None and not os.path.exists(output_path_temp):
+                if self.reuse_local_copy(_id, data, session, expected_size, output_path):
+                    return
+
             # ------------ Check if have previous data ------------
-            if os.path.exists(output_path_temp):
-                downloaded = os.path.getsize(output_path_temp)
+            downloaded = self.storage.size(output_path_temp)
+            if downloaded or os.path.exists(output_path_temp):
+                if not self.storage.remote:
+                    # Uploaded parts cannot be read back before the upload completes
+                    downloaded = self.verify_partial(_id, data["url"], session, output_path_temp, expected_size)
                 if downloaded == expected_size:
                     self.downloaded_size += downloaded
                     self.process[_id]["downloaded_size"] = downloaded
                     self.process[_id]["success"] = True
                     self.finished += 1
-                    self.logger.debug(f"{str(_id):>3} | File already fully downloaded")
-
-                    if os.path.exists(output_path):
-                        os.remove(output_path)
-                    os.rename(output_path_temp, output_path)
+                    self.logger.debug("%3s | File already fully downloaded", _id)
+                    self.storage.commit(output_path_temp, output_path)
                     return
 
                 elif 0 < downloaded < expected_size:
                     downloaded_mb = downloaded / (1024 * 1024)
                     self.logger.debug(
-                        f"{str(_id):>3} | Resuming download from {downloaded_mb} mb {downloaded_mb/expected_size_mb:.2%}"
+                        "%3s | Resuming download from %s mb %.2f%%",
+                        _id,
+                        downloaded_mb,
+                        100 * downloaded_mb / expected_size_mb,
                     )
                     header["Range"] = f"bytes={downloaded}-"
 
                 else:
-                    if downloaded >= expected_size:
-                        self.logger.debug(
-                            f"{str(_id):>3} | File are corrupted, re-downloading"
-                        )
-                    else:
-                        self.logger.debug(f"{str(_id):>3} | Starting download")
-                    os.remove(output_path_temp)
+                    self.logger.debug("%3s | Starting download", _id)
+                    self.storage.discard(output_path_temp)
                     downloaded = 0
             else:
-                self.logger.debug(f"{str(_id):>3} | Starting download")
+                self.logger.debug("%3s | Starting download", _id)
             self.process[_id]["downloaded_size"] = downloaded
             self.downloaded_size += downloaded
 
         # ----------------- Start downloading -----------------
         response: requests.Response = session.get(
-            data["url"], headers=header, stream=True
+            data["url"], headers=header, stream=True, timeout=TIMEOUT
         )
 
         # ------------------- Downloading -------------------
@@ -274,57 +748,420 @@ class DownloadHelper:
             # The server cannot serve the requested range
             # Re-download file
             self.logger.warning(
-                f"{str(_id):>3} | Re-downloading file (Error response: 416)"
+                "%3s | Re-downloading file (Error response: 416)", _id
             )
+            response.close()
             response: requests.Response = session.get(
-                data["url"], headers=HEADERS, stream=True
+                data["url"], headers=HEADERS, stream=True, timeout=TIMEOUT
             )
 
         # ----------------- Downloading Success -----------------
         if response.status_code in [200, 206]:
-            if not os.path.exists(data["download_path"]):
+            if not self.storage.remote and not os.path.exists(data["download_path"]):
                 self.logger.debug(
-                    f"{str(_id):>3} | Creating directory {data['download_path']}"
+                    "%3s | Creating directory %s", _id, data['download_path']
                 )
-                os.makedirs(data["download_path"])
+                os.makedirs(data["download_path"], exist_ok=True)
+
+            if response.status_code == 200 and "Range" in header:
+                # Server ignored the range, start over instead of appending the whole file
+                self.logger.debug("%3s | Range not supported, re-downloading", _id)
+                self.storage.discard(output_path_temp)
+                self.downloaded_size -= self.process[_id]["downloaded_size"]
+                self.process[_id]["downloaded_size"] = 0
 
             self.process[_id]["loading"] = True
+            self.source_selector.record(
+                data["url"], connect_time=response.elapsed.total_seconds()
+            )
 
-            with open(output_path_temp, "ab") as f:
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    if self.download_stop:
-                        self.logger.debug(f"{str(_id):>3} | Download stopped")
-                        return
-                    if chunk:
-                        f.write(chunk)
-                        self.downloaded_size += len(chunk)
-                        self.process[_id]["downloaded_size"] += len(chunk)
+            def open_hedge(offset):
+                hedge_header = HEADERS.copy()
+                hedge_header["Range"] = f"bytes={offset}-"
+                hedge = session.get(
+                    data["url"], headers=hedge_header, stream=True, timeout=TIMEOUT
+                )
+                content_range = hedge.headers.get("Content-Range", "")
+                if hedge.status_code != 206 or not content_range.startswith(f"bytes {offset}-"):
+                    hedge.close()
+                    return None
+                return hedge
+
+            switch_to = None
+            transfer_start = window_start = time.monotonic()
+            window_bytes = 0
+            transfer = self.watchdog.watch(
+                _id, response, self.process[_id]["downloaded_size"], open_hedge
+            )
+            self.track(_id, transfer)
+            pool = BufferPool(size=chunk_size)
+            member = getattr(session, "egress", None)
+            try:
+                with self.storage.open(output_path_temp, pool, sync=self.sync_writes) as writer:
+                    while True:
+                        try:
+                            for buffer, size in iter_readinto(transfer.response, pool):
+                                if _id in self.started:
+                                    self.first_byte(_id)
+                                if self.stopped(_id):
+                                    pool.put(buffer)
+                                    self.logger.debug("%3s | Download stopped", _id)
+                                    return
+                                if not transfer.progress(size):
+                                    # A hedged request took over from this offset
+                                    pool.put(buffer)
+                                    break
+                                writer.write(buffer, size)
+                                if member is not None:
+                                    self.egress_pool.transferred(member, size)
+                                self.downloaded_size += size
+                                self.process[_id]["downloaded_size"] += size
+                                window_bytes += size
+                                if self.bandwidth.rate > 0 or self.priority is not None:
+                                    transfer.throttled = True
+                                    self.bandwidth.consume(size, lambda: self.stopped(_id))
+                                    self.yield_to_priority(_id, size)
+                                    transfer.throttled = False
+
+                                # ------------ Measure and compare source speed ------------
+                                now = time.monotonic()
+                                if now - window_start >= RATE_WINDOW:
+                                    rate = window_bytes / (now - window_start)
+                                    self.source_selector.record(data["url"], rate=rate)
+                                    self.priority_rate(_id, rate)
+
+                                    window_start, window_bytes = now, 0
+                                    # A capped transfer is slow on purpose, another source would not help
+                                    if (
+                                        now - transfer_start >= MIN_SWITCH_INTERVAL
+                                        and self.bandwidth.rate <= 0
+                                        and self.background.rate <= 0
+                                    ):
+                                        switch_to = self.switch_source(_id, data, session, rate)
+                                        if switch_to:
+                                            break
+                        except (requests.RequestException, OSError, http_client.HTTPException):
+                            # Aborted by the watchdog or a stop, otherwise a real error
+                            # (iter_readinto reads below urllib3, so a truncated body
+                            # raises IncompleteRead)
+                            if self.stopped(_id):
+                                self.logger.debug("%3s | Download stopped", _id)
+                                return
+                            if transfer.replacement is None:
+                                raise
+
+                        if switch_to or transfer.take_replacement() is None:
+                            break
+            finally:
+                self.untrack(_id, transfer)
+                self.watchdog.unwatch(transfer)
+                release_response(transfer.response)
+
+            if self.stopped(_id):
+                # Its connection was closed by a stop, which can end the body quietly
+                self.logger.debug("%3s | Download stopped", _id)
+                return
+            if switch_to:
+                return self.download_video(_id, switch_to, session, chunk_size)
+
+            downloaded = self.storage.size(output_path_temp)
+            if 0 < self.process[_id]["total_size"] != downloaded:
+                self.logger.error(
+                    "%3s | Transfer ended early (%s/%s bytes)", _id, downloaded, self.process[_id]["total_size"]
+                )
+                self.process[_id]["success"] = False
+                return
 
             # ----------------- Download completed -----------------
-            if os.path.exists(output_path):
-                os.remove(output_path)
-            os.rename(output_path_temp, output_path)
+            self.storage.commit(output_path_temp, output_path)
+            self.index_file(_id, output_path)
             self.process[_id]["success"] = True
             self.process[_id]["downloaded_size"] = self.process[_id]["total_size"]
             self.finished += 1
             self.logger.info(
-                f"{str(_id):>3} | Download completed successfully: {output_path}"
+                "%3s | Download completed successfully: %s", _id, output_path
             )
 
         # ----------------- Error handling -----------------
         elif response.status_code == 403:
+            response.close()
             self.logger.error("403 Forbidden: Access to the resource is denied.")
+            self.process[_id]["status"] = 403
             self.process[_id]["success"] = False
             return
         else:
             self.logger.error(
-                f"{str(_id):^3} | Failed to download video. Status code: {response.status_code}. Message: {response.text}"
+                "%3s | Failed to download video. Status code: %s. Message: %s",
+                _id,
+                response.status_code,
+                response.text,
             )
+            response.close()
             self.process[_id]["success"] = False
 
         # ----------------- Clean up -----------------
         # del self.process[_id]
 
+    @staticmethod
+    def fetch_range(session: requests.Session, url: str, start: int, end: int):
+        """
+        Fetches bytes `start` to `end` (inclusive) of `url`.
+        Returns:
+            bytes | None: None when the host does not answer with that range.
+        """
+        header = HEADERS.copy()
+        header["Range"] = f"bytes={start}-{end}"
+        length = end - start + 1
+        with session.get(url, headers=header, stream=True, timeout=TIMEOUT) as response:
+            # A host ignoring Range would send the whole video, never read it
+            if response.status_code != 206:
+                return None
+            content = response.raw.read(length, decode_content=True)
+        return content if len(content) == length else None
+
+    def verify_partial(self, _id, url: str, session: requests.Session, path: str, expected_size: int) -> int:
+        """
+        Checks a partial file left by an earlier run against the source before it is
+        resumed, and truncates it to the part that matches (see verified_length).
+        A file longer than `expected_size` is checked up to that size.
+        Returns:
+            int: The length of the file kept.
+        """
+        from helper.integrity import verified_length
+
+        downloaded = os.path.getsize(path)
+        if expected_size <= 0:
+            # Unknown size, the file is downloaded again anyway
+            return downloaded
+        try:
+            verified = verified_length(
+                path, min(downloaded, expected_size), lambda start, end: self.fetch_range(session, url, start, end)
+            )
+        except (requests.RequestException, OSError) as e:
+            self.logger.debug("%3s | Could not check the partial file: %s", _id, e)
+            verified = None
+        if verified is None:
+            # Unchecked: trusted as before, unless it is too long to be a prefix
+            verified = downloaded if downloaded <= expected_size else 0
+        if verified < downloaded:
+            self.logger.warning(
+                "%3s | Partial file does not match the source after %s of %s bytes, truncating",
+                _id,
+                verified,
+                downloaded,
+            )
+            with open(path, "r+b") as f:
+                f.truncate(verified)
+        return verified
+
+    def reuse_local_copy(
+        self, _id, data: dict, session: requests.Session, expected_size: int, output_path: str
+    ) -> bool:
+        """
+        Looks for a file with the same content under the download folder (same size,
+        same first and last MB) and hard links or copies it instead of downloading.
+        Returns:
+            bool: True if the episode was satisfied from a local file.
+        """
+        try:
+            match = self.content_index.find(
+                expected_size, lambda start, end: self.fetch_range(session, data["url"], start, end)
+            )
+        except (requests.RequestException, OSError) as e:
+            self.logger.debug("%3s | Content lookup failed: %s", _id, e)
+            return False
+        if match is None:
+            return False
+
+        if os.path.abspath(match) == os.path.abspath(output_path):
+            self.logger.info("%3s | Already downloaded: %s", _id, output_path)
+        else:
+            method = materialize(match, output_path)
+            self.index_file(_id, output_path)
+            self.logger.info("%3s | Reused local file (%s): %s", _id, method, match)
+
+        self.downloaded_size += expected_size
+        self.process[_id]["downloaded_size"] = expected_size
+        self.process[_id]["success"] = True
+        self.finished += 1
+        return True
+
+    def index_file(self, _id, path: str) -> None:
+        """
+        Adds a finished file to the content index, if there is one. The file is on
+        disk either way, so an index that cannot be written is only logged.
+        """
+        if self.content_index is None:
+            return
+        try:
+            self.content_index.add(path)
+        except (OSError, ValueError) as e:
+            self.logger.warning("%3s | Could not add %s to the content index: %s", _id, path, e)
+
+    def switch_source(self, _id, data: dict, session: requests.Session, rate: float):
+        """
+        Checks whether the transfer should move to a faster alternative source.
+        The alternative must serve a file of the same size, so the download can
+        continue from the current offset.
+        Returns:
+            dict | None: The video data for the new source, or None to keep the current one.
+        """
+        alternatives = data.get("alternatives", [])
+        alternative = self.source_selector.better_source(data["url"], alternatives, rate)
+        if alternative is None:
+            return None
+        try:
+            if self.get_expected_size(alternative, session) != self.process[_id]["total_size"]:
+                self.logger.debug("%3s | Source %s differs in size, not switching", _id, alternative)
+                return None
+        except requests.RequestException:
+            self.source_selector.record(alternative, failed=True)
+            return None
+
+        self.logger.info(
+            "%3s | Switching source %s -> %s (%.0f KB/s)",
+            _id,
+            self.source_selector.host(data["url"]),
+            self.source_selector.host(alternative),
+            rate / 1024,
+        )
+        return {
+            **data,
+            "url": alternative,
+            "alternatives": [url for url in alternatives if url != alternative] + [data["url"]],
+        }
+
+    def download_hls(self, _id, data: dict, session: requests.Session) -> None:
+        """
+        Downloads an episode served as an HLS playlist.
+        The media segments are fetched concurrently (at most `hls_workers` at a time),
+        each retried on its own, and written in order into a single output file.
+        Progress is saved after every segment so an interrupted download resumes
+        from the last complete segment.
+        Args:
+            _id: The ID of the episode.
+            data (dict): "url" of the playlist and "download_path" of the output folder.
+            session (requests.Session): The session used for the API request.
+        """
+        if self.stopped(_id):
+            self.logger.debug("%3s | Download stopped", _id)
+            return
+
+        self.logger.info("%3s | Downloading HLS stream from %s", _id, data['url'])
+        header = HEADERS.copy()
+
+        if self.process.get(_id, None) is None:
+            self.process[_id] = {
+                "total_size": -1,
+                "downloaded_size": 0,
+                "finished": False,
+                "success": False,
+            }
+
+        playlist = hls.fetch_playlist(session, data["url"], header)
+        if playlist["encrypted"]:
+            self.logger.error("%3s | Encrypted HLS streams are not supported", _id)
+            self.process[_id]["success"] = False
+            return
+
+        segments = playlist["segments"]
+        extension = "mp4" if playlist["fmp4"] else "ts"
+        output_path = self.check_filename(data["download_path"], str(_id), extension)
+        output_path_temp = f"{output_path}{DOWNLOADING_EXTENSION}"
+        self.process[_id]["path"] = output_path_temp
+
+        # ------------ Check if have previous data ------------
+        state = hls.load_state(output_path_temp)
+        if not os.path.exists(output_path_temp) or os.path.getsize(output_path_temp) < state["offset"]:
+            state = {"segments_done": 0, "offset": 0}
+        if state["segments_done"] > len(segments):
+            self.logger.debug("%3s | Playlist changed, re-downloading", _id)
+            state = {"segments_done": 0, "offset": 0}
+        if state["segments_done"]:
+            self.logger.debug(
+                "%3s | Resuming download from segment %s/%s", _id, state['segments_done'], len(segments)
+            )
+
+        # Estimate the size from the average segment, refined as segments arrive
+        def estimate(segments_done, offset):
+            if segments_done == 0:
+                return -1
+            return int(offset / segments_done * len(segments))
+
+        expected_size = estimate(state["segments_done"], state["offset"])
+        # A resumed episode (e.g. after a pause) replaces its earlier share of the totals
+        self.total_size -= max(self.process[_id].get("total_size", -1), 0)
+        self.downloaded_size -= self.process[_id].get("downloaded_size", 0)
+        self.process[_id]["segments_total"] = len(segments)
+        self.process[_id]["segments_done"] = state["segments_done"]
+        self.process[_id]["total_size"] = expected_size
+        self.process[_id]["downloaded_size"] = state["offset"]
+        self.process[_id]["loading"] = True
+        self.total_size += max(expected_size, 0)
+        self.downloaded_size += state["offset"]
+
+        if not os.path.exists(data["download_path"]):
+            self.logger.debug(
+                "%3s | Creating directory %s", _id, data['download_path']
+            )
+            os.makedirs(data["download_path"], exist_ok=True)
+
+        window = {"start": time.monotonic(), "bytes": 0}
+
+        def on_segment(index, size, offset):
+            nonlocal expected_size
+            new_expected_size = estimate(index + 1, offset)
+            self.total_size += new_expected_size - max(expected_size, 0)
+            expected_size = new_expected_size
+            self.downloaded_size += size
+            self.process[_id]["segments_done"] = index + 1
+            self.process[_id]["downloaded_size"] = offset
+            self.process[_id]["total_size"] = expected_size
+            hls.save_state(output_path_temp, index + 1, offset)
+            self.first_byte(_id)
+            self.bandwidth.consume(size, lambda: self.stopped(_id))
+            self.yield_to_priority(_id, size)
+            window["bytes"] += size
+            now = time.monotonic()
+            if now - window["start"] >= RATE_WINDOW:
+                self.priority_rate(_id, window["bytes"] / (now - window["start"]))
+                window["start"], window["bytes"] = now, 0
+
+        writer = hls.SegmentWriter(
+            session,
+            segments,
+            header,
+            window=self.hls_workers,
+            egress=self.egress_pool,
+            adapter=self.adapter,
+            logger=self.logger,
+        )
+        self.track(_id, writer)
+        try:
+            completed = writer.write_to(
+                output_path_temp,
+                state["segments_done"],
+                state["offset"],
+                on_segment,
+                lambda: self.stopped(_id),
+            )
+        finally:
+            self.untrack(_id, writer)
+        if not completed:
+            self.logger.debug("%3s | Download stopped", _id)
+            return
+
+        # ----------------- Download completed -----------------
+        # Segments are assembled locally; a remote sink gets the file once complete
+        self.storage.store(output_path_temp, output_path)
+        hls.remove_state(output_path_temp)
+        self.index_file(_id, output_path)
+        self.process[_id]["success"] = True
+        self.finished += 1
+        self.logger.info(
+            "%3s | Download completed successfully: %s", _id, output_path
+        )
+
     def download_episode(self, _id, data) -> None:
         """
         Downloads a specific episode of an anime.
@@ -336,21 +1173,210 @@ class DownloadHelper:
         Raises:
             Exception: If there is an error fetching video data for the specified episode.
         """
-        session = requests.Session()
-
+        self.started[_id] = time.monotonic()
+        if _id in self.process:
+            # Tried again after an earlier run (retry, resume)
+            self.process[_id]["finished"] = False
         try:
-            api_data = self.video_detail_api(session, data["data"][_id])
-            self.logger.debug(f"API Data: {api_data}")
-            video_data = {
-                "download_path": f"{self.download_path}/{data['title']}",
-                "url": "https:" + api_data["s"][0]["src"],
-            }
-            self.logger.debug(f"Video Data: {video_data}")
-            self.download_video(_id, video_data, session)
+            for attempt in range(EPISODE_RETRIES + 1):
+                # Hosts the attempt sent requests to
+                hosts = []
+                try:
+                    self.download_attempt(_id, data, hosts)
+                except Exception as e:
+                    if attempt == EPISODE_RETRIES or not self.host_failing(_id, hosts, e):
+                        raise
+                    continue
+                if (
+                    self.process.get(_id, {}).get("success")
+                    or self.stopped(_id)
+                    or attempt == EPISODE_RETRIES
+                    or not self.host_failing(_id, hosts)
+                ):
+                    return
 
         except Exception as e:
-            self.logger.error(f"Error fetching video data for {_id}: {e}")
+            self.logger.error("Error fetching video data for %s: %s", _id, e)
             raise e
+        finally:
+            # Finished without a transfer (already on disk, reused) or failed
+            self.started.pop(_id, None)
+            if _id in self.process:
+                # "success" is False while the transfer runs, this marks it as final
+                self.process[_id]["finished"] = True
+
+    def download_attempt(self, _id, data, hosts: list) -> None:
+        """
+        Resolves and downloads an episode once, waiting first for the hosts it
+        needs whose circuit is open (see wait_for_host). The hosts are added to
+        `hosts` as they are reached.
+        """
+        prepared = self.prepared.pop(_id, None)
+        if prepared is None or time.monotonic() - prepared["time"] > PLAN_TTL:
+            hosts.append(API_HOST)
+            if not self.wait_for_host(_id, API_HOST):
+                return
+            prepared = self.resolve_episode(_id, data)
+        video_data = prepared["video_data"]
+        hosts.append(urlparse(video_data["url"]).hostname or "")
+        if not self.wait_for_host(_id, hosts[-1]):
+            return
+        if prepared["hls"]:
+            # With an egress pool, each segment picks its own member
+            self.download_hls(_id, video_data, prepared["session"])
+        elif self.egress_pool is not None:
+            self.download_via_egress(_id, video_data, prepared["session"])
+        else:
+            self.download_video(_id, video_data, prepared["session"])
+
+    def host_failing(self, _id, hosts: list, error: Exception = None) -> bool:
+        """
+        Whether an episode that failed did so because one of its hosts is failing
+        (its circuit is open), in which case it waits for the host and tries again.
+        An episode whose failure came before the circuit opened, among the failed
+        answers that open it, waits for them to be decided (see HostHealth.settle).
+        """
+        failing = [host for host in hosts if self.health.tripped(host)]
+        if not failing:
+            failing = [host for host in hosts if self.health.settle(host, lambda: self.stopped(_id))]
+        if not failing:
+            return False
+        self.logger.info(
+            "%3s | %s failing%s, trying again once it recovers", _id, failing[0], f" ({error})" if error else ""
+        )
+        return True
+
+    def wait_for_host(self, _id, host: str) -> bool:
+        """
+        Holds an episode back while the circuit of `host` is open, instead of
+        sending requests that would fail too.
+        Returns:
+            bool: False if the episode was stopped while waiting.
+        """
+        if self.health.wait(host, lambda: True):
+            return True
+        self.logger.info("%3s | Waiting for %s to recover", _id, host)
+        self.started.pop(_id, None)
+        if not self.health.wait(host, lambda: self.stopped(_id)):
+            self.logger.debug("%3s | Download stopped", _id)
+            return False
+        self.started[_id] = time.monotonic()
+        return True
+
+    def download_via_egress(self, _id, video_data: dict, session: requests.Session) -> None:
+        """
+        Downloads a progressive episode through a member of the egress pool. When the
+        video host answers 403, the episode is tried again through another member,
+        at most once per member.
+        """
+        pool = self.egress_pool
+        tried = set()
+        while True:
+            member = pool.acquire(exclude=tried)
+            tried.add(member["name"])
+            pool.bind(session, member)
+            self.process.get(_id, {}).pop("status", None)
+            error = None
+            try:
+                self.download_video(_id, video_data, session)
+            except requests.HTTPError as e:
+                error = e
+            finally:
+                pool.release(member)
+
+            if error is not None:
+                status = getattr(error.response, "status_code", None)
+            else:
+                status = self.process.get(_id, {}).get("status")
+            if status == 403:
+                pool.forbidden(member)
+            if status != 403 or self.stopped(_id) or not [m for m in pool.live if m["name"] not in tried]:
+                if error is not None:
+                    raise error
+                return
+            self.logger.info("%3s | 403 through %s, trying another egress", _id, member["name"])
+
+    def resolve_api(self, names: list, data: dict, workers: int = 4, stop_flag=None) -> dict:
+        """
+        Calls the API for a batch of episodes: MAX_STREAMS calls at a time over one
+        HTTP/2 connection, or `workers` at a time over HTTP/1.1.
+        Returns:
+            dict: Episode name to (session holding its cookies, API answer); episodes
+            whose call failed are left out.
+        """
+        if self.multiplexed is not None:
+            from helper.multiplex import MAX_STREAMS
+
+            workers = max(workers, MAX_STREAMS)
+
+        def call(name):
+            def should_stop():
+                return self.download_stop or (stop_flag is not None and stop_flag.is_set())
+
+            if should_stop() or not self.health.wait(API_HOST, should_stop):
+                return name, None
+            session = self.new_session()
+            try:
+                return name, (session, self.video_detail_api(session, data["data"][name]))
+            except Exception as e:
+                self.logger.debug("%3s | API call failed: %s", name, e)
+                return name, None
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            return {name: api for name, api in executor.map(call, names) if api is not None}
+
+    def resolve_episode(self, _id, data, api: tuple = None) -> dict:
+        """
+        Resolves the source of an episode through the API, or from `api` (see
+        resolve_api) when the call was already made.
+        Returns:
+            dict: "session" holding the API cookies, "hls", "video_data" for the
+            download and "time" of the resolution.
+        """
+        if api is None:
+            session = self.new_session()
+            api_data = self.video_detail_api(session, data["data"][_id])
+        else:
+            session, api_data = api
+        sources = {}
+        for source in api_data["s"]:
+            src = source["src"]
+            sources["https:" + src if src.startswith("//") else src] = source.get("type", "")
+        playlists = [url for url in sources if hls.is_hls(url, sources[url])]
+        progressive = [url for url in sources if url not in playlists]
+
+        video_data = {"download_path": f"{self.download_path}/{data['title']}"}
+        # The API's first source decides between HLS and a progressive file. Only
+        # progressive sources are ranked by probed throughput: reading the start
+        # of a playlist says nothing about the speed of its segments.
+        if progressive and next(iter(sources)) in progressive:
+            ranked = self.source_selector.rank(session, progressive, HEADERS)
+            video_data["url"] = ranked[0]
+            video_data["alternatives"] = ranked[1:]
+            is_hls = False
+        else:
+            video_data["url"] = playlists[0]
+            is_hls = True
+        self.logger.debug(
+            "%3s | %d sources, using %s%s", _id, len(sources), video_data["url"], " (HLS)" if is_hls else ""
+        )
+        return {"session": session, "hls": is_hls, "video_data": video_data, "time": time.monotonic()}
+
+    def prepare_episode(self, _id, data, api: tuple = None) -> int:
+        """
+        Resolves an episode ahead of its download and probes its size. The session
+        and source are kept for download_episode, so preparing costs no extra request.
+        Returns:
+            int: The size of the episode in bytes, -1 when unknown (HLS or no Content-Length).
+        """
+        prepared = self.resolve_episode(_id, data, api)
+        size = -1
+        if not prepared["hls"]:
+            size = self.get_expected_size(prepared["video_data"]["url"], prepared["session"]) or -1
+            if size > 0:
+                prepared["video_data"]["size"] = size
+        self.prepared[_id] = prepared
+        return size
 
 
 
@@ -359,7 +1385,7 @@ def test():
     response = requests.get(url)
     data = {"title": "", "total episode": 0, "names": [], "data": {}}
 
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = bs4.BeautifulSoup(response.text, "html.parser")
 
     articles = soup.find_all("article")
     for article in articles:
@@ -390,7 +1416,7 @@ def test():
 
     print(data)
 
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = bs4.BeautifulSoup(response.text, "html.parser")
     other_video = soup.find_all("player_html5_api")
     print(other_video)
 
@@ -406,7 +1432,7 @@ def test2():
     # "s":"a424bc070358074db5a6b793fbe1f29e"}
     
     
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = bs4.BeautifulSoup(response.text, "html.parser")
     source = soup.find("source")
     if source:
         print(source["src"])
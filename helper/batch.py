@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import logging
+import threading
+from collections import deque
+
+from helper.anime1_fetch import DownloadHelper
+
+POLL_INTERVAL = 0.1  # seconds between two checks of the stop flag
+
+# Episode states
+QUEUED = "queued"
+ACTIVE = "active"
+PAUSING = "pausing"  # paused, its transfer has not returned yet
+RESUMING = "resuming"  # resumed while still pausing
+CANCELLING = "cancelling"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+FAILED = "failed"
+
+RUNNING = (ACTIVE, PAUSING, RESUMING, CANCELLING)
+
+
+class EpisodeBatch:
+    """
+    Downloads the episodes of a batch with `workers` threads, each of which can be
+    paused, resumed or cancelled while the others keep going.
+
+    Pausing or cancelling an episode closes its connections (see
+    DownloadHelper.pause), so the transfer returns at once, even when blocked on a
+    stalled socket; the partial file is kept. A resumed episode goes back to the
+    front of the queue and continues from its partial file.
+
+    Workers wait while episodes are paused, so the batch ends once every episode is
+    done, failed or cancelled, or when it is stopped. The number of workers can be
+    changed while the batch runs (set_workers): surplus workers leave after their
+    current episode, so no transfer is restarted.
+
+    One episode can be played next (play_next): it starts at once on an extra
+    worker and gets most of the bandwidth until it ends.
+    """
+
+    def __init__(
+        self,
+        download_helper: DownloadHelper,
+        data: dict,
+        names: list,
+        workers: int = 4,
+        logger: logging = logging,
+    ) -> None:
+        self.helper = download_helper
+        self.data = data
+        self.names = list(names)
+        self.workers = max(workers, 1)
+        self.logger = logger
+
+        self.pending = deque(self.names)
+        self.states = {name: QUEUED for name in self.names}
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.running = False
+        # Live worker threads, and how many were started in total (for their names)
+        self.threads = []
+        self.started = 0
+        # The episode played next, and the extra worker started for it
+        self.priority = None
+        self.extra = 0
+
+    # ----------------- Control -----------------
+    def pause(self, name) -> bool:
+        """
+        Returns:
+            bool: Whether the episode was queued or running and is now paused.
+        """
+        with self.condition:
+            state = self.states.get(name)
+            if state == QUEUED:
+                self.pending.remove(name)
+                self.states[name] = PAUSED
+            elif state in (ACTIVE, RESUMING):
+                self.states[name] = PAUSING
+                self.helper.pause(name)
+            else:
+                return False
+        self.logger.info("%3s | Paused", name)
+        return True
+
+    def resume(self, name) -> bool:
+        """
+        Returns:
+            bool: Whether the episode was paused and is queued again.
+        """
+        with self.condition:
+            state = self.states.get(name)
+            if state == PAUSED:
+                self.helper.resume(name)
+                self.pending.appendleft(name)
+                self.states[name] = QUEUED
+                self.condition.notify()
+            elif state == PAUSING:
+                # Queued again once its transfer has returned
+                self.states[name] = RESUMING
+            else:
+                return False
+        self.logger.info("%3s | Resumed", name)
+        return True
+
+    def cancel(self, name) -> bool:
+        """
+        Returns:
+            bool: Whether the episode was not finished yet and is now cancelled.
+        """
+        with self.condition:
+            state = self.states.get(name)
+            if state == QUEUED:
+                self.pending.remove(name)
+                self.states[name] = CANCELLED
+            elif state == PAUSED:
+                self.states[name] = CANCELLED
+            elif state in RUNNING:
+                self.states[name] = CANCELLING
+            else:
+                return False
+            self.helper.paused.discard(name)
+            self.helper.cancel(name)
+            if self.states[name] == CANCELLED:
+                self._end_priority(name)
+            self.condition.notify_all()
+        self.logger.info("%3s | Cancelled", name)
+        return True
+
+    def play_next(self, name) -> bool:
+        """
+        Downloads an episode before the others and gives it most of the bandwidth
+        (see DownloadHelper.set_priority). A queued, paused or failed episode starts
+        at once, on an extra worker when every worker is busy.
+        Returns:
+            bool: Whether the episode is downloading or done.
+        """
+        with self.condition:
+            state = self.states.get(name)
+            if state is None or state == CANCELLED:
+                return False
+            if state == DONE:
+                return True
+            if state in (QUEUED, PAUSED, FAILED):
+                if state == QUEUED:
+                    self.pending.remove(name)
+                self.helper.resume(name)
+                self.pending.appendleft(name)
+                self.states[name] = QUEUED
+                self.extra = 1
+                self.condition.notify_all()
+                if self.running:
+                    self._spawn()
+            elif state == PAUSING:
+                self.states[name] = RESUMING
+            self.priority = name
+            self.helper.set_priority(name)
+        self.logger.info("%3s | Playing next", name)
+        return True
+
+    def stop(self) -> None:
+        """
+        Stops every transfer and ends the batch; partial files are kept.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.helper.stop()
+
+    def state(self, name) -> str:
+        return self.states.get(name)
+
+    def set_workers(self, workers: int) -> None:
+        """
+        Changes how many episodes download at once. New workers start right away;
+        when shrinking, workers leave once their current episode ends.
+        """
+        with self.condition:
+            self.workers = max(workers, 1)
+            self.condition.notify_all()
+            if self.running:
+                self._spawn()
+        self.logger.info("Downloading %s episodes at once", self.workers)
+
+    @property
+    def active(self) -> int:
+        with self.condition:
+            return sum(1 for state in self.states.values() if state in RUNNING)
+
+    # ----------------- Running -----------------
+    def _spawn(self) -> None:
+        # Called with the condition held
+        while len(self.threads) < min(self.workers + self.extra, len(self.names)):
+            thread = threading.Thread(target=self._work, name=f"episode-{self.started}", daemon=True)
+            self.started += 1
+            self.threads.append(thread)
+            thread.start()
+
+    def _end_priority(self, name) -> None:
+        # Called with the condition held
+        if name == self.priority:
+            self.priority = None
+            self.extra = 0
+            self.helper.set_priority(None)
+
+    def _next(self):
+        with self.condition:
+            while not self.stopping:
+                if len(self.threads) > self.workers + self.extra:
+                    # Shrunk by set_workers, or the episode played next ended
+                    break
+                if self.pending:
+                    name = self.pending.popleft()
+                    self.states[name] = ACTIVE
+                    return name
+                if not any(state in RUNNING or state == PAUSED for state in self.states.values()):
+                    break
+                self.condition.wait()
+            self.threads.remove(threading.current_thread())
+            return None
+
+    def _finish(self, name) -> None:
+        with self.condition:
+            state = self.states[name]
+            if state == PAUSING:
+                self.states[name] = PAUSED
+            elif state == RESUMING:
+                self.helper.resume(name)
+                self.pending.appendleft(name)
+                self.states[name] = QUEUED
+            elif state == CANCELLING:
+                self.states[name] = CANCELLED
+            else:
+                success = self.helper.process.get(name, {}).get("success")
+                self.states[name] = DONE if success else FAILED
+            if self.states[name] in (DONE, FAILED, CANCELLED):
+                self._end_priority(name)
+            self.condition.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            name = self._next()
+            if name is None:
+                return
+            try:
+                self.helper.download_episode(name, self.data)
+            except Exception as e:
+                self.logger.error("Error downloading episode %s: %s", name, e)
+            self._finish(name)
+
+    def run(self, stop_flag: threading.Event = None) -> int:
+        """
+        Downloads the batch and waits for it to end. Setting `stop_flag` stops it.
+        Returns:
+            int: The number of episodes downloaded successfully.
+        """
+        with self.condition:
+            self.running = True
+            self._spawn()
+        while True:
+            with self.condition:
+                if not self.threads:
+                    self.running = False
+                    break
+                thread = self.threads[0]
+            if stop_flag is not None and stop_flag.is_set() and not self.stopping:
+                self.stop()
+            thread.join(POLL_INTERVAL)
+        return sum(1 for state in self.states.values() if state == DONE)
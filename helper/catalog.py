@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import bisect
+import gzip
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+
+from helper.lazy_import import lazy_import
+
+requests = lazy_import("requests")
+
+# The anime list the anime1.me front page loads:
+# [[category id, title, episodes, year, season, fansub], ...]
+CATALOG_URL = "https://d1zquzjgwo9yb.cloudfront.net/"
+CATEGORY_URL = "https://anime1.me/?cat={}"
+CATALOG_PATH = "catalog.json.gz"
+MAX_AGE = 24 * 60 * 60  # seconds before the index is refreshed
+
+# Common variant characters folded to the form used on anime1.me
+_VARIANTS = str.maketrans({"裏": "裡", "麵": "麪", "衆": "眾", "綫": "線", "戶": "戸", "姫": "姬", "産": "產"})
+
+
+def normalize(title: str) -> str:
+    """
+    Normalizes a title for lookup: NFKC (full-width to half-width), case folding,
+    variant characters folded, and whitespace, punctuation and symbols removed.
+    """
+    title = unicodedata.normalize("NFKC", title).casefold().translate(_VARIANTS)
+    return "".join(c for c in title if unicodedata.category(c)[0] not in "PZS")
+
+
+def bigrams(text: str) -> set:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def episode_count(episodes: str) -> int:
+    """
+    Extracts the number of episodes from the list's episode column ("1-12", "連載中(05)").
+    """
+    numbers = [int(n) for n in re.findall(r"\d+", str(episodes))]
+    return max(numbers) if numbers else 0
+
+
+class CatalogIndex:
+    """
+    Locally persisted index of the anime1.me catalog.
+    Entries are kept as compact rows in a gzip file. On load, a sorted key list
+    (prefix lookup with bisect) and a bigram posting index (fuzzy lookup) are built in
+    memory, and updates only touch the rows that changed.
+    """
+
+    def __init__(self, path: str = CATALOG_PATH, logger: logging = logging) -> None:
+        self.path = path
+        self.logger = logger
+
+        self.entries = {}
+        self.keys = []
+        self.postings = {}
+        self.etag = None
+        self.updated = 0
+
+    # ----------------- Storage -----------------
+    def load(self) -> bool:
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.etag = stored.get("etag")
+        self.updated = stored.get("updated", 0)
+        for row in stored.get("rows", []):
+            self._add(row, keep_sorted=False)
+        self.keys.sort()
+        return True
+
+    def save(self) -> None:
+        rows = [
+            [e["id"], e["title"], e["episodes"], e["year"], e["season"], e["fansub"]]
+            for e in self.entries.values()
+        ]
+        temp_path = f"{self.path}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump(
+                {"etag": self.etag, "updated": self.updated, "rows": rows},
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        os.replace(temp_path, self.path)
+
+    # ----------------- Index maintenance -----------------
+    @staticmethod
+    def _pad(row: list) -> list:
+        return list(row[:6]) + [""] * (6 - len(row))
+
+    def _add(self, row: list, keep_sorted: bool = True) -> None:
+        row = self._pad(row)
+        entry = {
+            "id": row[0],
+            "title": str(row[1]),
+            "episodes": row[2],
+            "year": row[3],
+            "season": row[4],
+            "fansub": row[5],
+            "count": episode_count(row[2]),
+            "url": CATEGORY_URL.format(row[0]),
+            "key": normalize(str(row[1])),
+        }
+        entry["grams"] = len(bigrams(entry["key"]))
+        self.entries[entry["id"]] = entry
+        if keep_sorted:
+            bisect.insort(self.keys, (entry["key"], entry["id"]))
+        else:
+            self.keys.append((entry["key"], entry["id"]))
+        for gram in bigrams(entry["key"]):
+            self.postings.setdefault(gram, set()).add(entry["id"])
+
+    def _remove(self, _id) -> None:
+        entry = self.entries.pop(_id)
+        i = bisect.bisect_left(self.keys, (entry["key"], _id))
+        if i < len(self.keys) and self.keys[i] == (entry["key"], _id):
+            del self.keys[i]
+        for gram in bigrams(entry["key"]):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def merge(self, rows: list) -> dict:
+        """
+        Applies a fresh catalog, touching only rows that were added, changed or removed.
+        Returns:
+            dict: Counts of "added", "changed" and "removed" entries.
+        """
+        counts = {"added": 0, "changed": 0, "removed": 0}
+        seen = set()
+        for row in rows:
+            if not row:
+                continue
+            row = self._pad(row)
+            _id = row[0]
+            seen.add(_id)
+            old = self.entries.get(_id)
+            if old is None:
+                self._add(row)
+                counts["added"] += 1
+            elif [old["title"], old["episodes"], old["year"], old["season"], old["fansub"]] != row[1:6]:
+                self._remove(_id)
+                self._add(row)
+                counts["changed"] += 1
+        for _id in [_id for _id in self.entries if _id not in seen]:
+            self._remove(_id)
+            counts["removed"] += 1
+        return counts
+
+    def update(self, session: requests.Session = None, force: bool = False) -> dict:
+        """
+        Refreshes the index from the site if it is older than MAX_AGE (or `force`).
+        A conditional request is used, so an unchanged catalog is not downloaded again.
+        Returns:
+            dict: The merge counts, empty if nothing changed.
+        """
+        if not force and self.entries and time.time() - self.updated < MAX_AGE:
+            return {}
+        session = session or requests.Session()
+        header = {"referer": "https://anime1.me/"}
+        if self.etag and self.entries:
+            header["If-None-Match"] = self.etag
+        response = session.get(CATALOG_URL, headers=header, timeout=30)
+        self.updated = time.time()
+        if response.status_code == 304:
+            self.save()
+            return {}
+        response.raise_for_status()
+
+        counts = self.merge(response.json())
+        self.etag = response.headers.get("ETag")
+        self.save()
+        self.logger.info(
+            f"Catalog updated: {len(self.entries)} entries "
+            f"(+{counts['added']} ~{counts['changed']} -{counts['removed']})"
+        )
+        return counts
+
+    # ----------------- Lookup -----------------
+    def prefix(self, query: str, limit: int = 20) -> list:
+        """
+        Looks up the entries whose title starts with `query` (after normalization).
+        Args:
+            limit (int | None): The most entries returned, None for all of them.
+        Returns:
+            list: The matching entries in title order, none for an empty query.
+        """
+        key = normalize(query)
+        if not key:
+            # Every title starts with ""
+            return []
+        results = []
+        i = bisect.bisect_left(self.keys, (key,))
+        while i < len(self.keys) and (limit is None or len(results) < limit) and self.keys[i][0].startswith(key):
+            results.append(self.entries[self.keys[i][1]])
+            i += 1
+        return results
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """
+        Looks up entries by title: prefix matches first, then fuzzy matches ranked by
+        bigram similarity (substring matches rank higher).
+        Returns:
+            list: The matching entries, best first.
+        """
+        key = normalize(query)
+        if not key:
+            return []
+        results = self.prefix(query, limit)
+        found = {entry["id"] for entry in results}
+
+        grams = bigrams(key)
+        hits = {}
+        for gram in grams:
+            for _id in self.postings.get(gram, ()):
+                if _id not in found:
+                    hits[_id] = hits.get(_id, 0) + 1
+
+        scored = []
+        for _id, common in hits.items():
+            entry = self.entries[_id]
+            score = 2 * common / (len(grams) + entry["grams"])
+            if key in entry["key"]:
+                score += 1
+            if score >= 0.3:
+                scored.append((score, _id))
+        scored.sort(key=lambda item: item[0], reverse=True)
+
+        for _, _id in scored[: limit - len(results)]:
+            results.append(self.entries[_id])
+        return results
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+CONTENT_INDEX_PATH = "content_index.json"
+SAMPLE_SIZE = 1024 * 1024  # bytes hashed from the start and the end of a file
+EXTENSIONS = (".mp4", ".ts")
+
+
+def partial_hash(size: int, head: bytes, tail: bytes) -> str:
+    """
+    Hashes a file by its size and its first and last SAMPLE_SIZE bytes.
+    """
+    digest = hashlib.sha1(str(size).encode())
+    digest.update(head)
+    digest.update(tail)
+    return digest.hexdigest()
+
+
+def file_partial_hash(path: str, size: int) -> str:
+    with open(path, "rb") as f:
+        head = f.read(SAMPLE_SIZE)
+        f.seek(max(size - SAMPLE_SIZE, 0))
+        tail = f.read(SAMPLE_SIZE)
+    return partial_hash(size, head, tail)
+
+
+def materialize(source: str, destination: str) -> str:
+    """
+    Places a copy of `source` at `destination`, as a hard link when possible.
+    Returns:
+        str: "link" or "copy".
+    """
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    try:
+        os.link(source, destination)
+        return "link"
+    except OSError:
+        shutil.copy2(source, destination)
+        return "copy"
+
+
+class ContentIndex:
+    """
+    Index of the finished videos under the download folder by size and partial hash.
+    Before a transfer, a local file with the same size and the same first and last
+    MB as the remote file is reused instead of downloading it again, which catches
+    re-titled series, custom titles and series listed in two categories. The index is
+    cached on disk and only files whose size or mtime changed are hashed again.
+    """
+
+    def __init__(self, root: str, cache_path: str = CONTENT_INDEX_PATH, logger: logging = logging) -> None:
+        self.root = root
+        self.cache_path = cache_path
+        self.logger = logger
+
+        self.files = {}
+        self.by_size = {}
+        self.scanned = False
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                self.files = json.load(f)
+        except (OSError, ValueError):
+            self.files = {}
+
+    def save(self) -> None:
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.files, f, ensure_ascii=False)
+        os.replace(temp_path, self.cache_path)
+
+    def _walk(self, path: str):
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from self._walk(entry.path)
+                    elif entry.name.endswith(EXTENSIONS):
+                        yield entry
+        except OSError:
+            return
+
+    def scan(self) -> None:
+        """
+        Brings the index up to date with the files under the root folder.
+        """
+        self.load()
+        files = {}
+        hashed = 0
+        for entry in self._walk(self.root):
+            stat = entry.stat()
+            path = os.path.abspath(entry.path)
+            cached = self.files.get(path)
+            if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+                files[path] = cached
+                continue
+            try:
+                files[path] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "partial": file_partial_hash(path, stat.st_size),
+                }
+                hashed += 1
+            except OSError:
+                continue
+
+        self.files = files
+        self.by_size = {}
+        for path, info in files.items():
+            self.by_size.setdefault(info["size"], []).append(path)
+        self.scanned = True
+        self.save()
+        self.logger.debug(f"Content index: {len(files)} files, {hashed} hashed")
+
+    def add(self, path: str) -> None:
+        """
+        Adds a finished download to the index.
+        """
+        with self.lock:
+            if not self.scanned:
+                return
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            self.files[path] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "partial": file_partial_hash(path, stat.st_size),
+            }
+            self.by_size.setdefault(stat.st_size, []).append(path)
+            self.save()
+
+    def find(self, size: int, fetch_range):
+        """
+        Looks for a local file with the same content as a remote file.
+        Args:
+            size (int): The size of the remote file.
+            fetch_range (callable): fetch_range(start, end) returns the remote bytes
+                start..end (inclusive), or None if the range cannot be read.
+        Returns:
+            str | None: The path of the matching local file.
+        """
+        if size <= 0:
+            return None
+        with self.lock:
+            if not self.scanned:
+                self.scan()
+            candidates = [
+                path for path in self.by_size.get(size, []) if os.path.exists(path)
+            ]
+        if not candidates:
+            return None
+
+        head = fetch_range(0, min(SAMPLE_SIZE, size) - 1)
+        if head is None:
+            return None
+        tail = fetch_range(max(size - SAMPLE_SIZE, 0), size - 1)
+        if tail is None:
+            return None
+        remote = partial_hash(size, head, tail)
+        for path in candidates:
+            if self.files[path]["partial"] == remote:
+                return path
+        return None
@@ -0,0 +1,468 @@
+from __future__ import annotations
+
+import hmac
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from helper.eta import ThroughputEstimator
+
+CONTROL_HOST = "127.0.0.1"  # loopback only, other hosts need an explicit bind address
+CONTROL_PORT = 8612
+EVENT_INTERVAL = 0.5  # seconds between two coalesced progress events
+KEEPALIVE = 15  # seconds after which an idle event stream gets a comment line
+
+# Job states
+QUEUED, RESOLVING, DOWNLOADING, DONE, FAILED, CANCELLED = (
+    "queued", "resolving", "downloading", "done", "failed", "cancelled",
+)
+
+PAGE = """<!doctype html>
+<meta charset="utf-8">
+<title>Anime1 downloader</title>
+<style>body{font:14px sans-serif;background:#111;color:#eee}td{padding:2px 8px}</style>
+<p id="metrics"></p>
+<table id="episodes"></table>
+<script>
+const episodes = {};
+const source = new EventSource("/events" + location.search);
+function render(data) {
+  if (data.metrics) document.getElementById("metrics").textContent =
+    `${data.metrics.finished}/${data.metrics.episodes} episodes, ${data.metrics.rate_text}, ETA ${data.metrics.eta_text}`;
+  for (const [job, names] of Object.entries(data.episodes || {}))
+    for (const [name, state] of Object.entries(names)) episodes[job + "/" + name] = state;
+  document.getElementById("episodes").innerHTML = Object.entries(episodes).map(([key, e]) =>
+    `<tr><td>${key}</td><td>${e.state}</td><td>${(100 * e.downloaded / Math.max(e.total, 1)).toFixed(1)}%</td></tr>`
+  ).join("");
+}
+source.addEventListener("snapshot", e => render(JSON.parse(e.data)));
+source.addEventListener("progress", e => render(JSON.parse(e.data)));
+</script>
+"""
+
+
+class ControlServer:
+    """
+    Local HTTP API to queue downloads and follow their progress without the UI.
+
+    Jobs (a series, optionally a list or range of its episodes) are run one after
+    the other by the app's download_headless, sharing its DownloadHelper.
+    Progress is published as Server-Sent Events: one thread samples the helper
+    every EVENT_INTERVAL seconds, keeps only the episodes that changed, and
+    serializes the event once for every connected client, so the cost of a tick
+    does not grow with the number of clients. A new client first receives a full
+    snapshot.
+
+    When a token is set, every request must carry it as a bearer token (or as
+    `?token=` for browsers, whose EventSource cannot send headers).
+
+    Endpoints (JSON bodies):
+        GET  /                     -> a minimal progress page
+        POST /jobs   {"series", "episodes" | "range"} -> 201 {"id"}
+        GET  /jobs                 -> job summaries
+        GET  /jobs/<id>            -> a job with the state of each episode
+        POST /jobs/<id>/cancel     -> cancels the job, or {"episode"} only
+        POST /jobs/<id>/pause      {"episode"}
+        POST /jobs/<id>/resume     {"episode"}
+        POST /jobs/<id>/play       {"episode"} -> {"stream"}: the URL to play it from
+        GET  /metrics              -> totals, rate, ETA, clients, circuits
+        GET  /events               -> text/event-stream of "snapshot" then "progress"
+    """
+
+    def __init__(self, downloader, token: str = "", interval: float = EVENT_INTERVAL, logger: logging = logging) -> None:
+        # The app: download_helper, batch, resolve_series(series), download_headless(data, names), play_next(name)
+        self.downloader = downloader
+        self.token = token
+        self.interval = interval
+        self.logger = logger
+        self.server = None
+
+        self.jobs = {}
+        self.pending = deque()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.current = None
+        self.stopping = False
+
+        # Coalesced events: the latest serialized event and its sequence number
+        self.events = threading.Condition()
+        self.sequence = 0
+        self.event = b""
+        self.last_state = {}
+        self.clients = 0
+        self.estimator = None
+        self.estimator_lock = threading.Lock()
+        self.publish_time = 0.0
+
+    # ----------------- Jobs -----------------
+    def add_job(self, series: str, episodes: list = None, episode_range: list = None) -> dict:
+        with self.lock:
+            job = {
+                "id": str(next(self.ids)),
+                "series": series,
+                "episodes": episodes,
+                "range": episode_range,
+                "title": series,
+                "names": [],
+                "state": QUEUED,
+                "error": "",
+                "finished": 0,
+            }
+            self.jobs[job["id"]] = job
+            self.pending.append(job["id"])
+            self.wakeup.notify()
+        self.logger.info(f"Job {job['id']} queued: {series}")
+        return job
+
+    def cancel_job(self, job_id: str) -> bool:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["state"] in (DONE, FAILED, CANCELLED):
+                return False
+            state = job["state"]
+            job["state"] = CANCELLED
+            if state == QUEUED:
+                self.pending.remove(job_id)
+                return True
+        batch = getattr(self.downloader, "batch", None)
+        if state == DOWNLOADING and batch is not None:
+            for name in job["names"]:
+                batch.cancel(name)
+        return True
+
+    def episode_action(self, job_id: str, action: str, name) -> bool:
+        job = self.jobs.get(job_id)
+        batch = getattr(self.downloader, "batch", None)
+        if job is None or job is not self.current or batch is None or name not in job["names"]:
+            return False
+        return getattr(batch, action)(name)
+
+    def _select(self, job: dict, data: dict) -> list:
+        names = data["names"]
+        if job["episodes"]:
+            wanted = {str(name) for name in job["episodes"]}
+            return [name for name in names if str(name) in wanted]
+        if job["range"]:
+            start, end = job["range"]
+            return names[max(int(start) - 1, 0) : int(end)]
+        return list(names)
+
+    def _run_job(self, job: dict) -> None:
+        data = self.downloader.resolve_series(job["series"])
+        if data is None:
+            job["state"], job["error"] = FAILED, "series not found"
+            return
+        names = self._select(job, data)
+        with self.lock:
+            if job["state"] == CANCELLED:
+                return
+            job["title"], job["names"], job["state"] = data["title"], names, DOWNLOADING
+            self.estimator = ThroughputEstimator(
+                [name for other in self.jobs.values() for name in other["names"]]
+            )
+        # download_headless sets the batch of this job once its sizes are probed
+        self.downloader.batch = None
+        job["finished"] = self.downloader.download_headless(data, names) or 0
+        batch = getattr(self.downloader, "batch", None)
+        with self.lock:
+            # Kept once the batch is gone
+            job["states"] = {name: batch.state(name) for name in names} if batch is not None else {}
+            if job["state"] != CANCELLED:
+                job["state"] = DONE if job["finished"] == len(names) else FAILED
+
+    def _runner(self, stop_flag: threading.Event) -> None:
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopping:
+                    self.wakeup.wait()
+                if self.stopping:
+                    return
+                job = self.jobs[self.pending.popleft()]
+                job["state"] = RESOLVING
+                self.current = job
+            try:
+                self._run_job(job)
+            except Exception as e:
+                self.logger.error(f"Job {job['id']} failed: {e}")
+                job["state"], job["error"] = FAILED, str(e)
+            finally:
+                self.current = None
+            if stop_flag.is_set():
+                return
+
+    def play(self, job_id: str, name):
+        """
+        Plays an episode of the running job next (see the app's play_next).
+        Returns:
+            str | None: The URL to stream it from.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job is not self.current or name not in job["names"]:
+            return None
+        return self.downloader.play_next(name)
+
+    # ----------------- Snapshots -----------------
+    def job_summary(self, job: dict) -> dict:
+        summary = {key: job[key] for key in ("id", "series", "title", "state", "error", "finished")}
+        summary["episodes"] = len(job["names"])
+        return summary
+
+    def episode_states(self, job: dict) -> dict:
+        process = self.downloader.download_helper.process
+        batch = getattr(self.downloader, "batch", None) if job is self.current else None
+        final = job.get("states", {})
+        states = {}
+        for name in job["names"]:
+            entry = process.get(name) or {}
+            if name in final:
+                state = final[name]
+            elif batch is not None and batch.state(name) is not None:
+                state = batch.state(name)
+            else:
+                state = "queued"
+            states[str(name)] = {
+                "state": state,
+                "downloaded": max(entry.get("downloaded_size", 0), 0),
+                "total": entry.get("total_size", -1),
+            }
+        return states
+
+    def metrics(self) -> dict:
+        from helper.eta import format_eta, format_rate
+
+        helper = self.downloader.download_helper
+        estimator = self.estimator
+        if estimator is not None:
+            with self.estimator_lock:
+                estimator.update(helper.process)
+        with self.lock:
+            jobs = list(self.jobs.values())
+        rate = estimator.rate if estimator is not None else 0.0
+        eta = estimator.eta if estimator is not None else None
+        return {
+            "jobs": len(jobs),
+            "jobs_queued": sum(1 for job in jobs if job["state"] == QUEUED),
+            "episodes": sum(len(job["names"]) for job in jobs),
+            "finished": helper.finished,
+            "downloaded_size": helper.downloaded_size,
+            "total_size": helper.total_size,
+            "rate": rate,
+            "rate_text": format_rate(rate),
+            "eta": eta,
+            "eta_text": format_eta(eta),
+            "clients": self.clients,
+            "publish_ms": self.publish_time * 1000,
+            "stalls": helper.watchdog.summary(),
+            "circuits": helper.health.states(),
+        }
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return {
+            "jobs": [self.job_summary(job) for job in jobs],
+            "episodes": {job["id"]: self.episode_states(job) for job in jobs if job["names"]},
+            "metrics": self.metrics(),
+        }
+
+    def _publish(self) -> None:
+        start = time.perf_counter()
+        snapshot = self.snapshot()
+        changed = {}
+        for job_id, states in snapshot["episodes"].items():
+            last = self.last_state.setdefault(job_id, {})
+            for name, state in states.items():
+                if last.get(name) != state:
+                    last[name] = state
+                    changed.setdefault(job_id, {})[name] = state
+        jobs = [job for job in snapshot["jobs"] if self.last_state.get(("job", job["id"])) != job]
+        for job in jobs:
+            self.last_state[("job", job["id"])] = job
+        if changed or jobs:
+            payload = json.dumps({"jobs": jobs, "episodes": changed, "metrics": snapshot["metrics"]})
+            with self.events:
+                self.sequence += 1
+                self.event = f"id: {self.sequence}\nevent: progress\ndata: {payload}\n\n".encode("utf-8")
+                self.events.notify_all()
+        self.publish_time = time.perf_counter() - start
+
+    def _publisher(self, stop_flag: threading.Event) -> None:
+        while not stop_flag.wait(self.interval) and not self.stopping:
+            try:
+                self._publish()
+            except Exception as e:
+                self.logger.error(f"Error publishing progress: {e}")
+
+    def stream(self, write) -> None:
+        """
+        Writes the event stream to a client until it disconnects: a snapshot, then
+        every coalesced progress event. A client slower than EVENT_INTERVAL skips
+        to the latest event.
+        """
+        snapshot = json.dumps(self.snapshot())
+        with self.events:
+            seen = self.sequence
+        write(f"event: snapshot\ndata: {snapshot}\n\n".encode("utf-8"))
+        while not self.stopping:
+            with self.events:
+                if self.sequence == seen:
+                    self.events.wait(KEEPALIVE)
+                if self.sequence == seen:
+                    event = b": keepalive\n\n"
+                else:
+                    seen, event = self.sequence, self.event
+            write(event)
+
+    # ----------------- HTTP -----------------
+    def make_handler(self):
+        control = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                control.logger.debug(f"Control: {self.address_string()} {format % args}")
+
+            def reply(self, code: int, body, content_type: str = "application/json") -> None:
+                if content_type == "application/json":
+                    body = json.dumps(body, ensure_ascii=False)
+                payload = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def authorized(self, query: dict) -> bool:
+                if not control.token:
+                    return True
+                given = self.headers.get("Authorization", "")
+                if not given and "token" in query:
+                    given = f"Bearer {query['token'][0]}"
+                if hmac.compare_digest(given, f"Bearer {control.token}"):
+                    return True
+                self.reply(401, {"error": "unauthorized"})
+                return False
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not self.authorized(parse_qs(url.query)):
+                    return
+                parts = url.path.strip("/").split("/")
+                if url.path == "/":
+                    self.reply(200, PAGE, "text/html; charset=utf-8")
+                elif url.path == "/jobs":
+                    with control.lock:
+                        jobs = list(control.jobs.values())
+                    self.reply(200, [control.job_summary(job) for job in jobs])
+                elif len(parts) == 2 and parts[0] == "jobs" and parts[1] in control.jobs:
+                    job = control.jobs[parts[1]]
+                    summary = control.job_summary(job)
+                    summary["episodes"] = control.episode_states(job)
+                    self.reply(200, summary)
+                elif url.path == "/metrics":
+                    self.reply(200, control.metrics())
+                elif url.path == "/events":
+                    self.send_events()
+                else:
+                    self.reply(404, {"error": "not found"})
+
+            def send_events(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                def write(data: bytes) -> None:
+                    self.wfile.write(data)
+                    self.wfile.flush()
+
+                with control.events:
+                    control.clients += 1
+                try:
+                    control.stream(write)
+                except OSError:
+                    pass
+                finally:
+                    with control.events:
+                        control.clients -= 1
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if not self.authorized(parse_qs(url.query)):
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(body, dict):
+                        raise ValueError
+                except ValueError:
+                    self.reply(400, {"error": "bad request"})
+                    return
+
+                parts = url.path.strip("/").split("/")
+                if url.path == "/jobs":
+                    series = body.get("series")
+                    episode_range = body.get("range")
+                    if not isinstance(series, str) or not series or (
+                        episode_range is not None and len(episode_range) != 2
+                    ):
+                        self.reply(400, {"error": "expected {\"series\", \"episodes\" or \"range\"}"})
+                        return
+                    job = control.add_job(series, body.get("episodes"), episode_range)
+                    self.reply(201, {"id": job["id"]})
+                elif len(parts) == 3 and parts[0] == "jobs" and parts[1] in control.jobs:
+                    job_id, action = parts[1], parts[2]
+                    if action == "cancel" and "episode" not in body:
+                        ok = control.cancel_job(job_id)
+                    elif action in ("cancel", "pause", "resume"):
+                        ok = control.episode_action(job_id, action, body.get("episode"))
+                    elif action == "play":
+                        url = control.play(job_id, body.get("episode"))
+                        self.reply(200 if url else 409, {"ok": bool(url), "stream": url})
+                        return
+                    else:
+                        self.reply(404, {"error": "not found"})
+                        return
+                    self.reply(200 if ok else 409, {"ok": ok})
+                else:
+                    self.reply(404, {"error": "not found"})
+
+        return Handler
+
+    def serve(self, host: str = CONTROL_HOST, port: int = CONTROL_PORT, stop_flag: threading.Event = None) -> tuple:
+        """
+        Starts the HTTP server, the job runner and the event publisher in
+        background threads. The default binds to loopback only.
+        Returns:
+            tuple: The (host, port) the server is bound to.
+        """
+        stop_flag = stop_flag or threading.Event()
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._runner, args=(stop_flag,), name="control-jobs", daemon=True).start()
+        threading.Thread(target=self._publisher, args=(stop_flag,), name="control-events", daemon=True).start()
+        self.logger.info(f"Control API listening on http://{self.server.server_address[0]}:{self.server.server_address[1]}")
+        if host not in ("127.0.0.1", "localhost", "::1") and not self.token:
+            self.logger.warning("Control API accepts requests from other hosts without a token")
+        return self.server.server_address
+
+    def shutdown(self) -> None:
+        with self.lock:
+            self.stopping = True
+            self.wakeup.notify_all()
+        with self.events:
+            self.events.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
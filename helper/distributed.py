@@ -0,0 +1,447 @@
+from __future__ import annotations
+
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from helper.anime1_fetch import DownloadHelper
+from helper.lazy_import import lazy_import
+
+requests = lazy_import("requests")
+
+COORDINATOR_HOST = "127.0.0.1"  # loopback only, other hosts need an explicit bind address
+COORDINATOR_PORT = 8611
+LEASE_TIME = 60  # seconds a worker keeps an episode without reporting progress
+MAX_ATTEMPTS = 5  # leases per episode before it is given up
+IDLE_WAIT = 5  # seconds a worker waits when no episode is available
+
+
+class Coordinator:
+    """
+    Owns the series crawl and the episode job list, and hands episodes out to
+    workers over HTTP.
+    A worker leases one episode at a time and has to report progress within
+    LEASE_TIME seconds. Leases that run out (the worker died or lost its network)
+    are handed to the next worker that asks, so every episode is downloaded by
+    exactly one live worker.
+    When a token is set, every request must carry it as a bearer token; a
+    coordinator reachable from other hosts should always set one, since the job
+    list contains the API request tokens of every episode.
+
+    Endpoints (JSON bodies):
+        POST /lease    {"worker"}                          -> {"job", "lease", "done"}
+        POST /progress {"worker", "id", "downloaded", "total"} -> 200, or 409 if the lease is lost
+        POST /complete {"worker", "id", "success"}          -> 200, or 409 if the lease is lost
+        GET  /status                                        -> counts and per-episode state
+    """
+
+    def __init__(
+        self,
+        download_helper: DownloadHelper,
+        lease_time: int = LEASE_TIME,
+        token: str = "",
+        logger: logging = logging,
+    ) -> None:
+        self.download_helper = download_helper
+        self.lease_time = lease_time
+        self.token = token
+        self.logger = logger
+
+        self.jobs = {}
+        self.order = []
+        self.lock = threading.Lock()
+        self.all_done = threading.Event()
+        self.server = None
+
+    # ----------------- Jobs -----------------
+    def add_series(self, url: str) -> int:
+        """
+        Crawls a series and adds one job per episode.
+        Returns:
+            int: The number of jobs added.
+        """
+        data = self.download_helper.get_series_data(url)
+        if data is None:
+            return 0
+        return self.add_jobs(data)
+
+    def add_jobs(self, data: dict) -> int:
+        """
+        Adds one job per episode of already fetched series data (see get_series_data).
+        Returns:
+            int: The number of jobs added.
+        """
+        added = 0
+        with self.lock:
+            for name in data["names"]:
+                _id = f"{data['url']}#{name}"
+                if _id in self.jobs:
+                    continue
+                self.jobs[_id] = {
+                    "id": _id,
+                    "title": data["title"],
+                    "name": name,
+                    "apireq": data["data"][name],
+                    "state": "pending",
+                    "worker": None,
+                    "expires": 0,
+                    "attempts": 0,
+                    "downloaded": 0,
+                    "total": 0,
+                }
+                self.order.append(_id)
+                added += 1
+            self.all_done.clear()
+        self.logger.info(f"Coordinator: {added} episode(s) of {data['title']} queued")
+        return added
+
+    def _expire(self, now: float) -> None:
+        for job in self.jobs.values():
+            if job["state"] == "leased" and job["expires"] < now:
+                self.logger.warning(f"Lease of {job['name']} held by {job['worker']} expired")
+                job["state"] = "pending" if job["attempts"] < MAX_ATTEMPTS else "failed"
+                job["worker"] = None
+        self._check_done()
+
+    def _check_done(self) -> None:
+        if all(job["state"] in ("done", "failed") for job in self.jobs.values()):
+            self.all_done.set()
+
+    def lease(self, worker: str) -> dict:
+        with self.lock:
+            now = time.time()
+            self._expire(now)
+            for _id in self.order:
+                job = self.jobs[_id]
+                if job["state"] != "pending":
+                    continue
+                job["state"] = "leased"
+                job["worker"] = worker
+                job["expires"] = now + self.lease_time
+                job["attempts"] += 1
+                self.logger.info(f"Leased {job['name']} to {worker} (attempt {job['attempts']})")
+                return {
+                    "job": {
+                        "id": _id,
+                        "title": job["title"],
+                        "name": job["name"],
+                        "apireq": job["apireq"],
+                    },
+                    "lease": self.lease_time,
+                    "done": False,
+                }
+            return {"job": None, "lease": self.lease_time, "done": self.all_done.is_set()}
+
+    def _held(self, worker: str, _id: str) -> dict:
+        job = self.jobs.get(_id)
+        if job is None or job["state"] != "leased" or job["worker"] != worker:
+            return None
+        return job
+
+    def progress(self, worker: str, _id: str, downloaded: int, total: int) -> bool:
+        with self.lock:
+            job = self._held(worker, _id)
+            if job is None:
+                return False
+            job["expires"] = time.time() + self.lease_time
+            job["downloaded"] = downloaded
+            job["total"] = total
+            return True
+
+    def complete(self, worker: str, _id: str, success: bool) -> bool:
+        with self.lock:
+            job = self._held(worker, _id)
+            if job is None:
+                return False
+            if success:
+                job["state"] = "done"
+                job["downloaded"] = job["total"] = max(job["total"], job["downloaded"])
+            else:
+                job["state"] = "pending" if job["attempts"] < MAX_ATTEMPTS else "failed"
+            job["worker"] = None
+            self.logger.info(f"{job['name']} {'done' if success else 'failed'} on {worker}")
+            self._check_done()
+            return True
+
+    def status(self) -> dict:
+        with self.lock:
+            self._expire(time.time())
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["state"]] = counts.get(job["state"], 0) + 1
+            return {
+                "counts": counts,
+                "done": self.all_done.is_set(),
+                "jobs": [
+                    {
+                        key: self.jobs[_id][key]
+                        for key in ("name", "title", "state", "worker", "attempts", "downloaded", "total")
+                    }
+                    for _id in self.order
+                ],
+            }
+
+    # ----------------- HTTP -----------------
+    def make_handler(self):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                coordinator.logger.debug(f"Coordinator: {self.address_string()} {format % args}")
+
+            def reply(self, code: int, body: dict) -> None:
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def authorized(self) -> bool:
+                if not coordinator.token:
+                    return True
+                if hmac.compare_digest(
+                    self.headers.get("Authorization", ""), f"Bearer {coordinator.token}"
+                ):
+                    return True
+                self.reply(401, {"error": "unauthorized"})
+                return False
+
+            def do_GET(self):
+                if not self.authorized():
+                    return
+                if self.path == "/status":
+                    self.reply(200, coordinator.status())
+                else:
+                    self.reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                if not self.authorized():
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    worker = str(body["worker"])
+                except (ValueError, KeyError):
+                    self.reply(400, {"error": "bad request"})
+                    return
+
+                if self.path == "/lease":
+                    self.reply(200, coordinator.lease(worker))
+                elif self.path == "/progress":
+                    ok = coordinator.progress(
+                        worker, body.get("id"), int(body.get("downloaded", 0)), int(body.get("total", 0))
+                    )
+                    self.reply(200 if ok else 409, {"ok": ok})
+                elif self.path == "/complete":
+                    ok = coordinator.complete(worker, body.get("id"), bool(body.get("success")))
+                    self.reply(200 if ok else 409, {"ok": ok})
+                else:
+                    self.reply(404, {"error": "not found"})
+
+        return Handler
+
+    def serve(self, host: str = COORDINATOR_HOST, port: int = COORDINATOR_PORT) -> tuple:
+        """
+        Starts the HTTP server in a background thread.
+        The default binds to loopback only; pass "0.0.0.0" (ideally with a token) to
+        accept workers on other hosts.
+        Returns:
+            tuple: The (host, port) the server is bound to.
+        """
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.logger.info(f"Coordinator listening on {self.server.server_address[0]}:{self.server.server_address[1]}")
+        if host not in ("127.0.0.1", "localhost", "::1") and not self.token:
+            self.logger.warning("Coordinator accepts requests from other hosts without a token")
+        return self.server.server_address
+
+    def run(self, stop_flag: threading.Event) -> None:
+        """
+        Waits until every episode is done or failed, or stop_flag is set.
+        """
+        while not self.all_done.wait(1):
+            if stop_flag.is_set():
+                return
+        # Idle workers ask again every IDLE_WAIT seconds, keep answering until they
+        # have learned that the job list is done
+        stop_flag.wait(IDLE_WAIT * 2)
+
+    def shutdown(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class EpisodeKey:
+    """
+    Key of a leased episode in the worker's DownloadHelper. Episode names ("01",
+    "02"...) repeat across series, so the key is the series URL and the name; it
+    is written as the name alone, which keeps file names and logs as they were.
+    """
+
+    __slots__ = ("series", "name")
+
+    def __init__(self, series: str, name) -> None:
+        self.series = series
+        self.name = name
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, EpisodeKey) and (self.series, self.name) == (other.series, other.name)
+
+    def __hash__(self) -> int:
+        return hash((self.series, self.name))
+
+    def __str__(self) -> str:
+        return str(self.name)
+
+    def __format__(self, spec: str) -> str:
+        return format(str(self.name), spec)
+
+    def __repr__(self) -> str:
+        return f"EpisodeKey({self.series!r}, {self.name!r})"
+
+
+class Worker:
+    """
+    Leases episodes from a Coordinator and downloads them with a DownloadHelper.
+    Every download slot runs its own lease loop. While an episode downloads, its
+    progress is reported every third of the lease time, which also renews the lease.
+    """
+
+    def __init__(
+        self,
+        download_helper: DownloadHelper,
+        coordinator_url: str,
+        worker_id: str = None,
+        max_workers: int = 4,
+        token: str = "",
+        logger: logging = logging,
+    ) -> None:
+        self.download_helper = download_helper
+        self.coordinator_url = coordinator_url.rstrip("/")
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.max_workers = max_workers
+        self.logger = logger
+
+        self.session = requests.Session()
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def call(self, path: str, body: dict) -> requests.Response:
+        body["worker"] = self.worker_id
+        return self.session.post(f"{self.coordinator_url}{path}", json=body, timeout=10)
+
+    def report(self, job: dict, stop: threading.Event, lost: threading.Event, interval: float) -> None:
+        """
+        Reports the progress of a leased episode until `stop` is set.
+        If the coordinator answers that the lease is lost (it expired and the episode
+        went to another worker), `lost` is set and the transfer is cancelled.
+        """
+        key = self.key(job)
+        while not stop.wait(interval):
+            process = self.download_helper.process.get(key, {})
+            try:
+                response = self.call(
+                    "/progress",
+                    {
+                        "id": job["id"],
+                        "downloaded": process.get("downloaded_size", 0),
+                        "total": process.get("total_size", 0),
+                    },
+                )
+            except requests.RequestException as e:
+                self.logger.warning(f"Failed to report progress of {job['name']}: {e}")
+                continue
+            if response.status_code == 409:
+                self.logger.warning(f"Lease of {job['name']} was lost, stopping its transfer")
+                lost.set()
+                self.download_helper.cancel(key)
+                return
+
+    @staticmethod
+    def key(job: dict) -> EpisodeKey:
+        # The job ID is "<series URL>#<name>"
+        return EpisodeKey(job["id"].rsplit("#", 1)[0], job["name"])
+
+    def run_job(self, job: dict, lease: float) -> None:
+        key = self.key(job)
+        data = {
+            "title": job["title"],
+            "total episode": 1,
+            "names": [key],
+            "data": {key: job["apireq"]},
+        }
+        stop = threading.Event()
+        lost = threading.Event()
+        reporter = threading.Thread(
+            target=self.report, args=(job, stop, lost, max(lease / 3, 1)), daemon=True
+        )
+        # The episode may come back to this worker after an earlier lease was lost
+        self.download_helper.cancelled.discard(key)
+        reporter.start()
+        self.download_helper.total_eps += 1
+        try:
+            self.download_helper.download_episode(key, data)
+        except Exception as e:
+            self.logger.error(f"Error downloading episode {job['name']}: {e}")
+        finally:
+            stop.set()
+            reporter.join()
+
+        if lost.is_set():
+            # Another worker owns the episode now, it reports the completion
+            return
+        success = self.download_helper.process.get(key, {}).get("success", False)
+        try:
+            response = self.call("/complete", {"id": job["id"], "success": bool(success)})
+        except requests.RequestException as e:
+            # The lease runs out and the episode is handed out again
+            self.logger.error(f"Failed to report completion of {job['name']}: {e}")
+            return
+        if response.status_code == 409:
+            self.logger.warning(f"Lease of {job['name']} was lost before its completion was reported")
+
+    def loop(self, stop_flag: threading.Event) -> None:
+        while not stop_flag.is_set():
+            try:
+                response = self.call("/lease", {})
+                response.raise_for_status()
+                reply = response.json()
+            except (requests.RequestException, ValueError) as e:
+                self.logger.warning(f"Coordinator unreachable: {e}")
+                stop_flag.wait(IDLE_WAIT)
+                continue
+
+            if reply["job"] is None:
+                if reply.get("done"):
+                    return
+                stop_flag.wait(IDLE_WAIT)
+                continue
+            self.run_job(reply["job"], reply.get("lease", LEASE_TIME))
+
+    def run(self, stop_flag: threading.Event) -> None:
+        """
+        Runs max_workers lease loops until the coordinator has no work left or
+        stop_flag is set.
+        """
+        self.logger.info(f"Worker {self.worker_id} connected to {self.coordinator_url}")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.loop, stop_flag) for _ in range(self.max_workers)]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error(f"Worker loop failed: {e}")
+        self.logger.info(f"Worker {self.worker_id} finished")
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from helper.lazy_import import lazy_import
+from helper.source_select import EWMA_ALPHA
+
+requests = lazy_import("requests")
+
+PROXY_SCHEMES = ("http", "https", "socks4", "socks4a", "socks5", "socks5h")
+FORBIDDEN_LIMIT = 3  # 403 answers in a row after which a member is removed
+RATE_WINDOW = 1.0  # seconds over which the throughput of a member is measured
+
+
+def parse_members(text: str, logger: logging = logging) -> list:
+    """
+    Parses the `egress` setting: local source addresses and proxy URLs, separated
+    by commas or spaces. Malformed entries are logged and skipped.
+    Returns:
+        list: The valid entries, as strings.
+    """
+    members = []
+    for entry in text.replace(",", " ").split():
+        if "://" in entry:
+            if urlparse(entry).scheme.lower() not in PROXY_SCHEMES or not urlparse(entry).hostname:
+                logger.error(f"Ignoring invalid egress proxy {entry!r}, expected e.g. socks5://host:1080")
+                continue
+        else:
+            try:
+                ipaddress.ip_address(entry)
+            except ValueError:
+                logger.error(f"Ignoring invalid egress entry {entry!r}, expected a local address or a proxy URL")
+                continue
+        members.append(entry)
+    return members
+
+
+class EgressPool:
+    """
+    Spreads transfers over several ways out: local source addresses (each with its
+    own connection pool bound to the address) and HTTP or SOCKS proxies. When a host
+    throttles each client address, every member adds its own share of bandwidth.
+
+    Each transfer takes a member with acquire() and hands it back with release(),
+    and reports what it receives with transferred(). The member picked is the one
+    a new transfer should get the largest share from: the measured throughput of
+    the member (an EWMA over all of its transfers) divided by the transfers it
+    would then carry. Members not measured yet are tried first. A member answering
+    FORBIDDEN_LIMIT 403s in a row is removed, except the last one.
+    """
+
+    def __init__(self, entries: list, adapter_factory, logger: logging = logging) -> None:
+        self.logger = logger
+        self.members = []
+        for entry in entries:
+            member = {
+                "name": entry,
+                "proxy": None,
+                "adapter": None,
+                # EWMA of the combined throughput of its transfers in bytes/s, None until measured
+                "rate": None,
+                "window_start": 0.0,
+                "window_bytes": 0,
+                "active": 0,
+                "transfers": 0,
+                "bytes": 0,
+                "forbidden": 0,
+                "removed": False,
+            }
+            if "://" in entry:
+                member["proxy"] = entry
+            else:
+                member["adapter"] = adapter_factory()
+                # Every pool of the adapter binds its connections to the address
+                member["adapter"].poolmanager.connection_pool_kw["source_address"] = (entry, 0)
+            self.members.append(member)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, entries: list, adapter_factory, logger: logging = logging):
+        """
+        Checks the entries and creates the pool: source addresses must be local
+        addresses of this machine, SOCKS proxies need the optional PySocks package.
+        Returns:
+            EgressPool | None: None when no usable entry is left.
+        """
+        usable = []
+        for entry in entries:
+            if "://" in entry:
+                if entry.lower().startswith("socks"):
+                    try:
+                        import socks  # noqa: F401
+                    except ImportError:
+                        logger.warning(f"SOCKS proxy {entry} needs `pip install requests[socks]`, skipped")
+                        continue
+            else:
+                family = socket.AF_INET6 if ":" in entry else socket.AF_INET
+                try:
+                    with socket.socket(family) as sock:
+                        sock.bind((entry, 0))
+                except OSError as e:
+                    logger.error(f"Egress address {entry} is not usable: {e}")
+                    continue
+            usable.append(entry)
+        if not usable:
+            return None
+        logger.info(f"Egress pool: {', '.join(usable)}")
+        return cls(usable, adapter_factory, logger)
+
+    @property
+    def live(self) -> list:
+        return [member for member in self.members if not member["removed"]]
+
+    def acquire(self, exclude: tuple = ()) -> dict:
+        """
+        Picks the member for a new transfer and counts it as busy until release().
+        Args:
+            exclude (tuple): Names of members not to pick (e.g. already tried), unless
+                no other member is left.
+        Returns:
+            dict: The member.
+        """
+
+        def share(member):
+            if member["rate"] is None:
+                return float("inf")
+            return member["rate"] / (member["active"] + 1)
+
+        with self.lock:
+            candidates = [member for member in self.live if member["name"] not in exclude] or self.live
+            member = max(candidates, key=lambda m: (share(m), -m["active"]))
+            if not member["active"]:
+                # Its idle time does not count against its throughput
+                member["window_start"], member["window_bytes"] = time.monotonic(), 0
+            member["active"] += 1
+            member["transfers"] += 1
+            return member
+
+    def release(self, member: dict) -> None:
+        with self.lock:
+            member["active"] -= 1
+
+    def transferred(self, member: dict, size: int) -> None:
+        """
+        Counts `size` bytes received through `member`.
+        """
+        now = time.monotonic()
+        with self.lock:
+            member["bytes"] += size
+            member["window_bytes"] += size
+            member["forbidden"] = 0
+            elapsed = now - member["window_start"]
+            if elapsed >= RATE_WINDOW:
+                rate = member["window_bytes"] / elapsed
+                old = member["rate"]
+                member["rate"] = rate if not old else old + EWMA_ALPHA * (rate - old)
+                member["window_start"], member["window_bytes"] = now, 0
+
+    def forbidden(self, member: dict) -> bool:
+        """
+        Counts a 403 answer through `member`, and removes it after FORBIDDEN_LIMIT
+        in a row.
+        Returns:
+            bool: Whether the member is removed.
+        """
+        with self.lock:
+            member["forbidden"] += 1
+            if member["removed"] or member["forbidden"] < FORBIDDEN_LIMIT:
+                return member["removed"]
+            if len(self.live) == 1:
+                self.logger.warning(f"Egress {member['name']} keeps answering 403, but it is the last one left")
+                return False
+            member["removed"] = True
+        self.logger.warning(f"Egress {member['name']} removed after {FORBIDDEN_LIMIT} 403 answers in a row")
+        return True
+
+    def bind(self, session: requests.Session, member: dict) -> requests.Session:
+        """
+        Sends the requests of `session` through `member` from now on.
+        Returns:
+            requests.Session: The session.
+        """
+        if member["adapter"] is not None:
+            session.mount("https://", member["adapter"])
+            session.mount("http://", member["adapter"])
+            session.proxies = {}
+        else:
+            session.proxies = {"http": member["proxy"], "https": member["proxy"]}
+        session.egress = member
+        return session
+
+    def session(self, member: dict, base: requests.Session, adapter) -> requests.Session:
+        """
+        Creates a session through `member` sharing the cookies and hooks of `base`,
+        for the segments of an episode spread over several members.
+        Args:
+            adapter: The adapter of proxy members (e.g. the shared adapter of the helper).
+        """
+        session = requests.Session()
+        session.cookies = base.cookies
+        session.hooks = {event: list(hooks) for event, hooks in base.hooks.items()}
+        if adapter is not None:
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        return self.bind(session, member)
+
+    def summary(self) -> str:
+        """
+        Returns a one-line report of the traffic of each member, or "" if none carried any.
+        """
+        with self.lock:
+            members = [dict(member) for member in self.members]
+        if not any(member["transfers"] for member in members):
+            return ""
+        return "Egress: " + ", ".join(
+            f"{member['name']} {member['transfers']} transfers {member['bytes'] / 2**20:.0f} MB"
+            + (" (removed)" if member["removed"] else "")
+            for member in members
+        )
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import math
+import time
+
+SAMPLE_INTERVAL = 0.5  # seconds between two samples of the progress
+HALF_LIFE = 5.0  # seconds after which a throughput sample weighs half
+
+
+def format_rate(rate: float) -> str:
+    return f"{rate / (1024 * 1024):.1f} MB/s"
+
+
+def format_eta(seconds) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    if hours:
+        return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+    return f"{rest // 60:02d}:{rest % 60:02d}"
+
+
+class ThroughputEstimator:
+    """
+    Smoothed throughput and ETA of a batch, computed from the per-episode progress
+    dict (DownloadHelper.process or ShardedDownloader.process).
+
+    Rates are exponentially weighted moving averages with a time constant, so
+    irregular sampling does not skew them. Only bytes transferred between two
+    samples of an active episode count: resumed partial files and reused local
+    copies do not show up as a burst. Sampling is throttled to SAMPLE_INTERVAL, so
+    calling `update` from a 10 Hz UI loop over thousands of episodes stays cheap.
+
+    The remaining bytes count episodes of unknown size (not started yet, or HLS
+    without an estimate) as the average known size. Episodes that failed or were
+    cancelled are left out of them.
+    """
+
+    def __init__(self, names: list, sizes: dict = None, half_life: float = HALF_LIFE) -> None:
+        self.names = list(names)
+        # Sizes known before the download starts (e.g. from the size probe)
+        self.sizes = sizes or {}
+        self.tau = half_life / math.log(2)
+
+        self.last_sample = None
+        self.rate = 0.0
+        # Active episodes: name -> [downloaded at last sample, smoothed rate]
+        self.episodes = {}
+        # Finished episodes: name -> downloaded bytes
+        self.done_sizes = {}
+
+        self.finished = 0
+        self.downloaded = 0
+        self.remaining = 0
+        self.eta = None
+
+    def smooth(self, rate: float, sample: float, elapsed: float) -> float:
+        if rate <= 0:
+            # Seeded with the first sample instead of climbing up from zero
+            return sample
+        alpha = 1 - math.exp(-elapsed / self.tau)
+        return rate + alpha * (sample - rate)
+
+    def update(self, process: dict, now: float = None, dropped=()) -> bool:
+        """
+        Samples the progress, at most every SAMPLE_INTERVAL seconds.
+        Args:
+            process (dict): Per-episode progress.
+            now (float): Time of the sample, time.monotonic() by default.
+            dropped: Episodes cancelled for good (DownloadHelper.dropped).
+        Returns:
+            bool: Whether a new sample was taken.
+        """
+        now = time.monotonic() if now is None else now
+        if self.last_sample is not None and now - self.last_sample < SAMPLE_INTERVAL:
+            return False
+        elapsed = now - self.last_sample if self.last_sample is not None else 0.0
+        self.last_sample = now
+
+        transferred = 0
+        finished = downloaded = remaining = 0
+        known_total = known_count = unknown = 0
+        episodes, sizes, done_sizes = self.episodes, self.sizes, self.done_sizes
+        for name in self.names:
+            if name in done_sizes:
+                # Finished episodes never change again
+                finished += 1
+                downloaded += done_sizes[name]
+                known_total += done_sizes[name]
+                known_count += 1
+                continue
+            state = process.get(name)
+            if name in dropped and not (state and state.get("success")):
+                # Cancelled: its partial file counts, nothing more will arrive
+                episodes.pop(name, None)
+                if state:
+                    downloaded += max(state.get("downloaded_size", 0), 0)
+                continue
+            if not state:
+                total = sizes.get(name, -1)
+                if total > 0:
+                    known_total += total
+                    known_count += 1
+                    remaining += total
+                else:
+                    unknown += 1
+                continue
+
+            total = state.get("total_size", -1)
+            if total <= 0:
+                total = sizes.get(name, -1)
+            done = max(state.get("downloaded_size", 0), 0)
+            if total > 0:
+                known_total += total
+                known_count += 1
+
+            tracked = episodes.get(name)
+            if tracked is not None:
+                delta = max(done - tracked[0], 0)
+                transferred += delta
+                if elapsed > 0:
+                    tracked[1] = self.smooth(tracked[1], delta / elapsed, elapsed)
+                tracked[0] = done
+            if state.get("success"):
+                # "success" starts out False while the transfer runs, "finished" marks a failure
+                episodes.pop(name, None)
+                done_sizes[name] = done
+                finished += 1
+                downloaded += done
+                continue
+            if state.get("finished"):
+                # Failed, it may be tried again and is not cached like a success
+                episodes.pop(name, None)
+                downloaded += done
+                continue
+            if tracked is None and state.get("loading"):
+                episodes[name] = [done, 0.0]
+
+            downloaded += done
+            if total > 0:
+                remaining += max(total - done, 0)
+            else:
+                unknown += 1
+
+        if elapsed > 0:
+            self.rate = self.smooth(self.rate, transferred / elapsed, elapsed)
+        average = known_total / known_count if known_count else 0
+        self.finished = finished
+        self.downloaded = downloaded
+        self.remaining = remaining + unknown * average
+        self.eta = self.remaining / self.rate if self.rate > 1 else None
+        return True
+
+    def episode_eta(self, name, process: dict):
+        """
+        Returns:
+            tuple: (smoothed rate, ETA in seconds or None) of an active episode.
+        """
+        tracked = self.episodes.get(name)
+        if tracked is None:
+            return 0.0, None
+        total = (process.get(name) or {}).get("total_size", -1)
+        if total <= 0:
+            total = self.sizes.get(name, -1)
+        if total <= 0 or tracked[1] <= 1:
+            return tracked[1], None
+        return tracked[1], max(total - tracked[0], 0) / tracked[1]
+
+    def summary(self) -> str:
+        return (
+            f"{self.finished}/{len(self.names)} episodes, "
+            f"{self.downloaded / (1024 * 1024):.0f} MB done, {self.remaining / (1024 * 1024):.0f} MB left, "
+            f"{format_rate(self.rate)}, ETA {format_eta(self.eta)}"
+        )
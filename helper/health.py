@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+FAILURE_LIMIT = 5  # failed answers in a row after which the circuit of a host opens
+COOLDOWN = 30.0  # seconds before the first probe of an open circuit
+MAX_COOLDOWN = 600.0  # cool-down cap, it doubles after every failed probe
+PROBE_TIMEOUT = 60.0  # seconds after which a probe that never answered is replaced
+POLL_INTERVAL = 0.5  # seconds between two checks of the stop condition while waiting
+EPISODE_RETRIES = 3  # times an episode failed by its host waits for it and tries again
+SETTLE_TIMEOUT = 10.0  # seconds a failed episode waits to learn whether its host's circuit opens
+
+# Circuit states
+CLOSED = "closed"  # requests flow
+OPEN = "open"  # new work waits for the cool-down
+HALF_OPEN = "half-open"  # a single probe is on its way
+
+
+def failed(status: int) -> bool:
+    """
+    Whether an answer counts against the health of its host: 403 (refused) and 5xx.
+    """
+    return status == 403 or status >= 500
+
+
+class HostHealth:
+    """
+    Health of each host and a circuit breaker per host.
+
+    Every answer is recorded (observe is a requests response hook). After
+    `failures` failed answers in a row (see failed) the circuit of the host opens:
+    new work waits in wait() instead of being sent and failing. Once `cooldown`
+    seconds have passed, a single caller is let through as a probe; an answer that
+    did not fail closes the circuit and releases the others, a failed one opens it
+    again for twice as long (up to MAX_COOLDOWN).
+
+    Answers that arrive while the circuit is open come from requests sent before
+    it opened and change nothing. `failures` of 0 turns the breaker off, answers
+    are still counted.
+    """
+
+    def __init__(self, failures: int = FAILURE_LIMIT, cooldown: float = COOLDOWN, logger: logging = logging) -> None:
+        self.failures = failures
+        self.cooldown = cooldown
+        self.logger = logger
+        self.hosts = {}
+        self.condition = threading.Condition()
+
+    def _host(self, host: str) -> dict:
+        # Called with the condition held
+        state = self.hosts.get(host)
+        if state is None:
+            state = {
+                "state": CLOSED,
+                # Failed answers in a row, and in total
+                "failed": 0,
+                "failures": 0,
+                "answers": 0,
+                "opened": 0,
+                "cooldown": self.cooldown,
+                # When the next probe may go (OPEN), or when the probe is given up (HALF_OPEN)
+                "until": 0.0,
+                "waiting": 0,
+            }
+            self.hosts[host] = state
+        return state
+
+    def _open(self, host: str, state: dict, cooldown: float) -> None:
+        # Called with the condition held
+        state["state"] = OPEN
+        state["cooldown"] = cooldown
+        state["until"] = time.monotonic() + cooldown
+        state["opened"] += 1
+        # Releases the episodes waiting in settle
+        self.condition.notify_all()
+        self.logger.warning(
+            f"Circuit of {host} open after {state['failed']} failed answers in a row, probing in {cooldown:g} s"
+        )
+
+    def record(self, host: str, status: int) -> None:
+        """
+        Records an answer of `host` with HTTP `status`.
+        """
+        with self.condition:
+            state = self._host(host)
+            state["answers"] += 1
+            if not failed(status):
+                if state["failed"]:
+                    # Ends the failure window, see settle
+                    state["failed"] = 0
+                    self.condition.notify_all()
+                if state["state"] == HALF_OPEN:
+                    state["state"] = CLOSED
+                    state["cooldown"] = self.cooldown
+                    self.logger.warning(f"Circuit of {host} closed, the probe got {status}")
+                    self.condition.notify_all()
+                return
+            state["failed"] += 1
+            state["failures"] += 1
+            if state["state"] == HALF_OPEN:
+                self.logger.warning(f"Probe of {host} got {status}")
+                self._open(host, state, min(state["cooldown"] * 2, MAX_COOLDOWN))
+            elif state["state"] == CLOSED and 0 < self.failures <= state["failed"]:
+                self._open(host, state, state["cooldown"])
+
+    def observe(self, response, *args, **kwargs) -> None:
+        """
+        Response hook recording every answer of a session (see new_session).
+        """
+        self.record(urlparse(response.request.url).hostname or "", response.status_code)
+
+    def tripped(self, host: str) -> bool:
+        """
+        Whether the circuit of `host` is not closed.
+        """
+        with self.condition:
+            state = self.hosts.get(host)
+            return state is not None and state["state"] != CLOSED
+
+    def settle(self, host: str, should_stop=None, timeout: float = SETTLE_TIMEOUT) -> bool:
+        """
+        Waits until the failed answers in a row of `host` are decided: they open its
+        circuit, or an answer that did not fail (or `timeout`) ends them. Episodes
+        that failed before the circuit opened use it to tell a failing host from a
+        failure of their own.
+        Args:
+            should_stop (callable): Waiting ends once it returns True.
+        Returns:
+            bool: Whether the circuit of `host` is not closed.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            state = self.hosts.get(host)
+            while True:
+                if state is None or self.failures <= 0:
+                    return False
+                if state["state"] != CLOSED:
+                    return True
+                if not state["failed"] or (should_stop is not None and should_stop()):
+                    return False
+                now = time.monotonic()
+                if now >= deadline:
+                    return False
+                self.condition.wait(min(deadline - now, POLL_INTERVAL))
+
+    def wait(self, host: str, should_stop=None) -> bool:
+        """
+        Blocks while the circuit of `host` is open. When its cool-down is over, the
+        caller is let through as the probe of the host; its next request decides.
+        Args:
+            should_stop (callable): Waiting ends once it returns True.
+        Returns:
+            bool: False if stopped while waiting.
+        """
+        with self.condition:
+            state = self.hosts.get(host)
+            if state is None or state["state"] == CLOSED:
+                return True
+            state["waiting"] += 1
+            try:
+                while True:
+                    if state["state"] == CLOSED:
+                        return True
+                    if should_stop is not None and should_stop():
+                        return False
+                    now = time.monotonic()
+                    if now >= state["until"]:
+                        if state["state"] == OPEN:
+                            self.logger.info(f"Circuit of {host} half-open, probing")
+                        else:
+                            # The probe was stopped or never answered
+                            self.logger.debug(f"Probe of {host} got no answer, probing again")
+                        state["state"] = HALF_OPEN
+                        state["until"] = now + PROBE_TIMEOUT
+                        return True
+                    self.condition.wait(min(state["until"] - now, POLL_INTERVAL))
+            finally:
+                state["waiting"] -= 1
+
+    def states(self) -> dict:
+        """
+        Returns:
+            dict: Host -> its circuit state, failed answers (in a row and in total),
+            answers, times opened and episodes waiting.
+        """
+        with self.condition:
+            return {
+                host: {key: state[key] for key in ("state", "failed", "failures", "answers", "opened", "waiting")}
+                for host, state in self.hosts.items()
+            }
+
+    def summary(self) -> str:
+        """
+        Returns a one-line report of the hosts whose circuit opened, or "" if none did.
+        """
+        states = self.states()
+        opened = [f"{host} opened {state['opened']}x ({state['state']})" for host, state in states.items() if state["opened"]]
+        if not opened:
+            return ""
+        return "Circuits: " + ", ".join(opened)
@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+from helper.lazy_import import lazy_import
+
+requests = lazy_import("requests")
+
+HLS_MIME_TYPES = (
+    "application/vnd.apple.mpegurl",
+    "application/x-mpegurl",
+    "audio/mpegurl",
+    "audio/x-mpegurl",
+)
+
+STATE_EXTENSION = ".state"
+MAX_WINDOW = 32  # segments fetched at once, whatever hls_workers is set to
+
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def is_hls(url: str, mime_type: str = "") -> bool:
+    """
+    Checks whether a source is an HLS playlist, either by its MIME type or by the
+    `.m3u8` extension of the URL path.
+    """
+    if mime_type and mime_type.lower() in HLS_MIME_TYPES:
+        return True
+    return urlparse(url).path.lower().endswith(".m3u8")
+
+
+def _parse_attributes(line: str) -> dict:
+    attributes = {}
+    for key, value in _ATTRIBUTE_RE.findall(line.split(":", 1)[-1]):
+        attributes[key] = value.strip('"')
+    return attributes
+
+
+def parse_playlist(text: str, base_url: str) -> dict:
+    """
+    Parses an HLS playlist.
+    Args:
+        text (str): The playlist content.
+        base_url (str): The URL of the playlist, used to resolve relative URIs.
+    Returns:
+        dict: A dictionary containing the following keys:
+            - "variants" (list): Variant streams of a master playlist, each a dict
+              with "url" and "bandwidth", sorted by bandwidth (highest first).
+            - "segments" (list): Media segments, each a dict with "index", "url"
+              and "duration". An `EXT-X-MAP` init section is the first segment.
+            - "encrypted" (bool): True if the segments are encrypted.
+            - "fmp4" (bool): True if the segments are fragmented MP4 rather than MPEG-TS.
+    Raises:
+        ValueError: If the text is not an HLS playlist.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != "#EXTM3U":
+        raise ValueError("Not an HLS playlist")
+
+    playlist = {"variants": [], "segments": [], "encrypted": False, "fmp4": False}
+    pending_variant = None
+    duration = 0.0
+
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-STREAM-INF"):
+            attributes = _parse_attributes(line)
+            pending_variant = {"bandwidth": int(attributes.get("BANDWIDTH", 0) or 0)}
+        elif line.startswith("#EXTINF"):
+            try:
+                duration = float(line.split(":", 1)[1].split(",", 1)[0])
+            except ValueError:
+                duration = 0.0
+        elif line.startswith("#EXT-X-KEY"):
+            if _parse_attributes(line).get("METHOD", "NONE") != "NONE":
+                playlist["encrypted"] = True
+        elif line.startswith("#EXT-X-MAP"):
+            uri = _parse_attributes(line).get("URI")
+            if uri:
+                playlist["fmp4"] = True
+                playlist["segments"].append(
+                    {"index": len(playlist["segments"]), "url": urljoin(base_url, uri), "duration": 0.0}
+                )
+        elif line.startswith("#"):
+            continue
+        elif pending_variant is not None:
+            pending_variant["url"] = urljoin(base_url, line)
+            playlist["variants"].append(pending_variant)
+            pending_variant = None
+        else:
+            playlist["segments"].append(
+                {"index": len(playlist["segments"]), "url": urljoin(base_url, line), "duration": duration}
+            )
+            duration = 0.0
+
+    playlist["variants"].sort(key=lambda v: v["bandwidth"], reverse=True)
+    return playlist
+
+
+def fetch_playlist(session: requests.Session, url: str, headers: dict, timeout=10) -> dict:
+    """
+    Fetches a playlist and follows a master playlist to its highest bandwidth variant.
+    Returns:
+        dict: The parsed media playlist (see parse_playlist), with the resolved "url".
+    """
+    for _ in range(3):
+        response = session.get(url, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        playlist = parse_playlist(response.text, response.url or url)
+        if not playlist["variants"]:
+            playlist["url"] = url
+            return playlist
+        url = playlist["variants"][0]["url"]
+    raise ValueError("Too many nested HLS master playlists")
+
+
+def fetch_segment(
+    session: requests.Session,
+    url: str,
+    headers: dict,
+    retries: int = 3,
+    timeout=(10, 30),
+    live: set = None,
+    should_stop=None,
+) -> bytes:
+    """
+    Downloads a single segment, retrying it on its own with a short back-off
+    (except after a 403).
+    Args:
+        live (set): The open response is kept here while it is read, so it can be aborted.
+        should_stop (callable): No retry is made once it returns True.
+    Raises:
+        requests.RequestException: If the segment still fails after all retries.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+                if live is not None:
+                    live.add(response)
+                try:
+                    response.raise_for_status()
+                    return response.content
+                finally:
+                    if live is not None:
+                        live.discard(response)
+        except requests.RequestException as e:
+            if attempt == retries or (should_stop is not None and should_stop()):
+                raise
+            if getattr(e.response, "status_code", None) == 403:
+                # Refused to this client, another try would be refused too
+                raise
+            time.sleep(0.5 * 2**attempt)
+
+
+def load_state(path: str) -> dict:
+    """
+    Loads the segment progress saved next to a partial HLS download.
+    Returns:
+        dict: {"segments_done": int, "offset": int}, zeros if there is no valid state.
+    """
+    try:
+        with open(path + STATE_EXTENSION, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return {"segments_done": int(state["segments_done"]), "offset": int(state["offset"])}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {"segments_done": 0, "offset": 0}
+
+
+def save_state(path: str, segments_done: int, offset: int) -> None:
+    temp_path = path + STATE_EXTENSION + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"segments_done": segments_done, "offset": offset}, f)
+    os.replace(temp_path, path + STATE_EXTENSION)
+
+
+def remove_state(path: str) -> None:
+    try:
+        os.remove(path + STATE_EXTENSION)
+    except FileNotFoundError:
+        pass
+
+
+class SegmentWriter:
+    """
+    Streams downloaded segments into one file in playlist order.
+    Segments are fetched by a bounded pool of workers, at most `window` segments ahead
+    of the one being written, so memory stays bounded by the window size.
+
+    With an EgressPool, each segment is fetched through the member picked for it,
+    in a session sharing the cookies of `session`; a segment answered with 403 is
+    fetched again through another member.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session,
+        segments: list,
+        headers: dict,
+        window: int = 4,
+        retries: int = 3,
+        egress=None,
+        adapter=None,
+        logger: logging = logging,
+    ) -> None:
+        self.session = session
+        self.segments = segments
+        self.headers = headers
+        self.window = min(max(window, 1), MAX_WINDOW)
+        self.retries = retries
+        self.egress = egress
+        # Adapter of the sessions through proxy members
+        self.adapter = adapter
+        self.logger = logger
+        # Segment responses being read, see abort
+        self.live = set()
+        # Member name -> session through it
+        self.sessions = {}
+
+    def abort(self) -> None:
+        """
+        Closes the connections of the segments being fetched, from another thread.
+        """
+        from helper.watchdog import abort_response
+
+        for response in list(self.live):
+            abort_response(response)
+
+    def fetch(self, url: str, should_stop) -> bytes:
+        """
+        Fetches one segment, through a member of the egress pool when there is one.
+        """
+        if self.egress is None:
+            return fetch_segment(self.session, url, self.headers, self.retries, live=self.live, should_stop=should_stop)
+
+        tried = set()
+        while True:
+            member = self.egress.acquire(exclude=tried)
+            tried.add(member["name"])
+            session = self.sessions.get(member["name"])
+            if session is None:
+                session = self.sessions[member["name"]] = self.egress.session(member, self.session, self.adapter)
+            try:
+                chunk = fetch_segment(session, url, self.headers, self.retries, live=self.live, should_stop=should_stop)
+                self.egress.transferred(member, len(chunk))
+                return chunk
+            except requests.HTTPError as e:
+                if getattr(e.response, "status_code", None) != 403:
+                    raise
+                self.egress.forbidden(member)
+                if should_stop() or not [m for m in self.egress.live if m["name"] not in tried]:
+                    raise
+                self.logger.debug("403 through %s for %s, trying another egress", member["name"], url)
+            finally:
+                self.egress.release(member)
+
+    def write_to(self, path: str, start: int, offset: int, on_segment, should_stop) -> bool:
+        """
+        Fetches segments from `start` and appends them to `path`, truncating it to
+        `offset` first so a torn trailing segment is rewritten.
+        Args:
+            path (str): The output file.
+            start (int): The index of the first segment to fetch.
+            offset (int): The size of the file after segment `start - 1`.
+            on_segment (callable): Called as on_segment(index, size, offset) after each write.
+            should_stop (callable): Returns True when the download should stop.
+        Returns:
+            bool: True if all segments were written, False if stopped.
+        """
+        mode = "r+b" if os.path.exists(path) else "wb"
+        # Threads are started on demand, so the pool can be sized for a window that
+        # grows while the episode downloads (see DownloadHelper.set_hls_workers)
+        with open(path, mode) as f, ThreadPoolExecutor(max_workers=MAX_WINDOW) as executor:
+            f.truncate(offset)
+            f.seek(offset)
+
+            pending = {}
+            next_submit = start
+            for index in range(start, len(self.segments)):
+                while next_submit < len(self.segments) and next_submit < index + self.window:
+                    pending[next_submit] = executor.submit(
+                        self.fetch, self.segments[next_submit]["url"], should_stop
+                    )
+                    next_submit += 1
+
+                if should_stop():
+                    for future in pending.values():
+                        future.cancel()
+                    return False
+
+                try:
+                    chunk = pending.pop(index).result()
+                except (requests.RequestException, OSError):
+                    if not should_stop():
+                        raise
+                if should_stop():
+                    # Aborted (an aborted read can also end short without an error):
+                    # the segments written so far stay resumable
+                    for future in pending.values():
+                        future.cancel()
+                    return False
+                f.write(chunk)
+                f.flush()
+                offset += len(chunk)
+                on_segment(index, len(chunk), offset)
+
+        return True
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import mmap
+
+VERIFY_SIZE = 64 * 1024  # bytes compared with the source before a resume offset
+
+
+def first_difference(a, b) -> int:
+    """
+    Returns the index of the first byte where `a` and `b` differ, or the length of
+    the shorter one if it is a prefix of the other. Halves the compared span each
+    step, so only O(log n) slices are compared.
+    """
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def verified_length(path: str, offset: int, fetch_range, size: int = VERIFY_SIZE):
+    """
+    Checks that the first `offset` bytes of the partial file at `path` are a prefix
+    of the source before resuming after them: the `size` bytes before `offset` are
+    compared with the same range of the source. When they differ, earlier windows
+    are compared, each twice as far back, so a file replaced upstream costs a few
+    requests only. The local bytes are read through a memory map.
+    Args:
+        fetch_range (callable): (start, end) -> the source bytes start..end inclusive,
+            or None when the source cannot send ranges.
+    Returns:
+        int | None: The length up to which the file matches the source (`offset` when
+        its tail matches, 0 when nothing does), None when its tail cannot be checked.
+    """
+    if offset <= 0:
+        return 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        end = min(offset, len(view))
+        back = size
+        while end > 0:
+            start = max(end - size, 0)
+            remote = fetch_range(start, end - 1)
+            if remote is None:
+                # Unchecked, unless the tail already differed
+                return None if end == offset else 0
+            local = view[start:end]
+            if local == remote:
+                return end
+            matched = first_difference(local, remote)
+            if matched:
+                # A torn write: good up to the first differing byte
+                return start + matched
+            end = max(end - back, 0)
+            back *= 2
+        return 0
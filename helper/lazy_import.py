@@ -0,0 +1,45 @@
+import importlib
+import sys
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access.
+    Heavy modules (tkinter, requests, bs4) are bound through this so that
+    scripted runs which never touch them do not pay their import cost.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value) -> None:
+        setattr(self._load(), attr, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name: str):
+    """
+    Returns the module if it is already imported, otherwise a LazyModule
+    that imports it on first use.
+    Args:
+        name (str): The dotted module name.
+    Returns:
+        module | LazyModule: The module or its lazy stand-in.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import configparser
+import logging
+import os
+import threading
+
+POLL_INTERVAL = 1.0  # seconds between two checks of the config file
+# [APP] keys applied to a running batch
+LIVE_KEYS = ("max_workers", "hls_workers", "bandwidth_limit")
+
+
+class ConfigWatcher:
+    """
+    Watches the config file while a batch runs and hands the [APP] values of
+    LIVE_KEYS that changed to `on_change`, as a dict of key to string value.
+    The file's modification time is polled, so editors that replace the file
+    instead of writing it in place are noticed too.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        on_change,
+        keys: tuple = LIVE_KEYS,
+        interval: float = POLL_INTERVAL,
+        logger: logging = logging,
+    ) -> None:
+        self.path = path
+        self.on_change = on_change
+        self.keys = keys
+        self.interval = interval
+        self.logger = logger
+
+        self.mtime = self._mtime()
+        self.values = self._read()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self) -> dict:
+        config = configparser.ConfigParser()
+        try:
+            config.read(self.path)
+        except configparser.Error as e:
+            # Caught mid-write or broken by hand, the next change is read again
+            self.logger.warning("Could not read %s: %s", self.path, e)
+            return None
+        if not config.has_section("APP"):
+            return {}
+        return {key: config["APP"][key] for key in self.keys if key in config["APP"]}
+
+    def check(self) -> dict:
+        """
+        Reads the file again if it changed and hands the changed values on.
+        Returns:
+            dict: The values that changed.
+        """
+        mtime = self._mtime()
+        if mtime == self.mtime:
+            return {}
+        self.mtime = mtime
+        values = self._read()
+        if values is None:
+            return {}
+        changed = {key: value for key, value in values.items() if self.values.get(key) != value}
+        self.values = values
+        if changed:
+            self.logger.info("Config changed: %s", ", ".join(f"{k} = {v}" for k, v in changed.items()))
+            self.on_change(changed)
+        return changed
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.logger.error("Error applying config changes: %s", e)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
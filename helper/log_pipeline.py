@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+RATE_INTERVAL = 1.0  # seconds over which repeated messages are counted
+RATE_BURST = 10  # records of one message passed per RATE_INTERVAL
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes at most `burst` records of the same message per `interval` seconds and
+    drops the rest; the next record passed says how many were dropped.
+
+    Records count as the same message when they share their logger, level and
+    format string (`record.msg`, before the %-style arguments are merged), so the
+    per-episode and per-segment messages of a large batch collapse into one line
+    a second. Records above `max_level` (info and up by default) always pass.
+    """
+
+    def __init__(
+        self,
+        interval: float = RATE_INTERVAL,
+        burst: int = RATE_BURST,
+        max_level: int = logging.DEBUG,
+    ) -> None:
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.max_level = max_level
+        # (logger, level, msg) -> [window start, passed in window, dropped]
+        self.windows = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                dropped = window[2] if window is not None else 0
+                self.windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                dropped = 0
+            else:
+                window[2] += 1
+                self.dropped += 1
+                return False
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+        return True
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The listener runs in this process, so records are queued as they are and
+    # formatted on the listener thread instead of the logging thread
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class LogPipeline:
+    """
+    Hands the records of a logger to a background thread, which writes them to
+    the real handlers (console, file). Logging from a transfer thread costs a
+    queue put; formatting and I/O happen on the listener thread, so a slow disk
+    or console does not slow the transfers down.
+
+    Messages should be logged %-style (`logger.debug("%s | ...", _id)`), so
+    records dropped by the level or the RateLimitFilter are never formatted.
+    """
+
+    def __init__(self, logger: logging.Logger, handlers: list, rate_limit: RateLimitFilter = None) -> None:
+        self.logger = logger
+        self.queue = queue.SimpleQueue()
+        self.handler = _DeferredQueueHandler(self.queue)
+        self.rate_limit = rate_limit
+        if rate_limit is not None:
+            self.handler.addFilter(rate_limit)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+
+    @classmethod
+    def install(cls, logger: logging.Logger, handlers: list, rate_limit: RateLimitFilter = None):
+        """
+        Replaces the handlers of `logger` (and a pipeline installed before) with a
+        pipeline writing to `handlers`, and starts it.
+        Returns:
+            LogPipeline: The running pipeline.
+        """
+        previous = getattr(logger, "pipeline", None)
+        if previous is not None:
+            previous.stop()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        pipeline = cls(logger, handlers, rate_limit)
+        pipeline.start()
+        return pipeline
+
+    def start(self) -> None:
+        self.listener.start()
+        self.logger.addHandler(self.handler)
+        self.logger.pipeline = self
+
+    def stop(self) -> None:
+        """
+        Writes the queued records and stops the listener thread.
+        """
+        if getattr(self.logger, "pipeline", None) is self:
+            self.logger.removeHandler(self.handler)
+            del self.logger.pipeline
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.flush()
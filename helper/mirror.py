@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from helper.anime1_fetch import DownloadHelper
+from helper.lazy_import import lazy_import
+
+requests = lazy_import("requests")
+
+CHECKPOINT_PATH = "mirror.json"
+CRAWL_DIR = "mirror_series"  # crawled series data, one file per series
+CHECKPOINT_INTERVAL = 30  # seconds between two checkpoint writes during a pass
+CRAWL_MAX_AGE = 24 * 60 * 60  # seconds before a series is crawled again
+MAX_ATTEMPTS = 5  # attempts per episode before it is skipped
+PASS_DELAY = 10 * 60  # seconds between two passes over the series list
+
+
+class Mirror:
+    """
+    Mirrors many series into the download folder.
+    Episodes of all series are interleaved into one work list and run on a shared
+    pool, while the DownloadHelper's PoliteAdapter keeps per-host connection and rate
+    limits. Progress is checkpointed every CHECKPOINT_INTERVAL seconds and at the end
+    of every pass, so a restarted mirror skips everything already mirrored and resumes
+    partial files. The checkpoint only holds the done episodes and attempts; the
+    crawled series data is written once per crawl to its own file in CRAWL_DIR.
+    """
+
+    def __init__(
+        self,
+        download_helper: DownloadHelper,
+        checkpoint_path: str = CHECKPOINT_PATH,
+        crawl_dir: str = CRAWL_DIR,
+        max_workers: int = 4,
+        logger: logging = logging,
+    ) -> None:
+        self.download_helper = download_helper
+        self.checkpoint_path = checkpoint_path
+        self.crawl_dir = crawl_dir
+        self.max_workers = max_workers
+        self.logger = logger
+
+        self.lock = threading.Lock()
+        self.saved_at = 0.0
+        self.checkpoint = self.load_checkpoint()
+
+    # ----------------- Checkpoint -----------------
+    def load_checkpoint(self) -> dict:
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return {"series": {}}
+        # Checkpoints of older versions kept the crawled data inline
+        for url, series in checkpoint["series"].items():
+            if "data" in series:
+                self.save_crawl(url, series.pop("data"))
+        return checkpoint
+
+    def save_checkpoint(self, force: bool = True) -> None:
+        """
+        Writes the checkpoint. Unless `force`, it is skipped when the last write is
+        less than CHECKPOINT_INTERVAL seconds old.
+        """
+        with self.lock:
+            if not force and time.monotonic() - self.saved_at < CHECKPOINT_INTERVAL:
+                return
+            temp_path = f"{self.checkpoint_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.checkpoint, f, ensure_ascii=False)
+            os.replace(temp_path, self.checkpoint_path)
+            self.saved_at = time.monotonic()
+
+    def crawl_path(self, url: str) -> str:
+        return os.path.join(self.crawl_dir, f"{hashlib.sha1(url.encode()).hexdigest()}.json")
+
+    def save_crawl(self, url: str, data: dict) -> None:
+        os.makedirs(self.crawl_dir, exist_ok=True)
+        path = self.crawl_path(url)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    def load_crawl(self, url: str) -> dict:
+        try:
+            with open(self.crawl_path(url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # ----------------- Planning -----------------
+    def crawl(self, url: str) -> dict:
+        """
+        Returns the checkpointed series data, crawling the series again only when the
+        saved crawl is older than CRAWL_MAX_AGE.
+        """
+        series = self.checkpoint["series"].setdefault(url, {"done": [], "attempts": {}})
+        if time.time() - series.get("crawled", 0) < CRAWL_MAX_AGE:
+            data = self.load_crawl(url)
+            if data:
+                return data
+
+        data = self.download_helper.get_series_data(url)
+        if data is None:
+            return None
+        self.save_crawl(url, data)
+        series["crawled"] = time.time()
+        return data
+
+    def in_library(self, data: dict, name: str) -> bool:
+        folder = f"{self.download_helper.download_path}/{data['title']}"
+        return any(
+            self.download_helper.storage.exists(DownloadHelper.check_filename(folder, name, extension))
+            for extension in ("mp4", "ts")
+        )
+
+    def plan(self, urls: list) -> list:
+        """
+        Builds the work list: every episode that is neither checkpointed, on disk,
+        nor out of attempts. Series are interleaved so no single series (and host)
+        takes the whole pool.
+        Returns:
+            list: (url, data, name) tuples.
+        """
+        per_series = []
+        for url in urls:
+            try:
+                data = self.crawl(url)
+            except requests.RequestException as e:
+                self.logger.error(f"Error crawling {url}: {e}")
+                continue
+            if data is None:
+                continue
+            series = self.checkpoint["series"][url]
+            done = set(series["done"])
+            todo = []
+            for name in data["names"]:
+                if name in done or series["attempts"].get(name, 0) >= MAX_ATTEMPTS:
+                    continue
+                if self.in_library(data, name):
+                    done.add(name)
+                    continue
+                todo.append((url, data, name))
+            series["done"] = sorted(done)
+            per_series.append(todo)
+        self.save_checkpoint()
+
+        jobs = []
+        for i in range(max((len(todo) for todo in per_series), default=0)):
+            jobs.extend(todo[i] for todo in per_series if i < len(todo))
+        return jobs
+
+    # ----------------- Running -----------------
+    def run_pass(self, urls: list, stop_flag: threading.Event) -> int:
+        """
+        Downloads every pending episode once.
+        Returns:
+            int: The number of episodes still pending (failed) after the pass.
+        """
+        jobs = self.plan(urls)
+        self.logger.info(f"Mirror pass: {len(jobs)} episode(s) to download from {len(urls)} series")
+        self.download_helper.total_eps += len(jobs)
+
+        def run(job):
+            url, data, name = job
+            if stop_flag.is_set():
+                return job, False
+            try:
+                self.download_helper.download_episode(name, data)
+            except Exception as e:
+                self.logger.error(f"Error mirroring {name}: {e}")
+            return job, self.download_helper.process.get(name, {}).get("success", False)
+
+        pending = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(run, job) for job in jobs]
+            for future in as_completed(futures):
+                (url, data, name), success = future.result()
+                series = self.checkpoint["series"][url]
+                with self.lock:
+                    if success:
+                        series["done"].append(name)
+                        series["attempts"].pop(name, None)
+                    elif not stop_flag.is_set():
+                        series["attempts"][name] = series["attempts"].get(name, 0) + 1
+                        pending += 1
+                self.save_checkpoint(force=False)
+        self.save_checkpoint()
+        return pending
+
+    def run(self, urls: list, stop_flag: threading.Event) -> None:
+        """
+        Runs passes until everything is mirrored (or out of attempts) or stop_flag is set.
+        """
+        while not stop_flag.is_set():
+            pending = self.run_pass(urls, stop_flag)
+            if not pending:
+                self.logger.info("Mirror complete")
+                return
+            self.logger.info(f"{pending} episode(s) failed, retrying in {PASS_DELAY} seconds")
+            stop_flag.wait(PASS_DELAY)
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import asyncio
+import http.cookiejar
+import json
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+from helper.lazy_import import lazy_import
+from helper.watchdog import CONNECT_TIMEOUT, READ_TIMEOUT
+
+requests = lazy_import("requests")
+
+MAX_STREAMS = 32  # concurrent small requests sent over one HTTP/2 connection
+MAX_CONNECTIONS = 4  # connections per host when a host only speaks HTTP/1.1
+FALLBACK_COOLDOWN = 60  # seconds a host is spoken to over HTTP/1.1 after a transport failure
+
+
+class _RejectCookies(http.cookiejar.DefaultCookiePolicy):
+    # The API answers every episode with its own cookies: they are handed to the
+    # episode's session (see Response.copy_cookies) and never kept by the client
+    def set_ok(self, cookie, request):
+        return False
+
+
+class Response:
+    """
+    The parts of a requests.Response the API and page paths use, for a response
+    received over either transport.
+    """
+
+    def __init__(self, status_code: int, content: bytes, url: str, headers, cookies, http_version: str) -> None:
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+        self.headers = headers
+        self.cookies = cookies
+        self.http_version = http_version
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if 400 <= self.status_code < 600:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def copy_cookies(self, session: requests.Session) -> None:
+        for cookie in self.cookies:
+            session.cookies.set_cookie(cookie)
+
+
+class MultiplexedClient:
+    """
+    HTTP/2 client for the small requests of a batch: API calls and series pages.
+    Every request to a host shares one connection, so dozens of them are in flight
+    at once without opening a connection each. Hosts that do not offer HTTP/2
+    (ALPN) are spoken to over HTTP/1.1 by the same client, and a request that fails
+    on the transport is sent again through the caller's requests session. The host
+    then stays on the session for FALLBACK_COOLDOWN seconds before HTTP/2 is tried
+    again, so a single reset connection does not cost it the shared connection
+    for good.
+
+    With a HostLimiter, the request rate of each host is still limited; the
+    connection cap does not apply since a single connection is used. `record`
+    (e.g. HostHealth.record) is given the host and status of every answer received
+    over the connection; answers of the fallback go through the session's hooks.
+
+    The connection is driven by an asyncio client on its own thread: httpx's
+    blocking client can put the stream IDs of concurrent threads on the wire out
+    of order, which servers answer by closing the connection.
+
+    Needs the optional `httpx[http2]` package, see `create`.
+    """
+
+    def __init__(self, limiter=None, verify=True, record=None, logger: logging = logging) -> None:
+        import httpx
+
+        self.httpx = httpx
+        self.limiter = limiter
+        self.record = record
+        self.logger = logger
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="http2", daemon=True).start()
+        self.client = self._run(self._create_client(verify))
+        # Host -> time until which its requests go through requests, after a transport failure
+        self.fallback_hosts = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, limiter=None, verify=True, record=None, logger: logging = logging):
+        """
+        Returns:
+            MultiplexedClient | None: None when httpx or h2 is not installed.
+        """
+        try:
+            import h2  # noqa: F401
+            import httpx  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP/2 needs `pip install httpx[http2]`, using HTTP/1.1")
+            return None
+        return cls(limiter, verify, record, logger)
+
+    async def _create_client(self, verify):
+        return self.httpx.AsyncClient(
+            http2=True,
+            verify=verify,
+            follow_redirects=True,
+            timeout=self.httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=self.httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            cookies=http.cookiejar.CookieJar(policy=_RejectCookies()),
+        )
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def request(self, session: requests.Session, method: str, url: str, headers=None, data=None) -> Response:
+        """
+        Sends a small request over the shared connection, or through `session`
+        when the host fell back to HTTP/1.1.
+        """
+        host = urlparse(url).hostname or ""
+        if self.fallback_hosts.get(host, 0) <= time.monotonic():
+            if self.limiter is not None:
+                self.limiter.throttle(host)
+            try:
+                response = self._run(self.client.request(method, url, headers=headers, content=data))
+            except self.httpx.TransportError as e:
+                self.logger.warning(
+                    "HTTP/2 request to %s failed (%r), using HTTP/1.1 for %s s", host, e, FALLBACK_COOLDOWN
+                )
+                with self.lock:
+                    self.fallback_hosts[host] = time.monotonic() + FALLBACK_COOLDOWN
+            else:
+                if self.record is not None:
+                    self.record(host, response.status_code)
+                if self.versions.get(host) != response.http_version:
+                    self.versions[host] = response.http_version
+                    self.logger.debug("%s speaks %s", host, response.http_version)
+                return Response(
+                    response.status_code,
+                    response.content,
+                    str(response.url),
+                    response.headers,
+                    list(response.cookies.jar),
+                    response.http_version,
+                )
+
+        response = session.request(method, url, headers=headers, data=data, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        return Response(
+            response.status_code, response.content, response.url, response.headers, list(response.cookies), "HTTP/1.1"
+        )
+
+    def close(self) -> None:
+        self._run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
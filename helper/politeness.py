@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+from helper.lazy_import import lazy_import
+
+requests_adapters = lazy_import("requests.adapters")
+
+# Used for hosts no rule matches when the rules have no "*" entry; the rules
+# themselves come from the [LIMITS] section of the config
+FALLBACK_RULE = (4, 5.0)
+
+
+def parse_rules(items, logger: logging = logging) -> dict:
+    """
+    Parses "host = max connections, requests per second" entries.
+    Malformed entries are logged and skipped.
+    Args:
+        items: (host, value) pairs, e.g. config["LIMITS"].items().
+    Returns:
+        dict: host suffix -> (max connections, requests per second).
+    """
+    rules = {}
+    for host, value in items:
+        try:
+            connections, rate = value.split(",")
+            connections, rate = int(connections), float(rate)
+            if connections < 1 or rate <= 0:
+                raise ValueError
+        except ValueError:
+            logger.error(f"Ignoring invalid limit {host} = {value!r}, expected 'connections, requests per second'")
+            continue
+        rules[host] = (connections, rate)
+    return rules
+
+
+class HostLimiter:
+    """
+    Per-host connection caps and request-rate ceilings.
+    Each host gets a semaphore for its open connections and a token bucket for the
+    rate of new requests. Rules match the host or any parent domain, the most
+    specific rule wins.
+    """
+
+    def __init__(self, rules: dict) -> None:
+        self.rules = dict(rules)
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def rule(self, host: str) -> tuple:
+        parts = host.split(".")
+        for i in range(len(parts)):
+            suffix = ".".join(parts[i:])
+            if suffix in self.rules:
+                return self.rules[suffix]
+        return self.rules.get("*", FALLBACK_RULE)
+
+    def _host(self, host: str) -> dict:
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None:
+                connections, rate = self.rule(host)
+                state = {
+                    "slots": threading.BoundedSemaphore(connections),
+                    "rate": rate,
+                    "tokens": 1.0,
+                    "last": time.monotonic(),
+                    "lock": threading.Lock(),
+                }
+                self.hosts[host] = state
+            return state
+
+    def acquire(self, host: str) -> None:
+        """
+        Blocks until a connection slot and a request token are available for `host`.
+        """
+        self._host(host)["slots"].acquire()
+        self.throttle(host)
+
+    def throttle(self, host: str) -> None:
+        """
+        Blocks until a request token is available for `host`, without taking a
+        connection slot (for requests multiplexed over an open connection).
+        """
+        state = self._host(host)
+        while True:
+            with state["lock"]:
+                now = time.monotonic()
+                state["tokens"] = min(1.0, state["tokens"] + (now - state["last"]) * state["rate"])
+                state["last"] = now
+                if state["tokens"] >= 1.0:
+                    state["tokens"] -= 1.0
+                    return
+                wait = (1.0 - state["tokens"]) / state["rate"]
+            time.sleep(wait)
+
+    def release(self, host: str) -> None:
+        self._host(host)["slots"].release()
+
+
+def _polite_adapter_class():
+    class PoliteAdapter(requests_adapters.HTTPAdapter):
+        """
+        Transport adapter that sends every request through a HostLimiter.
+        The connection slot of a streamed response is held until the response is closed.
+        """
+
+        def __init__(self, limiter: HostLimiter, **kwargs) -> None:
+            self.limiter = limiter
+            super().__init__(**kwargs)
+
+        def send(self, request, stream=False, **kwargs):
+            host = urlparse(request.url).hostname or ""
+            self.limiter.acquire(host)
+            try:
+                response = super().send(request, stream=stream, **kwargs)
+            except BaseException:
+                self.limiter.release(host)
+                raise
+
+            if not stream:
+                self.limiter.release(host)
+                return response
+
+            close = response.close
+            released = threading.Lock()
+
+            def close_and_release():
+                try:
+                    close()
+                finally:
+                    if released.acquire(blocking=False):
+                        self.limiter.release(host)
+
+            response.close = close_and_release
+            return response
+
+    return PoliteAdapter
+
+
+def __getattr__(name: str):
+    # PoliteAdapter subclasses requests' HTTPAdapter, so it is defined on first
+    # use: importing this module (e.g. for HostLimiter) does not import requests
+    if name == "PoliteAdapter":
+        cls = _polite_adapter_class()
+        globals()["PoliteAdapter"] = cls
+        return cls
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from helper.anime1_fetch import DOWNLOADING_EXTENSION, DownloadHelper
+
+SPACE_MARGIN = 256 * 1024 * 1024  # bytes kept free on the download disk
+
+
+def probe_sizes(
+    download_helper: DownloadHelper,
+    data: dict,
+    names: list,
+    workers: int = 4,
+    stop_flag=None,
+    logger: logging = logging,
+) -> dict:
+    """
+    Resolves the episodes of a batch ahead of their download and probes their sizes.
+    The API calls are made first, all together (multiplexed over HTTP/2 when enabled),
+    then the sizes are probed `workers` at a time. The resolved sources stay in
+    `download_helper.prepared`, so the download reuses them.
+    Returns:
+        dict: Episode name to size in bytes, -1 when unknown.
+    """
+    resolved = download_helper.resolve_api(names, data, workers, stop_flag)
+
+    def probe(name):
+        if stop_flag is not None and stop_flag.is_set():
+            return -1
+        try:
+            return download_helper.prepare_episode(name, data, resolved.get(name))
+        except Exception as e:
+            logger.debug(f"{str(name):>3} | Size probe failed: {e}")
+            return -1
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return dict(zip(names, executor.map(probe, names)))
+
+
+def remaining_sizes(download_helper: DownloadHelper, data: dict, sizes: dict) -> dict:
+    """
+    Subtracts the bytes already stored (partial downloads) from the probed sizes.
+    Returns:
+        dict: Episode name to the bytes still to download, -1 when unknown.
+    """
+    folder = f"{download_helper.download_path}/{data['title']}"
+    remaining = {}
+    for name, size in sizes.items():
+        if size <= 0:
+            remaining[name] = -1
+            continue
+        partial = DownloadHelper.check_filename(folder, str(name)) + DOWNLOADING_EXTENSION
+        done = download_helper.storage.size(partial)
+        remaining[name] = max(size - done, 0)
+    return remaining
+
+
+def lpt_order(names: list, sizes: dict) -> list:
+    """
+    Orders episodes largest first (longest processing time first).
+    Every free worker takes the next episode, so the big files start early and the
+    batch does not end with one long transfer running alone. Episodes of unknown
+    size count as the median known size; ties keep the original order.
+    """
+    known = [size for size in sizes.values() if size > 0]
+    default = statistics.median(known) if known else 0
+    return sorted(names, key=lambda name: -(sizes.get(name, -1) if sizes.get(name, -1) > 0 else default))
+
+
+def check_disk_space(path: str, needed: int) -> tuple:
+    """
+    Checks that the disk holding `path` has `needed` bytes free, plus SPACE_MARGIN.
+    Returns:
+        tuple: (enough, free bytes).
+    """
+    # The download folder may not exist yet, check the closest existing parent
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    free = shutil.disk_usage(path).free
+    return free >= needed + SPACE_MARGIN, free
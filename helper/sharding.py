@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from helper.anime1_fetch import DownloadHelper
+from helper.health import COOLDOWN, FAILURE_LIMIT
+
+PUBLISH_INTERVAL = 0.1  # seconds between two progress snapshots of a shard
+STOP_GRACE = 1.0  # seconds a shard gets to stop before it is terminated
+
+# Per-episode fields of the shared progress array
+DOWNLOADED, TOTAL, STATE = range(3)
+FIELDS = 3
+WAITING, LOADING, DOWNLOADING, SUCCESS, FAILED = range(5)
+
+
+def _publish(helper: DownloadHelper, progress, index: dict) -> None:
+    for name, state in list(helper.process.items()):
+        i = index.get(name)
+        if i is None:
+            continue
+        base = i * FIELDS
+        progress[base + DOWNLOADED] = max(state.get("downloaded_size", 0), 0)
+        progress[base + TOTAL] = state.get("total_size", -1)
+        if progress[base + STATE] < SUCCESS:
+            progress[base + STATE] = DOWNLOADING if state.get("loading") else LOADING
+
+
+def _shard_main(
+    shard: int,
+    helper_class,
+    helper_args: dict,
+    max_workers: int,
+    data: dict,
+    jobs,
+    progress,
+    stop,
+    log_queue,
+    log_level: int,
+) -> None:
+    """
+    Entry point of a shard process: downloads episodes taken from `jobs` with its
+    own DownloadHelper and thread pool, and publishes their progress to `progress`.
+    """
+    logger = logging.getLogger(f"anime1.shard{shard}")
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(log_level)
+    logger.propagate = False
+
+    helper = helper_class(logger=logger, **helper_args)
+    index = {name: i for i, name in enumerate(data["names"])}
+
+    def work():
+        while not helper.download_stop:
+            try:
+                i = jobs.get_nowait()
+            except queue.Empty:
+                return
+            name = data["names"][i]
+            progress[i * FIELDS + STATE] = LOADING
+            try:
+                helper.download_episode(name, data)
+            except Exception as e:
+                logger.error(f"Error downloading episode {name}: {e}")
+            _publish(helper, progress, index)
+            success = helper.process.get(name, {}).get("success")
+            progress[i * FIELDS + STATE] = SUCCESS if success else FAILED
+
+    done = threading.Event()
+
+    def publish():
+        # Polled rather than waited on: a process that exits or is terminated while
+        # waiting on a multiprocessing.Event leaves the next set() blocked for good
+        while not done.wait(PUBLISH_INTERVAL):
+            if stop.value and not helper.download_stop:
+                # Closes the open connections too, a blocked read returns at once
+                helper.stop()
+            _publish(helper, progress, index)
+
+    publisher = threading.Thread(target=publish, daemon=True)
+    publisher.start()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in range(max_workers):
+            executor.submit(work)
+    done.set()
+    publisher.join()
+    summary = helper.watchdog.summary()
+    if summary:
+        logger.info(summary)
+
+
+class ShardedDownloader:
+    """
+    Downloads the episodes of a batch from several processes.
+    Each shard process runs its own DownloadHelper and transfer loop, so TLS and
+    chunk handling of many streams are spread over several cores. Shards take
+    episodes from a shared queue and publish their progress into a shared-memory
+    array (downloaded, total, state per episode), which the UI or CLI reads
+    directly. Setting the stop flag stops every shard; a shard that has not
+    finished after STOP_GRACE seconds is terminated, its partial files stay
+    resumable.
+
+    The progress attributes (process, downloaded_size, total_size, finished,
+    total_eps) mirror DownloadHelper's, so the same progress display works for both.
+    """
+
+    def __init__(
+        self,
+        download_path: str,
+        processes: int = 2,
+        max_workers: int = 4,
+        hls_workers: int = 4,
+        sync_writes: bool = False,
+        http2: bool = False,
+        bandwidth_limit: float = 0,
+        dns_ttl: float = 0,
+        egress: list = None,
+        circuit_failures: int = FAILURE_LIMIT,
+        circuit_cooldown: float = COOLDOWN,
+        storage: dict = None,
+        helper_class=DownloadHelper,
+        logger: logging = logging,
+    ) -> None:
+        self.processes = processes
+        self.max_workers = max_workers
+        self.helper_class = helper_class
+        self.helper_args = {
+            "download_path": download_path,
+            "hls_workers": hls_workers,
+            "sync_writes": sync_writes,
+            "http2": http2,
+            # Each shard gets an equal share of the rate cap
+            "bandwidth_limit": bandwidth_limit / max(processes, 1),
+            "dns_ttl": dns_ttl,
+            # Each shard balances its own transfers over the members
+            "egress": egress,
+            # Each shard keeps its own circuits
+            "circuit_failures": circuit_failures,
+            "circuit_cooldown": circuit_cooldown,
+            # Each shard uploads its own episodes
+            "storage": storage,
+        }
+        # Records of the shards are handed to this logger
+        self.logger = logger if isinstance(logger, logging.Logger) else logging.getLogger()
+
+        # Spawned, not forked: the parent runs threads (UI, logging) at this point
+        self.context = multiprocessing.get_context("spawn")
+        self.names = []
+        self.progress = None
+
+    # ----------------- Progress (read from shared memory) -----------------
+    def _field(self, field: int) -> list:
+        if self.progress is None:
+            return []
+        return self.progress[field::FIELDS]
+
+    @property
+    def total_eps(self) -> int:
+        return len(self.names)
+
+    @property
+    def downloaded_size(self) -> int:
+        return sum(self._field(DOWNLOADED))
+
+    @property
+    def total_size(self) -> int:
+        return sum(size for size in self._field(TOTAL) if size > 0)
+
+    @property
+    def finished(self) -> int:
+        return sum(1 for state in self._field(STATE) if state == SUCCESS)
+
+    @property
+    def process(self) -> dict:
+        """
+        Per-episode progress in the shape of DownloadHelper.process.
+        """
+        process = {}
+        for name, downloaded, total, state in zip(
+            self.names, self._field(DOWNLOADED), self._field(TOTAL), self._field(STATE)
+        ):
+            if state == WAITING:
+                continue
+            entry = {"downloaded_size": downloaded, "total_size": total, "loading": state >= DOWNLOADING}
+            if state in (SUCCESS, FAILED):
+                entry["success"] = state == SUCCESS
+                entry["finished"] = True
+            process[name] = entry
+        return process
+
+    @property
+    def dropped(self) -> set:
+        # Episodes of a shard are not cancelled one by one
+        return set()
+
+    # ----------------- Running -----------------
+    def run(self, data: dict, names: list, stop_flag: threading.Event) -> int:
+        """
+        Downloads `names` of the series `data` and waits for every shard.
+        Returns:
+            int: The number of episodes downloaded successfully.
+        """
+        self.names = list(names)
+        shard_data = {
+            "title": data["title"],
+            "total episode": len(self.names),
+            "names": self.names,
+            "data": {name: data["data"][name] for name in self.names},
+        }
+        self.progress = self.context.Array("q", len(self.names) * FIELDS, lock=False)
+        jobs = self.context.Queue()
+        for i in range(len(self.names)):
+            jobs.put(i)
+        stop = self.context.RawValue("b", 0)
+        log_queue = self.context.Queue()
+        listener = logging.handlers.QueueListener(log_queue, _LoggerHandler(self.logger))
+        listener.start()
+
+        shards = [
+            self.context.Process(
+                target=_shard_main,
+                args=(
+                    shard,
+                    self.helper_class,
+                    self.helper_args,
+                    self.max_workers,
+                    shard_data,
+                    jobs,
+                    self.progress,
+                    stop,
+                    log_queue,
+                    self.logger.getEffectiveLevel(),
+                ),
+                daemon=True,
+            )
+            for shard in range(min(self.processes, len(self.names)))
+        ]
+        self.logger.info(f"Downloading {len(self.names)} episodes in {len(shards)} processes")
+        for shard in shards:
+            shard.start()
+
+        try:
+            while any(shard.is_alive() for shard in shards):
+                if stop_flag.wait(PUBLISH_INTERVAL):
+                    stop.value = 1
+                    break
+            if stop.value:
+                deadline = time.monotonic() + STOP_GRACE
+                for shard in shards:
+                    shard.join(max(deadline - time.monotonic(), 0))
+                    if shard.is_alive():
+                        self.logger.debug(f"Terminating shard {shard.pid}")
+                        shard.terminate()
+            for shard in shards:
+                shard.join()
+        finally:
+            stop.value = 1
+            listener.stop()
+        return self.finished
+
+
+class _LoggerHandler(logging.Handler):
+    """
+    Hands records from the shard processes to a logger of this process.
+    """
+
+    def __init__(self, logger: logging.Logger) -> None:
+        super().__init__()
+        self.target = logger
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.target.handle(record)
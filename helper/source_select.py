@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from helper.lazy_import import lazy_import
+
+requests = lazy_import("requests")
+
+PROBE_SIZE = 256 * 1024  # bytes read by a probe
+PROBE_TIMEOUT = (3, 5)  # (connect, read) seconds
+EWMA_ALPHA = 0.3
+SWITCH_RATIO = 2.0  # switch when another host is this many times faster
+MIN_SWITCH_INTERVAL = 10  # seconds between two switches of the same transfer
+
+
+class SourceSelector:
+    """
+    Picks the fastest source out of the API's source list.
+    Candidates are probed with a short ranged read. Connect time and throughput are
+    remembered per host (as an EWMA) for the rest of the batch, so later episodes skip
+    the probe, and a transfer can move to another source when its host slows down.
+    """
+
+    def __init__(self, logger: logging = logging) -> None:
+        self.logger = logger
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlparse(url).netloc
+
+    def record(self, url: str, rate: float = None, connect_time: float = None, failed: bool = False) -> None:
+        """
+        Updates the statistics of the host of `url`.
+        Args:
+            url (str): A URL on the host.
+            rate (float): Measured throughput in bytes/s.
+            connect_time (float): Measured time to the response headers in seconds.
+            failed (bool): True if the request to the host failed.
+        """
+        host = self.host(url)
+        with self.lock:
+            stats = self.hosts.setdefault(
+                host, {"rate": None, "connect_time": None, "failures": 0}
+            )
+            if failed:
+                stats["failures"] += 1
+                stats["rate"] = 0.0
+                return
+            if rate is not None:
+                old = stats["rate"]
+                stats["rate"] = rate if not old else old + EWMA_ALPHA * (rate - old)
+            if connect_time is not None:
+                old = stats["connect_time"]
+                stats["connect_time"] = (
+                    connect_time if old is None else old + EWMA_ALPHA * (connect_time - old)
+                )
+
+    def rate(self, url: str):
+        stats = self.hosts.get(self.host(url))
+        return stats["rate"] if stats else None
+
+    def probe(self, session: requests.Session, url: str, headers: dict) -> None:
+        """
+        Measures connect time and throughput of `url` with a small ranged read.
+        """
+        header = headers.copy()
+        header["Range"] = f"bytes=0-{PROBE_SIZE - 1}"
+        start = time.monotonic()
+        try:
+            with session.get(url, headers=header, stream=True, timeout=PROBE_TIMEOUT) as response:
+                connect_time = time.monotonic() - start
+                if response.status_code not in (200, 206):
+                    self.record(url, failed=True)
+                    return
+                read_start = time.monotonic()
+                received = 0
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    received += len(chunk)
+                    if received >= PROBE_SIZE:
+                        break
+                elapsed = max(time.monotonic() - read_start, 1e-3)
+        except requests.RequestException as e:
+            self.logger.debug("Probe failed for %s: %s", self.host(url), e)
+            self.record(url, failed=True)
+            return
+
+        self.record(url, rate=received / elapsed, connect_time=connect_time)
+        self.logger.debug(
+            "Probe %s: connect %.0f ms, %.0f KB/s", self.host(url), connect_time * 1000, received / elapsed / 1024
+        )
+
+    def rank(self, session: requests.Session, urls: list, headers: dict) -> list:
+        """
+        Orders the candidate URLs from fastest to slowest.
+        Hosts already measured in this batch are not probed again. Only progressive
+        files should be ranked; an HLS playlist is a small text file, so probing it
+        does not measure the speed of its segments.
+        Returns:
+            list: The URLs, best first.
+        """
+        if len(urls) < 2:
+            return list(urls)
+
+        unknown = [url for url in urls if self.rate(url) is None]
+        if unknown:
+            with ThreadPoolExecutor(max_workers=len(unknown)) as executor:
+                for url in unknown:
+                    executor.submit(self.probe, session, url, headers)
+
+        def score(url):
+            stats = self.hosts.get(self.host(url), {})
+            return (stats.get("rate") or 0.0, -(stats.get("connect_time") or float("inf")))
+
+        return sorted(urls, key=score, reverse=True)
+
+    def better_source(self, url: str, alternatives: list, current_rate: float):
+        """
+        Returns an alternative URL whose host is known to be much faster than the
+        current transfer rate, or None to stay on the current source.
+        """
+        best, best_rate = None, current_rate * SWITCH_RATIO
+        for alternative in alternatives:
+            if self.host(alternative) == self.host(url):
+                continue
+            rate = self.rate(alternative)
+            if rate and rate > best_rate:
+                best, best_rate = alternative, rate
+        return best
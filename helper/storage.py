@@ -0,0 +1,573 @@
+from __future__ import annotations
+
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlparse
+
+from helper.anime1_fetch import DOWNLOADING_EXTENSION
+from helper.lazy_import import lazy_import
+from helper.transfer import RingWriter
+from helper.watchdog import CONNECT_TIMEOUT
+
+requests = lazy_import("requests")
+
+PART_SIZE = 8 * 1024 * 1024  # bytes per uploaded part (S3 needs 5 MB at least, except for the last)
+UPLOAD_WORKERS = 4  # parts of a sink uploaded at once
+PART_RETRIES = 3  # attempts per part before the transfer fails
+UPLOAD_TIMEOUT = (CONNECT_TIMEOUT, 120)
+JOURNAL_DIR = ".uploads"  # folder under download_path with the state of unfinished uploads
+REGION = "us-east-1"
+
+
+class LocalSink:
+    """
+    Stores the episodes as files under the download folder (the default sink).
+    A transfer appends to the partial file, which is renamed once complete.
+    """
+
+    remote = False
+
+    @staticmethod
+    def size(path: str) -> int:
+        """
+        Returns the bytes already stored of the partial file `path`, 0 if there is none.
+        """
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    @staticmethod
+    def open(path: str, pool, sync: bool = False) -> RingWriter:
+        """
+        Returns the writer appending to the partial file `path` (a context manager
+        with write(buffer, size), see RingWriter).
+        """
+        return RingWriter(path, pool, sync=sync)
+
+    @staticmethod
+    def discard(path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def commit(path: str, final_path: str) -> None:
+        """
+        Turns the complete partial file `path` into `final_path`.
+        """
+        if os.path.exists(final_path):
+            os.remove(final_path)
+        os.rename(path, final_path)
+
+    # A file assembled locally (HLS) is committed like any other
+    store = commit
+
+    @staticmethod
+    def exists(final_path: str) -> bool:
+        return os.path.exists(final_path)
+
+
+def _children(element, name: str) -> list:
+    # S3 answers are namespaced, some compatible services leave the namespace out
+    return [child for child in element.iter() if child.tag.rsplit("}", 1)[-1] == name]
+
+
+def _text(element, name: str, default: str = "") -> str:
+    found = _children(element, name)
+    return found[0].text or default if found else default
+
+
+class S3Client:
+    """
+    The multipart upload calls of an S3-compatible service (AWS, MinIO, Ceph, R2...),
+    signed with AWS Signature Version 4 and sent with requests. Objects are
+    addressed path-style (endpoint/bucket/key), which every such service accepts.
+    Bodies are not hashed into the signature (UNSIGNED-PAYLOAD); parts carry a
+    Content-MD5 the service checks instead.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = REGION,
+        session: requests.Session = None,
+    ) -> None:
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urlparse(self.endpoint).netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.session = session or requests.Session()
+
+    def sign(self, method: str, path: str, query: str, headers: dict) -> None:
+        """
+        Adds the date and the SigV4 Authorization header to `headers` (lower-case names).
+        """
+        amz_date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        headers["host"] = self.host
+        headers["x-amz-date"] = amz_date
+        headers.setdefault("x-amz-content-sha256", "UNSIGNED-PAYLOAD")
+        names = sorted(headers)
+        canonical = "\n".join(
+            [
+                method,
+                path,
+                query,
+                "".join(f"{name}:{str(headers[name]).strip()}\n" for name in names),
+                ";".join(names),
+                headers["x-amz-content-sha256"],
+            ]
+        )
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join(
+            ["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()]
+        )
+        key = f"AWS4{self.secret_key}".encode()
+        for part in (amz_date[:8], self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={';'.join(names)}, Signature={signature}"
+        )
+
+    def request(self, method: str, key: str, params: dict = None, data=b"", headers: dict = None, ok=(200,)):
+        """
+        Sends a signed request for object `key`.
+        Returns:
+            requests.Response: The answer, when its status is in `ok`.
+        Raises:
+            requests.HTTPError: Any other status, or an error document in a 200 answer.
+        """
+        path = quote(f"/{self.bucket}/{key}", safe="/-_.~")
+        query = "&".join(
+            f"{quote(name, safe='-_.~')}={quote(str(value), safe='-_.~')}" for name, value in sorted((params or {}).items())
+        )
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        self.sign(method, path, query, headers)
+        url = f"{self.endpoint}{path}" + (f"?{query}" if query else "")
+        response = self.session.request(method, url, data=data, headers=headers, timeout=UPLOAD_TIMEOUT)
+        # CompleteMultipartUpload can fail after answering 200
+        if response.status_code not in ok or b"<Error>" in response.content[:256]:
+            code = ""
+            if response.content:
+                try:
+                    code = _text(ElementTree.fromstring(response.content), "Code")
+                except ElementTree.ParseError:
+                    pass
+            raise requests.HTTPError(f"{method} {key}: {response.status_code} {code}".rstrip(), response=response)
+        return response
+
+    def create_upload(self, key: str) -> str:
+        """
+        Returns:
+            str: The ID of a new multipart upload of `key`.
+        """
+        response = self.request("POST", key, {"uploads": ""})
+        return _text(ElementTree.fromstring(response.content), "UploadId")
+
+    def upload_part(self, key: str, upload_id: str, number: int, data) -> str:
+        """
+        Returns:
+            str: The ETag of part `number` (from 1).
+        """
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        response = self.request(
+            "PUT", key, {"partNumber": number, "uploadId": upload_id}, data, {"Content-MD5": md5}
+        )
+        return response.headers.get("ETag", "")
+
+    def list_parts(self, key: str, upload_id: str) -> dict:
+        """
+        Returns:
+            dict: Part number -> (ETag, size) of the parts the service holds.
+        """
+        parts, marker = {}, 0
+        while True:
+            params = {"uploadId": upload_id}
+            if marker:
+                params["part-number-marker"] = marker
+            root = ElementTree.fromstring(self.request("GET", key, params).content)
+            for part in _children(root, "Part"):
+                parts[int(_text(part, "PartNumber"))] = (_text(part, "ETag"), int(_text(part, "Size", "0")))
+            if _text(root, "IsTruncated", "false").lower() != "true":
+                return parts
+            marker = _text(root, "NextPartNumberMarker") or max(parts, default=0)
+
+    def complete(self, key: str, upload_id: str, parts: list) -> None:
+        """
+        Assembles the object from `parts`, (number, ETag) pairs in order.
+        """
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts
+        ) + "</CompleteMultipartUpload>"
+        self.request("POST", key, {"uploadId": upload_id}, body.encode(), {"Content-Type": "application/xml"})
+
+    def abort(self, key: str, upload_id: str) -> None:
+        self.request("DELETE", key, {"uploadId": upload_id}, ok=(200, 204, 404))
+
+    def head(self, key: str) -> int:
+        """
+        Returns:
+            int: The size of object `key`, -1 if there is none.
+        """
+        response = self.request("HEAD", key, ok=(200, 404))
+        if response.status_code == 404:
+            return -1
+        return int(response.headers.get("Content-Length", 0))
+
+
+class PartWriter:
+    """
+    Uploads what a transfer writes as the parts of a multipart upload, without a
+    local copy. Used like RingWriter: write(buffer, size) copies the bytes into the
+    part being filled and hands the buffer straight back to the pool; every full
+    part is uploaded by the sink's workers while the transfer goes on. The last,
+    partial part stays in memory until the sink commits the upload.
+
+    Leaving the writer waits for its parts, then raises the first upload error.
+    """
+
+    def __init__(self, sink: S3Sink, key: str, pool=None) -> None:
+        self.sink = sink
+        self.key = key
+        self.pool = pool
+        self.futures = []
+        self.error = None
+
+    def __enter__(self) -> PartWriter:
+        self.upload_id, self.number, self.part, self.filled = self.sink.begin(self.key)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        for future in self.futures:
+            future.exception()
+        failed = self.error is not None
+        # The parts after a failed one are not contiguous, the tail would not fit either
+        self.sink.suspend(self.key, None if failed else self.part, self.filled)
+        if failed and exc_type is None:
+            raise self.error
+
+    def write(self, buffer, size: int) -> None:
+        """
+        Adds buffer[:size] to the upload. The buffer must not be used afterwards.
+        """
+        try:
+            if self.error is not None:
+                raise self.error
+            part_size = len(self.part)
+            with memoryview(buffer) as view:
+                position = 0
+                while position < size:
+                    count = min(size - position, part_size - self.filled)
+                    self.part[self.filled : self.filled + count] = view[position : position + count]
+                    self.filled += count
+                    position += count
+                    if self.filled == part_size:
+                        self.futures.append(self.sink.upload(self.key, self.upload_id, self.number, self.part, self))
+                        self.number += 1
+                        self.part, self.filled = bytearray(part_size), 0
+        finally:
+            if self.pool is not None:
+                self.pool.put(buffer)
+
+
+class S3Sink:
+    """
+    Streams the episodes to an S3-compatible bucket as multipart uploads, so
+    nothing but the part being filled is kept on this machine. Object keys are the
+    paths under the download folder, after `prefix`.
+
+    The upload ID and the parts uploaded of every unfinished upload are kept in a
+    journal (a JSON file per object under JOURNAL_DIR), so an interrupted download
+    resumes after its last contiguous part: the parts are checked against the
+    service (ListParts) and the transfer asks the source for the bytes after them.
+    At most twice `workers` full parts wait or upload at once across the
+    transfers of the sink; a transfer that gets ahead of its uploads waits.
+    """
+
+    remote = True
+
+    def __init__(
+        self,
+        client: S3Client,
+        download_path: str,
+        prefix: str = "",
+        workers: int = UPLOAD_WORKERS,
+        part_size: int = PART_SIZE,
+        logger: logging = logging,
+    ) -> None:
+        self.client = client
+        self.download_path = download_path
+        self.prefix = prefix.strip("/")
+        self.part_size = part_size
+        self.logger = logger
+        self.journal_dir = os.path.join(download_path, JOURNAL_DIR)
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="upload")
+        self.slots = threading.Semaphore(2 * max(workers, 1))
+        self.lock = threading.Lock()
+        # Key -> journal entry of the uploads in use: {"upload_id", "part_size", "parts": {number: etag}}
+        self.uploads = {}
+        # Key -> (part, bytes filled) of the last part of a suspended writer
+        self.tails = {}
+
+    def key(self, path: str) -> str:
+        """
+        Returns the object key of the episode at `path` (partial or final).
+        """
+        if path.endswith(DOWNLOADING_EXTENSION):
+            path = path[: -len(DOWNLOADING_EXTENSION)]
+        relative = os.path.relpath(path, self.download_path).replace(os.sep, "/")
+        return f"{self.prefix}/{relative}" if self.prefix else relative
+
+    # ----------------- Journal -----------------
+    def journal_path(self, key: str) -> str:
+        return os.path.join(self.journal_dir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def load(self, key: str):
+        try:
+            with open(self.journal_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        entry["parts"] = {int(number): etag for number, etag in entry["parts"].items()}
+        return entry
+
+    def save(self, key: str, entry: dict) -> None:
+        # Called with the lock held; replaced atomically so a crash leaves the old one
+        os.makedirs(self.journal_dir, exist_ok=True)
+        path = self.journal_path(key)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({**entry, "key": key}, f)
+        os.replace(path + ".tmp", path)
+
+    def drop(self, key: str) -> None:
+        with self.lock:
+            self.uploads.pop(key, None)
+            self.tails.pop(key, None)
+            try:
+                os.remove(self.journal_path(key))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def contiguous(entry: dict) -> int:
+        """
+        Returns the number of parts uploaded from part 1 without a gap.
+        """
+        count = 0
+        while count + 1 in entry["parts"]:
+            count += 1
+        return count
+
+    def entry(self, key: str):
+        """
+        Returns the journal entry of `key`, checked against the service the first
+        time: parts it does not hold (with the same ETag) are dropped, and the whole
+        entry when the upload no longer exists.
+        """
+        with self.lock:
+            if key in self.uploads:
+                return self.uploads[key]
+        entry = self.load(key)
+        if entry is None:
+            return None
+        try:
+            held = self.client.list_parts(key, entry["upload_id"])
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                self.logger.info(f"Upload of {key} is gone, starting over")
+                self.drop(key)
+                return None
+            raise
+        entry["parts"] = {number: etag for number, etag in entry["parts"].items() if held.get(number, ("",))[0] == etag}
+        with self.lock:
+            return self.uploads.setdefault(key, entry)
+
+    # ----------------- Sink -----------------
+    def size(self, path: str) -> int:
+        """
+        Returns the bytes of the episode at `path` already uploaded, or waiting in
+        memory to be, 0 if none.
+        """
+        key = self.key(path)
+        try:
+            entry = self.entry(key)
+        except requests.RequestException as e:
+            # Unchecked: the journal is trusted, the writer checks it again
+            self.logger.debug("Could not check the upload of %s: %s", key, e)
+            entry = self.load(key)
+        if entry is None:
+            return 0
+        with self.lock:
+            tail = self.tails.get(key, (None, 0))[1]
+            return self.contiguous(entry) * entry["part_size"] + tail
+
+    def open(self, path: str, pool, sync: bool = False) -> PartWriter:
+        """
+        Returns the writer uploading the episode at `path` after the bytes already
+        stored (see size). `sync` has no meaning here, parts are durable once uploaded.
+        """
+        return PartWriter(self, self.key(path), pool)
+
+    def begin(self, key: str) -> tuple:
+        """
+        Starts or resumes the upload of `key` for a writer.
+        Returns:
+            tuple: (upload ID, number of the next part, part to fill, bytes already in it).
+        """
+        entry = self.entry(key)
+        if entry is None:
+            entry = {"upload_id": self.client.create_upload(key), "part_size": self.part_size, "parts": {}}
+            with self.lock:
+                self.uploads[key] = entry
+                self.save(key, entry)
+        with self.lock:
+            part, filled = self.tails.pop(key, (None, 0))
+            if part is None:
+                part = bytearray(entry["part_size"])
+            return entry["upload_id"], self.contiguous(entry) + 1, part, filled
+
+    def suspend(self, key: str, part, filled: int) -> None:
+        """
+        Keeps the last part of a writer that was left, for commit or the next writer.
+        """
+        with self.lock:
+            if part is not None and filled:
+                self.tails[key] = (part, filled)
+            else:
+                self.tails.pop(key, None)
+
+    def upload(self, key: str, upload_id: str, number: int, data, writer: PartWriter):
+        """
+        Queues part `number` for upload, once fewer than the sink's limit of parts
+        are in memory. An error is handed to `writer`.
+        """
+        self.slots.acquire()
+
+        def send():
+            try:
+                for attempt in range(PART_RETRIES):
+                    try:
+                        etag = self.client.upload_part(key, upload_id, number, data)
+                        break
+                    except requests.RequestException as e:
+                        if attempt == PART_RETRIES - 1:
+                            raise
+                        self.logger.debug("Part %s of %s failed (%s), retrying", number, key, e)
+                with self.lock:
+                    entry = self.uploads.get(key)
+                    if entry is not None and entry["upload_id"] == upload_id:
+                        entry["parts"][number] = etag
+                        self.save(key, entry)
+            except Exception as e:
+                writer.error = writer.error or e
+                raise
+            finally:
+                self.slots.release()
+
+        return self.executor.submit(send)
+
+    def commit(self, path: str, final_path: str) -> None:
+        """
+        Uploads the last part of the episode at `path` and completes its upload
+        as the object of `final_path`.
+        """
+        key = self.key(path)
+        entry = self.entry(key)
+        if entry is None:
+            # Nothing was written (an empty episode)
+            entry = {"upload_id": self.client.create_upload(key), "part_size": self.part_size, "parts": {}}
+        with self.lock:
+            part, filled = self.tails.pop(key, (None, 0))
+        count = self.contiguous(entry)
+        if filled or not count:
+            count += 1
+            entry["parts"][count] = self.client.upload_part(
+                key, entry["upload_id"], count, bytes(part[:filled]) if part else b""
+            )
+        self.client.complete(key, entry["upload_id"], [(number, entry["parts"][number]) for number in range(1, count + 1)])
+        self.drop(key)
+        self.logger.debug("Uploaded %s in %s parts", key, count)
+
+    def store(self, path: str, final_path: str) -> None:
+        """
+        Uploads the complete local file `path` as the object of `final_path`, then
+        removes it. Resumes an upload of it that was interrupted.
+        """
+        offset = self.size(path)
+        with open(path, "rb") as f, self.open(path, None) as writer:
+            f.seek(offset)
+            while True:
+                chunk = f.read(self.part_size)
+                if not chunk:
+                    break
+                writer.write(chunk, len(chunk))
+        self.commit(path, final_path)
+        os.remove(path)
+
+    def discard(self, path: str) -> None:
+        """
+        Aborts the upload of the episode at `path`, if any.
+        """
+        key = self.key(path)
+        with self.lock:
+            entry = self.uploads.get(key)
+        entry = entry or self.load(key)
+        if entry is not None:
+            try:
+                self.client.abort(key, entry["upload_id"])
+            except requests.RequestException as e:
+                self.logger.debug("Aborting the upload of %s failed: %s", key, e)
+        self.drop(key)
+
+    def exists(self, final_path: str) -> bool:
+        try:
+            return self.client.head(self.key(final_path)) >= 0
+        except requests.RequestException:
+            return False
+
+
+def create_sink(settings: dict, download_path: str, logger: logging = logging):
+    """
+    Creates the sink described by the [STORAGE] settings: "local" (the default) or
+    "s3" with an endpoint and a bucket. Keys left empty are read from the
+    AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables.
+    Returns:
+        LocalSink | S3Sink: The sink, LocalSink when the settings are not usable.
+    """
+    settings = settings or {}
+    sink = settings.get("sink", "local").strip().lower() or "local"
+    if sink == "local":
+        return LocalSink()
+    if sink != "s3":
+        logger.error(f"Unknown storage sink {sink!r}, storing files locally")
+        return LocalSink()
+    missing = [name for name in ("endpoint", "bucket") if not settings.get(name)]
+    if missing:
+        logger.error(f"The s3 storage sink needs {' and '.join(missing)}, storing files locally")
+        return LocalSink()
+    client = S3Client(
+        settings["endpoint"],
+        settings["bucket"],
+        settings.get("access_key") or os.environ.get("AWS_ACCESS_KEY_ID", ""),
+        settings.get("secret_key") or os.environ.get("AWS_SECRET_ACCESS_KEY", ""),
+        region=settings.get("region") or REGION,
+    )
+    logger.info(f"Storing episodes in {settings['endpoint']}/{settings['bucket']}/{settings.get('prefix', '')}")
+    return S3Sink(
+        client,
+        download_path,
+        settings.get("prefix", ""),
+        int(settings.get("upload_workers") or UPLOAD_WORKERS),
+        logger=logger,
+    )
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+
+from helper.anime1_fetch import DOWNLOADING_EXTENSION, DownloadHelper
+
+STREAM_HOST = "127.0.0.1"
+STREAM_PORT = 8613
+CHUNK_SIZE = 256 * 1024  # bytes read from the file and sent at a time
+POLL_INTERVAL = 0.1  # seconds between two checks for new bytes
+IDLE_TIMEOUT = 60  # seconds without new bytes after which a response ends
+
+CONTENT_TYPES = {".mp4": "video/mp4", ".ts": "video/mp2t"}
+
+
+class StreamServer:
+    """
+    Serves episodes of a DownloadHelper over HTTP while they download, so a player
+    can start before the transfer ends: GET /episodes/<name> with Range support.
+
+    A request for bytes that have not arrived yet blocks until they do. The
+    response ends early when the episode is stopped, or when no new bytes arrive
+    for IDLE_TIMEOUT seconds. The file is opened for each read, so the rename of
+    the finished download is never held up (Windows refuses to rename open files).
+    HLS episodes have no known size until they end; they are sent whole, without
+    ranges.
+    """
+
+    def __init__(self, helper: DownloadHelper, logger: logging = logging) -> None:
+        self.helper = helper
+        self.logger = logger
+        self.server = None
+
+    def url(self, name) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/episodes/{quote(str(name))}"
+
+    def find(self, text: str):
+        """
+        Returns the episode named `text` in the helper, or None.
+        """
+        for name in list(self.helper.process):
+            if str(name) == text:
+                return name
+        return None
+
+    def available(self, name) -> tuple:
+        """
+        Returns:
+            tuple: (path to read, bytes on disk, whether the episode is complete),
+            path None when nothing is on disk yet.
+        """
+        entry = self.helper.process.get(name) or {}
+        temp = entry.get("path")
+        if temp is None:
+            return None, 0, False
+        final = temp[: -len(DOWNLOADING_EXTENSION)]
+        for path, complete in ((temp, False), (final, True)):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            return path, size, complete and bool(entry.get("success"))
+        return None, 0, False
+
+    def wait_for(self, name, position: int) -> tuple:
+        """
+        Blocks until the episode has more than `position` bytes on disk or is complete.
+        Returns:
+            tuple: See available; path None when the wait was given up.
+        """
+        last, since = -1, time.monotonic()
+        while True:
+            path, size, complete = self.available(name)
+            if path is not None and (size > position or complete):
+                return path, size, complete
+            if self.helper.stopped(name):
+                return None, size, False
+            if size != last:
+                last, since = size, time.monotonic()
+            elif time.monotonic() - since >= IDLE_TIMEOUT:
+                return None, size, False
+            time.sleep(POLL_INTERVAL)
+
+    @staticmethod
+    def read(path: str, position: int, length: int) -> bytes:
+        """
+        Reads from the partial file at `path`, or from the finished one if it was
+        renamed meanwhile.
+        """
+        final = path[: -len(DOWNLOADING_EXTENSION)] if path.endswith(DOWNLOADING_EXTENSION) else path
+        for candidate in (path, final):
+            try:
+                with open(candidate, "rb") as f:
+                    f.seek(position)
+                    return f.read(length)
+            except FileNotFoundError:
+                # Renamed since it was found
+                continue
+        return b""
+
+    def send(self, name, write, start: int, end: int = None) -> int:
+        """
+        Writes bytes `start` to `end` (inclusive, None for the end of the episode)
+        with `write`, waiting for the ones not downloaded yet.
+        Returns:
+            int: The number of bytes sent.
+        """
+        position = start
+        while end is None or position <= end:
+            path, size, complete = self.wait_for(name, position)
+            if path is None or position >= size:
+                break
+            stop = size if end is None else min(size, end + 1)
+            while position < stop:
+                chunk = self.read(path, position, min(CHUNK_SIZE, stop - position))
+                if not chunk:
+                    break
+                write(chunk)
+                position += len(chunk)
+            if complete and position >= size:
+                break
+        return position - start
+
+    def make_handler(self):
+        stream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                stream.logger.debug(f"Stream: {self.address_string()} {format % args}")
+
+            def do_HEAD(self):
+                self.do_GET(body=False)
+
+            def do_GET(self, body: bool = True):
+                path = urlparse(self.path).path
+                name = stream.find(unquote(path[len("/episodes/"):])) if path.startswith("/episodes/") else None
+                if name is None:
+                    self.send_error(404)
+                    return
+                # Wait for the transfer to start, for its path and size
+                file_path, _, _ = stream.wait_for(name, -1)
+                if file_path is None:
+                    self.send_error(504, "The episode is not downloading")
+                    return
+                entry = stream.helper.process.get(name, {})
+                total = entry.get("total_size", -1)
+                is_hls = entry.get("segments_total") is not None
+                extension = os.path.splitext(file_path.replace(DOWNLOADING_EXTENSION, ""))[1]
+                content_type = CONTENT_TYPES.get(extension, "application/octet-stream")
+
+                start, end = 0, None
+                match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", "").strip())
+                if match and any(match.groups()) and total > 0 and not is_hls:
+                    first, last = match.groups()
+                    if first:
+                        start, end = int(first), int(last) if last else total - 1
+                    elif last:
+                        start, end = max(total - int(last), 0), total - 1
+                    end = min(end, total - 1)
+                    if start >= total or start > end:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{total}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+                    self.send_header("Content-Length", str(end - start + 1))
+                elif total > 0 and not is_hls:
+                    end = total - 1
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(total))
+                else:
+                    # Size unknown until it ends: sent until the connection closes
+                    self.send_response(200)
+                    self.send_header("Connection", "close")
+                    self.close_connection = True
+                if not is_hls:
+                    self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Type", content_type)
+                self.end_headers()
+                if not body:
+                    return
+                try:
+                    sent = stream.send(name, self.wfile.write, start, end)
+                except OSError:
+                    # The player closed the connection, e.g. to seek
+                    return
+                if end is not None and sent < end - start + 1:
+                    # Cut short: the promised length cannot be kept
+                    self.close_connection = True
+
+        return Handler
+
+    def serve(self, host: str = STREAM_HOST, port: int = STREAM_PORT) -> tuple:
+        """
+        Starts the HTTP server in a background thread.
+        Returns:
+            tuple: The (host, port) the server is bound to.
+        """
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="stream", daemon=True).start()
+        self.logger.info(f"Streaming endpoint listening on http://{host}:{self.server.server_address[1]}")
+        return self.server.server_address
+
+    def shutdown(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -190,7 +190,7 @@ class DownloadProgressBar:
             pass
         self.root.after(100, self.process_queue)
     
-    def set_progress(self, current_value, max_value=None):
+    def set_progress(self, current_value, max_value=None, detail=""):
         if max_value:
             self.total_size = max(max_value, 1)
         self.progress["maximum"] = self.total_size
@@ -199,7 +199,7 @@ class DownloadProgressBar:
         self.progress["value"] = self.downloaded_size
             
         percent = (self.downloaded_size / self.total_size) * 100
-        self.percent_label.config(text=f"{percent:.2f}%")
+        self.percent_label.config(text=f"{percent:.2f}%  {detail}" if detail else f"{percent:.2f}%")
     
     def destroy(self):
         self.progress.destroy()
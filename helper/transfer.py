@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+
+BUFFER_SIZE = 256 * 1024  # bytes per pooled buffer
+RING_SIZE = 8  # filled buffers queued for the writer, caps memory per transfer
+SYNC_BYTES = 64 * 1024 * 1024  # bytes written between two fsync calls when syncing
+BURST_SECONDS = 0.5  # seconds of transfer at the capped rate that may arrive at once
+WAIT_SLICE = 0.1  # seconds a throttled transfer sleeps before checking for a stop
+
+
+class BufferPool:
+    """
+    A fixed set of reusable buffers.
+    get() blocks while every buffer is in use, which also limits how far the network
+    side can run ahead of the disk.
+    """
+
+    def __init__(self, count: int = RING_SIZE + 2, size: int = BUFFER_SIZE) -> None:
+        self.size = size
+        self.buffers = queue.Queue()
+        for _ in range(count):
+            self.buffers.put(bytearray(size))
+
+    def get(self) -> bytearray:
+        return self.buffers.get()
+
+    def put(self, buffer: bytearray) -> None:
+        self.buffers.put(buffer)
+
+
+class BandwidthLimiter:
+    """
+    Caps the combined rate of every transfer that reports to it (a token bucket
+    over bytes). Transfers report what they received and sleep while the bucket is
+    in debt. The rate can be changed while transfers run; 0 means no cap.
+    """
+
+    def __init__(self, rate: float = 0) -> None:
+        self.rate = rate
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.tokens + (now - self.last) * self.rate, self.rate * BURST_SECONDS)
+        self.last = now
+
+    def set_rate(self, rate: float) -> None:
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(rate, 0)
+            if self.rate == 0:
+                self.tokens = 0.0
+
+    def consume(self, size: int, should_stop=None) -> None:
+        """
+        Takes `size` bytes from the bucket and sleeps until it is out of debt.
+        Args:
+            should_stop (callable): The wait ends early once it returns True.
+        """
+        if self.rate <= 0:
+            return
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= size
+        while True:
+            with self.lock:
+                if self.rate <= 0:
+                    return
+                self._refill(time.monotonic())
+                if self.tokens >= 0:
+                    return
+                wait = -self.tokens / self.rate
+            if should_stop is not None and should_stop():
+                return
+            time.sleep(min(wait, WAIT_SLICE))
+
+
+def iter_readinto(response, pool: BufferPool):
+    """
+    Reads a streamed response into pooled buffers.
+    The socket data is read with readinto() straight into the buffers, so no new
+    bytes object is created per chunk. Each yielded buffer belongs to the caller until
+    it is handed to a RingWriter or put back into the pool.
+    Args:
+        response (requests.Response): A response opened with stream=True.
+        pool (BufferPool): The pool to take buffers from.
+    Yields:
+        tuple: (buffer, size) where buffer[:size] holds the data.
+    """
+    raw = response.raw
+    fp = getattr(raw, "_fp", None)
+    if fp is None or response.headers.get("Content-Encoding", "identity") != "identity":
+        # Compressed bodies have to go through urllib3 to be decoded
+        fp = raw
+
+    while True:
+        buffer = pool.get()
+        try:
+            size = fp.readinto(buffer)
+        except (AttributeError, ValueError) as e:
+            pool.put(buffer)
+            if not getattr(fp, "closed", False):
+                raise
+            # The response was closed from another thread (e.g. by the watchdog)
+            raise ConnectionAbortedError("Response closed while reading") from e
+        except BaseException:
+            pool.put(buffer)
+            raise
+        if not size:
+            pool.put(buffer)
+            return
+        yield buffer, size
+
+
+def release_response(response) -> None:
+    """
+    Closes a streamed response read with iter_readinto. When its body was read to
+    the end, the connection goes back to the pool for the next request instead of
+    being closed (requests only does so for bodies it read itself).
+    """
+    raw = response.raw
+    fp = getattr(raw, "_fp", None)
+    # http.client counts `length` down to 0 only for a complete body
+    if getattr(fp, "length", None) == 0 and hasattr(raw, "release_conn"):
+        raw.release_conn()
+    response.close()
+
+
+class RingWriter:
+    """
+    Writes filled buffers to a file from a dedicated thread.
+    Buffers are passed through a bounded queue, so a slow disk only blocks the reader
+    once the ring is full, and returned to the pool after being written.
+    Used as a context manager; leaving it drains the ring, then raises any write error.
+    """
+
+    def __init__(self, path: str, pool: BufferPool, ring_size: int = RING_SIZE, sync: bool = False) -> None:
+        self.path = path
+        self.pool = pool
+        self.sync = sync
+        self.ring = queue.Queue(maxsize=ring_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "RingWriter":
+        self.file = open(self.path, "ab", buffering=0)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.ring.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.error is not None and exc_type is None:
+            raise self.error
+
+    def write(self, buffer: bytearray, size: int) -> None:
+        """
+        Queues buffer[:size] for writing. The buffer must not be used afterwards.
+        """
+        if self.error is not None:
+            self.pool.put(buffer)
+            raise self.error
+        self.ring.put((buffer, size))
+
+    def _run(self) -> None:
+        unsynced = 0
+        while True:
+            item = self.ring.get()
+            if item is None:
+                break
+            buffer, size = item
+            try:
+                if self.error is None:
+                    view = memoryview(buffer)[:size]
+                    while view:
+                        written = self.file.write(view)
+                        view = view[written:]
+                    unsynced += size
+                    if self.sync and unsynced >= SYNC_BYTES:
+                        os.fsync(self.file.fileno())
+                        unsynced = 0
+            except OSError as e:
+                self.error = e
+            finally:
+                self.pool.put(buffer)
+
+        if self.sync and unsynced and self.error is None:
+            try:
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                self.error = e
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import logging
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from helper.lazy_import import lazy_import
+from helper.watchdog import CONNECT_TIMEOUT
+
+requests = lazy_import("requests")
+
+DNS_TTL = 300  # seconds a resolved address is reused
+POOL_SIZE = 64  # idle connections kept per host by the shared adapter of a helper
+
+
+class DNSCache:
+    """
+    Caches name resolution for `ttl` seconds, so the sessions of a batch (a new
+    one per episode) and its reconnects do not resolve the same hosts again.
+    Once installed it answers every socket.getaddrinfo call of the process, which
+    covers requests (urllib3) and the HTTP/2 client alike.
+
+    When the resolver fails, an expired answer is used rather than none; failures
+    themselves are never cached.
+    """
+
+    def __init__(self, ttl: float = DNS_TTL, logger: logging = logging) -> None:
+        self.ttl = ttl
+        self.logger = logger
+        self.resolver = socket.getaddrinfo
+        # (host, port, family, type, proto, flags) -> (expiry, addresses)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return list(entry[1])
+        try:
+            addresses = self.resolver(host, port, family, type, proto, flags)
+        except socket.gaierror as e:
+            if entry is None:
+                raise
+            self.logger.debug("Resolving %s failed (%s), using the expired answer", host, e)
+            return list(entry[1])
+        with self.lock:
+            self.entries[key] = (now + self.ttl, addresses)
+            self.misses += 1
+        return list(addresses)
+
+    def install(self) -> DNSCache:
+        if socket.getaddrinfo != self.getaddrinfo:
+            self.resolver = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+        return self
+
+    def uninstall(self) -> None:
+        if socket.getaddrinfo == self.getaddrinfo:
+            socket.getaddrinfo = self.resolver
+
+
+_dns_cache = None
+_dns_cache_lock = threading.Lock()
+
+
+def install_dns_cache(ttl: float = DNS_TTL, logger: logging = logging) -> DNSCache:
+    """
+    Installs the DNSCache of this process, once. Later calls change its TTL.
+    Returns:
+        DNSCache: The installed cache.
+    """
+    global _dns_cache
+    with _dns_cache_lock:
+        if _dns_cache is None:
+            _dns_cache = DNSCache(ttl, logger).install()
+        _dns_cache.ttl = ttl
+        return _dns_cache
+
+
+def connection_pool(session: requests.Session, url: str):
+    """
+    Returns the urllib3 pool `session` sends requests for `url` through, with the
+    same TLS and proxy settings, or None when the adapter has no pools.
+    """
+    adapter = session.get_adapter(url)
+    settings = session.merge_environment_settings(url, {}, None, None, None)
+    if hasattr(adapter, "get_connection_with_tls_context"):
+        request = requests.Request("GET", url).prepare()
+        return adapter.get_connection_with_tls_context(
+            request, settings["verify"], settings["proxies"], settings["cert"]
+        )
+    if hasattr(adapter, "get_connection"):
+        return adapter.get_connection(url, settings["proxies"])
+    return None
+
+
+def read_tickets(sock, wait: float) -> bool:
+    """
+    Reads the session tickets a TLS 1.3 server sends after the handshake. Left
+    unread on an idle connection, they make the pool take it for closed by the
+    server and open a new one. Waits up to `wait` seconds for them.
+    Returns:
+        bool: False if the server sent anything else or closed the connection.
+    """
+    if not isinstance(sock, ssl.SSLSocket):
+        return True
+    timeout = sock.gettimeout()
+    sock.settimeout(wait)
+    try:
+        sock.recv(1)
+    except (socket.timeout, ssl.SSLWantReadError):
+        # Nothing but the tickets
+        return True
+    finally:
+        sock.settimeout(timeout)
+    return False
+
+
+def warm_connections(session: requests.Session, url: str, count: int, logger: logging = logging) -> int:
+    """
+    Opens up to `count` connections (TCP and TLS) to the host of `url` and leaves
+    them idle in the pool of `session`'s adapter. Sessions sharing that adapter
+    then send their first requests without a handshake. Connections already open
+    in the pool count towards `count`.
+    Returns:
+        int: The number of connections opened.
+    """
+    pool = connection_pool(session, url)
+    if pool is None:
+        return 0
+    # Connections returned to a full pool are closed
+    count = min(count, pool.pool.maxsize)
+    connections = [pool._get_conn() for _ in range(count)]
+    new = [conn for conn in connections if getattr(conn, "sock", None) is None]
+
+    def connect(conn):
+        conn.timeout = CONNECT_TIMEOUT
+        try:
+            start = time.monotonic()
+            conn.connect()
+            # The tickets follow the handshake about one round trip later
+            if read_tickets(conn.sock, time.monotonic() - start):
+                return True
+            conn.close()
+            return False
+        except Exception as e:
+            # OSError, or urllib3's wrapper of it
+            logger.debug("Warming a connection to %s failed: %s", url, e)
+            conn.close()
+            return False
+
+    try:
+        if len(new) > 1:
+            with ThreadPoolExecutor(max_workers=len(new)) as executor:
+                opened = sum(executor.map(connect, new))
+        else:
+            opened = sum(map(connect, new))
+    finally:
+        for conn in connections:
+            pool._put_conn(conn)
+    return opened
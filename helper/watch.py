@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from helper.anime1_fetch import DownloadHelper, HEADERS, parse_video_page
+from helper.lazy_import import lazy_import
+
+requests = lazy_import("requests")
+
+WATCH_STATE_PATH = "watch.json"
+MIN_INTERVAL = 30 * 60  # seconds between two polls of a series that just changed
+MAX_INTERVAL = 12 * 60 * 60  # seconds, upper bound for series that stay unchanged
+BACKOFF = 1.5  # interval growth after a poll without new episodes
+JITTER = 0.2  # +/- fraction added to every interval
+MAX_POLLS_PER_CYCLE = 5  # series polled per scheduler tick
+TICK = 60  # seconds between scheduler ticks
+
+
+class SeriesWatcher:
+    """
+    Keeps followed series up to date by polling only their first page.
+    Every series has its own next poll time: series without new episodes back off up
+    to MAX_INTERVAL, and every interval is jittered, so many followed series spread
+    out to a few conditional requests per tick. New episodes are diffed against the
+    episodes already seen and the files already in the library, and only those are
+    downloaded.
+    """
+
+    def __init__(
+        self,
+        download_helper: DownloadHelper,
+        state_path: str = WATCH_STATE_PATH,
+        interval: int = MIN_INTERVAL,
+        max_workers: int = 4,
+        logger: logging = logging,
+    ) -> None:
+        self.download_helper = download_helper
+        self.state_path = state_path
+        self.interval = interval
+        self.max_workers = max_workers
+        self.logger = logger
+
+        # Shares the helper's connection pool, DNS cache and host health
+        self.session = download_helper.new_session()
+        self.lock = threading.Lock()
+        self.state = self.load_state()
+
+    # ----------------- State -----------------
+    def load_state(self) -> dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"series": {}}
+
+    def save_state(self) -> None:
+        temp_path = f"{self.state_path}.tmp"
+        with self.lock:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, ensure_ascii=False)
+            os.replace(temp_path, self.state_path)
+
+    @staticmethod
+    def key(url: str) -> str:
+        return url.split("/page")[0].rstrip("/")
+
+    def follow(self, url: str) -> None:
+        url = self.key(url)
+        series = self.state["series"].setdefault(url, {"known": []})
+        series.setdefault("interval", self.interval)
+        # Spread the first polls over one interval instead of polling everything at once
+        series.setdefault("next_poll", time.time() + random.uniform(0, min(self.interval, TICK * 5)))
+
+    def unfollow(self, url: str) -> None:
+        self.state["series"].pop(self.key(url), None)
+
+    def retain(self, urls: list) -> None:
+        """
+        Drops the state of every series not in `urls` (the followed series in the config).
+        """
+        keep = {self.key(url) for url in urls}
+        for url in [url for url in self.state["series"] if url not in keep]:
+            self.logger.debug("No longer following %s", url)
+            del self.state["series"][url]
+
+    # ----------------- Polling -----------------
+    def in_library(self, title: str, name: str) -> bool:
+        folder = f"{self.download_helper.download_path}/{title}"
+        for extension in ("mp4", "ts"):
+            path = DownloadHelper.check_filename(folder, name, extension)
+            if self.download_helper.storage.exists(path):
+                return True
+        return False
+
+    def poll(self, url: str) -> dict:
+        """
+        Fetches the first page of a series with a conditional request.
+        Returns:
+            dict: The page data restricted to the new episodes (see get_video_data_me),
+            or None if nothing changed.
+        """
+        series = self.state["series"][url]
+        header = HEADERS.copy()
+        if series.get("etag"):
+            header["If-None-Match"] = series["etag"]
+        if series.get("last_modified"):
+            header["If-Modified-Since"] = series["last_modified"]
+
+        response = self.session.get(url, headers=header, timeout=10)
+        if response.status_code == 304:
+            self.logger.debug("Not modified: %s", url)
+            return None
+        response.raise_for_status()
+
+        # The validators are only kept once every new episode is downloaded, so
+        # failed episodes are retried on the next poll
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "digest": hashlib.sha1(response.content).hexdigest(),
+        }
+        if validators["digest"] == series.get("digest"):
+            # Server ignores conditional requests, the page is still the same
+            return None
+
+        page = parse_video_page(response.content, url, self.logger)
+        if page is None:
+            return None
+
+        title = page["title"].replace("/", "-")
+        series["title"] = title
+        known = set(series["known"])
+        new_names = [
+            name
+            for name in page["names"]
+            if name not in known and not self.in_library(title, name)
+        ]
+        # Episodes already on disk count as seen
+        series["known"] = sorted(known | (set(page["names"]) - set(new_names)))
+        if not new_names:
+            series.update(validators)
+            return None
+        series["validators"] = validators
+
+        return {
+            "title": title,
+            "total episode": len(new_names),
+            "names": new_names,
+            "data": {name: page["data"][name] for name in new_names},
+        }
+
+    def reschedule(self, url: str, changed: bool) -> None:
+        series = self.state["series"][url]
+        if changed:
+            interval = self.interval
+        else:
+            interval = min(series.get("interval", self.interval) * BACKOFF, MAX_INTERVAL)
+        series["interval"] = interval
+        series["next_poll"] = time.time() + interval * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def download(self, data: dict, url: str, polled: list = None) -> None:
+        """
+        Downloads the given episodes and marks the successful ones as known.
+        Args:
+            polled (list): Every new episode the poll returned, when only some of them
+                are downloaded. The page validators are only kept once all of these
+                are known, so the others are found again by the next poll.
+        """
+        self.logger.info("%s: %s new episode(s)", data["title"], len(data["names"]))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.download_helper.download_episode, name, data): name
+                for name in data["names"]
+            }
+            for future, name in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    self.logger.error("Error downloading episode %s: %s", name, e)
+
+        series = self.state["series"].get(url)
+        if series is None:
+            return
+        done = [
+            name
+            for name in data["names"]
+            if self.download_helper.process.get(name, {}).get("success")
+        ]
+        series["known"] = sorted(set(series["known"]) | set(done))
+        validators = series.pop("validators", None)
+        if validators and set(polled or data["names"]) <= set(series["known"]):
+            series.update(validators)
+
+    def check(self, url: str, latest_only: bool = False) -> int:
+        """
+        Polls one series now and downloads its new episodes.
+        A series that is not followed is only checked once, it is not added to the
+        watched series.
+        Args:
+            url (str): The category URL of the series.
+            latest_only (bool): Only download the newest new episode.
+        Returns:
+            int: The number of new episodes queued.
+        """
+        url = self.key(url)
+        followed = url in self.state["series"]
+        self.follow(url)
+        try:
+            data = self.poll(url)
+        except requests.RequestException as e:
+            self.logger.error("Error polling %s: %s", url, e)
+            data = None
+        self.reschedule(url, data is not None)
+        if data:
+            polled = data["names"]
+            if latest_only:
+                data["names"] = polled[-1:]
+            self.download(data, url, polled)
+        if not followed:
+            self.unfollow(url)
+        self.save_state()
+        return len(data["names"]) if data else 0
+
+    def run(self, stop_flag: threading.Event) -> None:
+        """
+        Polls due series until stop_flag is set.
+        At most MAX_POLLS_PER_CYCLE series are polled per tick, the rest wait for the
+        next tick.
+        """
+        self.logger.info("Watching %s series", len(self.state["series"]))
+        while not stop_flag.is_set():
+            now = time.time()
+            due = heapq.nsmallest(
+                MAX_POLLS_PER_CYCLE,
+                (
+                    (series.get("next_poll", 0), url)
+                    for url, series in self.state["series"].items()
+                    if series.get("next_poll", 0) <= now
+                ),
+            )
+            for _, url in due:
+                if stop_flag.is_set():
+                    break
+                self.check(url)
+
+            if due:
+                self.logger.debug("Polled %s series", len(due))
+            if len(due) == MAX_POLLS_PER_CYCLE:
+                # More may be due, but they wait for the next tick
+                stop_flag.wait(TICK)
+                continue
+            next_poll = min(
+                (series.get("next_poll", now) for series in self.state["series"].values()),
+                default=now + TICK,
+            )
+            stop_flag.wait(min(max(next_poll - time.time(), 1), TICK))
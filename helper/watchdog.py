@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import logging
+import socket
+import threading
+import time
+
+from helper.lazy_import import lazy_import
+
+requests = lazy_import("requests")
+
+CONNECT_TIMEOUT = 10  # seconds
+READ_TIMEOUT = 60  # seconds, last resort when the watchdog cannot recover a transfer
+STALL_TIMEOUT = 10  # seconds without any byte before a transfer counts as stalled
+MIN_RATE = 16 * 1024  # bytes/s, below this for RATE_WINDOW the transfer counts as stalled
+RATE_WINDOW = 15  # seconds
+CHECK_INTERVAL = 0.5  # seconds between two watchdog checks
+
+
+def abort_response(response) -> None:
+    """
+    Closes a streamed response from another thread.
+    Closing the file object alone does not wake a thread blocked in recv(), so the
+    socket is shut down first.
+    """
+    try:
+        connection = getattr(response.raw, "_connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+    except (OSError, AttributeError):
+        pass
+    try:
+        response.close()
+    except Exception:
+        pass
+
+
+class Transfer:
+    """
+    State of one watched transfer, shared between the download thread and the watchdog.
+    """
+
+    def __init__(self, _id, response, offset: int, open_hedge) -> None:
+        self._id = _id
+        self.response = response
+        self.offset = offset
+        self.open_hedge = open_hedge
+
+        now = time.monotonic()
+        self.last_progress = now
+        self.window_start = now
+        self.window_offset = offset
+        self.stalled_at = None
+        self.hedging = False
+        self.replacement = None
+        # Set while the download thread waits on the bandwidth cap
+        self.throttled = False
+        self.lock = threading.Lock()
+
+    def progress(self, size: int) -> bool:
+        """
+        Accounts for a received chunk before it is written.
+        Returns:
+            bool: False if a hedged response has taken over, the chunk must then be dropped.
+        """
+        with self.lock:
+            if self.replacement is not None:
+                return False
+            self.offset += size
+            self.last_progress = time.monotonic()
+            return True
+
+    def abort(self) -> None:
+        """
+        Closes the connection of this transfer (and of a pending hedge) from another
+        thread, so a read blocked on it returns at once.
+        """
+        with self.lock:
+            responses = [self.response, self.replacement]
+        for response in responses:
+            if response is not None:
+                abort_response(response)
+
+    def take_replacement(self):
+        """
+        Returns the hedged response that replaced the current one, if any.
+        """
+        with self.lock:
+            replacement, self.replacement = self.replacement, None
+            if replacement is not None:
+                self.response = replacement
+                self.last_progress = self.window_start = time.monotonic()
+                self.window_offset = self.offset
+            return replacement
+
+
+class StallWatchdog:
+    """
+    Watches the throughput of all running transfers from a single thread.
+    When a transfer receives nothing for STALL_TIMEOUT, or less than MIN_RATE over
+    RATE_WINDOW, a hedged request is opened from the current offset. If the hedge
+    delivers its response before the original transfer makes progress again, the
+    original connection is aborted and the download continues on the hedge,
+    otherwise the hedge is dropped.
+    """
+
+    def __init__(self, logger: logging = logging) -> None:
+        self.logger = logger
+        self.transfers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+        self.stats = {"stalls": 0, "hedges": 0, "hedges_won": 0, "recovered_time": 0.0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key: str, amount=1) -> None:
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def summary(self) -> str:
+        """
+        Returns a one-line report of the stalls so far, or "" if there was none.
+        """
+        with self.stats_lock:
+            stats = dict(self.stats)
+        if not stats["stalls"]:
+            return ""
+        return (
+            f"Stalls: {stats['stalls']}, hedged requests: {stats['hedges']} "
+            f"({stats['hedges_won']} took over), recovered ~{stats['recovered_time']:.1f} seconds"
+        )
+
+    def watch(self, _id, response, offset: int, open_hedge) -> Transfer:
+        """
+        Starts watching a transfer.
+        Args:
+            _id: The ID of the episode.
+            response (requests.Response): The streamed response being read.
+            offset (int): The file offset the response starts at.
+            open_hedge (callable): open_hedge(offset) opens a new streamed response from `offset`.
+        Returns:
+            Transfer: The watched transfer, to be passed to unwatch() when done.
+        """
+        transfer = Transfer(_id, response, offset, open_hedge)
+        with self.lock:
+            self.transfers.add(transfer)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return transfer
+
+    def unwatch(self, transfer: Transfer) -> None:
+        with self.lock:
+            self.transfers.discard(transfer)
+        with transfer.lock:
+            if transfer.replacement is not None:
+                transfer.replacement.close()
+                transfer.replacement = None
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            with self.lock:
+                if not self.transfers:
+                    self.thread = None
+                    return
+                transfers = list(self.transfers)
+            now = time.monotonic()
+            for transfer in transfers:
+                self._check(transfer, now)
+
+    def _check(self, transfer: Transfer, now: float) -> None:
+        if transfer.hedging:
+            return
+        if transfer.throttled:
+            # Held back by the bandwidth cap, not by the server
+            transfer.last_progress = now
+            transfer.window_start, transfer.window_offset = now, transfer.offset
+            return
+        if transfer.stalled_at is not None and now - transfer.stalled_at < STALL_TIMEOUT:
+            # Give the last hedge (or the recovered transfer) some time
+            return
+
+        stalled = now - transfer.last_progress >= STALL_TIMEOUT
+        if now - transfer.window_start >= RATE_WINDOW:
+            rate = (transfer.offset - transfer.window_offset) / (now - transfer.window_start)
+            stalled = stalled or rate < MIN_RATE
+            transfer.window_start, transfer.window_offset = now, transfer.offset
+
+        if not stalled:
+            return
+
+        self.count("stalls")
+        transfer.stalled_at = now
+        transfer.hedging = True
+        self.logger.debug("%3s | Transfer stalled at %s, hedging", transfer._id, transfer.offset)
+        threading.Thread(target=self._hedge, args=(transfer,), daemon=True).start()
+
+    def _hedge(self, transfer: Transfer) -> None:
+        offset = transfer.offset
+        last_progress = transfer.last_progress
+        self.count("hedges")
+        try:
+            hedge = transfer.open_hedge(offset)
+        except requests.RequestException as e:
+            self.logger.debug("%3s | Hedged request failed: %s", transfer._id, e)
+            transfer.hedging = False
+            return
+
+        with transfer.lock:
+            if hedge is None or transfer.offset != offset or transfer not in self.transfers:
+                # The original transfer recovered (or finished) first
+                if hedge is not None:
+                    hedge.close()
+                transfer.hedging = False
+                return
+
+            transfer.replacement = hedge
+            original = transfer.response
+
+        now = time.monotonic()
+        recovered = max(0.0, last_progress + READ_TIMEOUT - now)
+        self.count("hedges_won")
+        self.count("recovered_time", recovered)
+        self.logger.info(
+            "%3s | Hedged request took over at %s (saved ~%.1fs)", transfer._id, offset, recovered
+        )
+        abort_response(original)
+        transfer.hedging = False